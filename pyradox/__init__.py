@@ -1,6 +1,6 @@
-from pyradox.datatype import Color, Time, Tree
-from pyradox.filetype import csv, json, table, txt, yml
-from pyradox.filetype.txt import parse, parse_file, parse_dir, parse_merge
+from pyradox.datatype import Color, History, Time, Tree
+from pyradox.filetype import binary, csv, json, table, txt, yml
+from pyradox.filetype.txt import parse, parse_file, parse_dir, parse_merge, iterparse
 from pyradox.filetype.yml import get_localisation
 
 from pyradox.config import get_language, get_game_from_path, get_game_directory
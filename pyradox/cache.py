@@ -0,0 +1,198 @@
+import pyradox.config
+
+import contextlib
+import gc
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+"""
+Persistent cache of parsed files.
+Disabled unless pyradox.config.cache_directory is set, in which case the parse_file functions of each file type store their results there.
+Each entry is the pickled result of parsing a file, and is keyed by the file's path, size and modification time,
+the parse options, and cache_version. Once the cache exceeds pyradox.config.cache_size_limit bytes,
+the least recently used entries are removed.
+Other data may be cached in subdirectories (e.g. by pyradox.worldmap), where each directory is an entry of several files.
+These are counted towards the size limit and removed in the same way; see stored_directory and mark_used.
+"""
+
+# Increase whenever a parser change affects its results, so that stale entries are not used.
+cache_version = 2
+
+# Total size of the entries in each cache directory, computed on first use.
+_directory_sizes = {}
+
+def is_enabled():
+    return pyradox.config.cache_directory is not None
+
+def cached(path, options, parse_function, *args, **kwargs):
+    """
+    Returns parse_function(*args, **kwargs), the result of parsing the file at path, using the cache if it is enabled.
+    options: A tuple of anything else the result depends on (e.g. the file type and encodings). Must have a consistent repr.
+    """
+    entry_path = _entry_path(path, options)
+    if entry_path is None:
+        return parse_function(*args, **kwargs)
+
+    result = _load(entry_path)
+    if result is None:
+        result = parse_function(*args, **kwargs)
+        _store(entry_path, result)
+    return result
+
+def load(path, options):
+    """Returns the cached result for the file, or None if there is none (or the cache is disabled)."""
+    entry_path = _entry_path(path, options)
+    if entry_path is None: return None
+    return _load(entry_path)
+
+def stored_directory(entry_directory):
+    """Counts an entry directory just stored within a subdirectory of the cache towards the size limit."""
+    _add_size(os.path.dirname(os.path.dirname(entry_directory)), _directory_size(entry_directory))
+
+def mark_used(entry_path):
+    """Marks an entry (a file or an entry directory) as recently used, so it is removed after less recently used ones."""
+    try:
+        os.utime(entry_path)
+    except OSError:
+        pass
+
+def clear():
+    """Removes all entries from the cache, including subdirectories."""
+    if not is_enabled(): return
+    directory = pyradox.config.cache_directory
+    for mtime, size, entry_path in _entries(directory):
+        _remove(entry_path)
+    try:
+        subdirectories = [entry.path for entry in os.scandir(directory) if entry.is_dir()]
+    except OSError:
+        subdirectories = []
+    for subdirectory in subdirectories:
+        shutil.rmtree(subdirectory, ignore_errors = True)
+    _directory_sizes[directory] = 0
+
+def _entry_path(path, options):
+    if not is_enabled(): return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = repr((cache_version, os.path.abspath(path), stat.st_size, stat.st_mtime_ns, options))
+    filename = hashlib.sha1(key.encode('utf_8')).hexdigest() + '.pickle'
+    return os.path.join(pyradox.config.cache_directory, filename)
+
+def _load(entry_path):
+    try:
+        with open(entry_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    try:
+        with gc_paused():
+            result = pickle.loads(data)
+    except Exception:
+        # Corrupt, or written by an incompatible version.
+        _remove(entry_path)
+        return None
+
+    mark_used(entry_path)
+    return result
+
+def _store(entry_path, result):
+    directory = os.path.dirname(entry_path)
+    os.makedirs(directory, exist_ok = True)
+    with gc_paused():
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+
+    # Write to a temporary file first so that other processes never see a partial entry.
+    fd, temp_path = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, entry_path)
+    except OSError:
+        _remove(temp_path)
+        return
+
+    _add_size(directory, len(data))
+
+def _add_size(directory, size):
+    """Counts size more bytes of entries in the cache at directory, removing entries if it is over the size limit."""
+    if directory not in _directory_sizes:
+        # Includes the entry just stored.
+        _directory_sizes[directory] = sum(entry_size for mtime, entry_size, entry_path in _entries(directory))
+    else:
+        _directory_sizes[directory] += size
+    if _directory_sizes[directory] > pyradox.config.cache_size_limit:
+        _evict(directory)
+
+def _evict(directory):
+    """Removes least recently used entries until the cache is at most three quarters of the size limit."""
+    entries = sorted(_entries(directory))
+
+    size = sum(entry_size for mtime, entry_size, entry_path in entries)
+    target = pyradox.config.cache_size_limit * 3 // 4
+    for mtime, entry_size, entry_path in entries:
+        if size <= target: break
+        _remove(entry_path)
+        size -= entry_size
+    _directory_sizes[directory] = size
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Pauses the cyclic garbage collector.
+    Lexing, parsing, pickling and unpickling Trees allocate a great many objects but create no reference cycles,
+    so the collector only slows them down (unpickling by several times).
+    """
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_was_enabled: gc.enable()
+
+def _entries(directory):
+    """
+    Returns (modification time, size, path) of each entry in the cache at directory:
+    the .pickle files in it, and the directories within its subdirectories, except those still being written.
+    """
+    result = []
+    try:
+        children = list(os.scandir(directory))
+    except OSError:
+        return result
+    for child in children:
+        try:
+            if child.name.endswith('.pickle'):
+                stat = child.stat()
+                result.append((stat.st_mtime_ns, stat.st_size, child.path))
+            elif child.is_dir():
+                for entry in os.scandir(child.path):
+                    if entry.is_dir() and not entry.name.endswith('.tmp'):
+                        result.append((entry.stat().st_mtime_ns, _directory_size(entry.path), entry.path))
+        except OSError:
+            continue
+    return result
+
+def _directory_size(path):
+    """Returns the total size of the files in an entry directory."""
+    size = 0
+    try:
+        for entry in os.scandir(path):
+            if entry.is_file(): size += entry.stat().st_size
+    except OSError:
+        pass
+    return size
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors = True)
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
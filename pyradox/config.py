@@ -4,6 +4,16 @@ from glob import glob
 
 language = 'english'
 
+# Directory in which to cache parsed files and province map data (see pyradox.cache), or None to disable caching.
+cache_directory = None
+# Once the cache exceeds this many bytes, the least recently used entries are removed.
+cache_size_limit = 1 << 30
+
+# Whether the lexers intern unquoted str tokens, and pyradox.token.make_string quoted strings that are identifiers (see sys.intern).
+# Game files repeat the same keys and values many times, so this saves memory and speeds up key comparisons.
+# Interned strings are never freed on Python 3.12 and later, so free text and other tokens are not interned.
+intern_strings = True
+
 # If you know the location of your games but it is not being found automatically, add it to the top of this list.
 # Uses glob, but not recursively (no **).
 prefixes = [
@@ -1,3 +1,4 @@
 from pyradox.datatype.color import Color
 from pyradox.datatype.time import Time
 from pyradox.datatype.tree import Tree
+from pyradox.datatype.history import History
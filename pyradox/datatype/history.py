@@ -0,0 +1,81 @@
+import pyradox.datatype.time
+import pyradox.datatype.tree
+
+import bisect
+import collections
+
+class History():
+    """
+    The state of a history Tree (e.g. a country, state or province history) over time, for taking it at many dates.
+    Equivalent to calling tree.at_time for each date, except that the date blocks are applied in date order
+    (keeping file order for equal dates) rather than file order. These are the same for files whose dates are in order.
+
+    The date blocks are sorted once. Each state is built from the latest state already computed before it,
+    merging only the blocks in between; states share their unchanged subtrees.
+    The most recently used _state_cache_length states are kept for later use, besides the state with no date blocks.
+    The tree should not be modified while the History is in use.
+    """
+
+    _state_cache_length = 16
+
+    def __init__(self, tree, merge_levels = -1):
+        """merge_levels: As at_time."""
+        self.merge_levels = merge_levels
+
+        base = pyradox.datatype.tree.Tree()
+        blocks = []
+        for key, value in tree.items():
+            if isinstance(key, pyradox.datatype.time.Time):
+                blocks.append((key, value))
+            else:
+                base.append(key, pyradox.datatype.tree._copy_value(value))
+        blocks.sort(key = lambda block: block[0])
+
+        self.dates = [date for date, value in blocks]
+        self._blocks = [value for date, value in blocks]
+
+        self._base = base
+        # Recently used states by the number of blocks applied, least recently used first.
+        self._states = collections.OrderedDict()
+
+    def snapshot(self, time = True):
+        """
+        Returns a Tree of the non-date items with all date blocks at or before time merged in, as at_time.
+        if time is True, use all date blocks.
+        if time is False, use no date blocks.
+        The result may be modified freely.
+        """
+        return self._state(self._count(time))._copy()
+
+    def snapshots(self, times = None):
+        """
+        Iterates over (time, snapshot) for each of times in turn, by default each date on which there is a date block.
+        Each snapshot applies only the blocks since the previous one if times are in order.
+        """
+        if times is None: times = [date for i, date in enumerate(self.dates) if i == 0 or date != self.dates[i - 1]]
+        for time in times:
+            yield time, self.snapshot(time)
+
+    def _count(self, time):
+        """Returns the number of date blocks at or before time."""
+        if time is True: return len(self.dates)
+        elif time is False: return 0
+        return bisect.bisect_right(self.dates, pyradox.datatype.time.Time(time))
+
+    def _state(self, count):
+        """Returns the state with the first count date blocks applied, which should not be modified."""
+        if count == 0: return self._base
+        state = self._states.get(count)
+        if state is not None:
+            self._states.move_to_end(count)
+            return state
+
+        # Continue from the latest state before it.
+        previous_count = max((state_count for state_count in self._states if state_count < count), default = 0)
+        state = self._state(previous_count)._copy()
+        for block in self._blocks[previous_count:count]:
+            state.merge(block, merge_levels = self.merge_levels)
+
+        self._states[count] = state
+        if len(self._states) > History._state_cache_length: self._states.popitem(last = False)
+        return state
@@ -0,0 +1,272 @@
+from pyradox.error import *
+import pyradox.datatype.color
+import pyradox.datatype.time
+import pyradox.datatype.tree
+import pyradox.datatype.util
+import pyradox.token
+
+import fnmatch
+import functools
+import operator
+import re
+
+"""
+Path queries over Trees, e.g. tree.select('state/*/history/buildings/#int/naval_base').
+
+A query is a sequence of steps separated by '/'. Each step selects items of the Trees selected by the previous step
+(the first step selects items of the Trees being queried). Values of intermediate steps that are not Trees are skipped.
+Steps:
+    key: Items with that key, matched non-case-sensitive as tree[key]. May be quoted, e.g. "a/b".
+        Unquoted keys are converted as the parser does, so 1936.1.1 matches Time keys and 123 matches int keys.
+    *: Any item.
+    pattern: A key containing * or ? matches as fnmatch against the key as a string, e.g. add_* or 1936.*.
+    #type: Items whose key has that type. Types are int, float, number, bool, str, time (or date), color and tree.
+    **: Zero or more levels of Trees, e.g. **/naval_base finds naval_base at any depth.
+Each step may be followed by predicates in brackets, all of which must hold for the item's value:
+    [#type]: The value has that type.
+    [key]: The value is a Tree containing key.
+    [key op literal]: The value is a Tree, and value[key] op literal holds. op is one of = != < > <= >=.
+    [op literal]: The value itself op literal holds.
+The last step may be followed by {n}, which groups the values of successive items into tuples of length n,
+as find_all(tuple_length = n), e.g. victory_points{2}. As there, groups may span several Trees, and leftover values are dropped.
+
+Queries are compiled into a chain of iterators specialised to each step. The most recently used compiled queries are cached by their text,
+so repeated queries, such as the same query over each of many Trees, are only compiled once.
+"""
+
+_quoted_pattern = r'"(?:[^"\\]|\\.)*"'
+
+_step_pattern = re.compile(r'''
+    \s*(?P<selector>%s|[^/\[\]{}"\s]+)\s*
+    (?P<predicates>(?:\[[^\]]*\]\s*)*)
+    (?:\{\s*(?P<tuple_length>\d+)\s*\}\s*)?
+    ''' % _quoted_pattern, re.VERBOSE)
+
+_predicate_pattern = re.compile(r'''
+    \[\s*(?P<key>%s|[^\]!<>="\s]*)\s*
+    (?:(?P<operator>!=|<=|>=|=|<|>)\s*(?P<value>%s|[^\]"\s]+)\s*)?\]\s*
+    ''' % (_quoted_pattern, _quoted_pattern), re.VERBOSE)
+
+def _not_bool(x_type):
+    return lambda x: isinstance(x, x_type) and not isinstance(x, bool)
+
+_type_tests = {
+    'int' : _not_bool(int),
+    'float' : _not_bool(float),
+    'number' : _not_bool((int, float)),
+    'bool' : lambda x: isinstance(x, bool),
+    'str' : lambda x: isinstance(x, str),
+    'time' : lambda x: isinstance(x, pyradox.datatype.time.Time),
+    'date' : lambda x: isinstance(x, pyradox.datatype.time.Time),
+    'color' : lambda x: isinstance(x, pyradox.datatype.color.Color),
+    'tree' : lambda x: isinstance(x, pyradox.datatype.tree.Tree),
+    }
+
+_comparisons = {
+    '=' : lambda x, spec: pyradox.datatype.util.match(x, spec),
+    '!=' : lambda x, spec: not pyradox.datatype.util.match(x, spec),
+    '<' : operator.lt,
+    '>' : operator.gt,
+    '<=' : operator.le,
+    '>=' : operator.ge,
+    }
+
+def compile_query(query):
+    """Returns the compiled Query for a query string. Queries are returned as is."""
+    if isinstance(query, Query): return query
+    return _compile(query)
+
+@functools.lru_cache(maxsize = 256)
+def _compile(query):
+    return Query(query)
+
+def select(query, *trees):
+    """Iterates over the values matching the query in each of the trees in turn."""
+    return compile_query(query).select(*trees)
+
+class Query():
+    """A compiled query. See the module documentation for the syntax."""
+
+    def __init__(self, query):
+        self.query = query
+        self.tuple_length = None
+        self._steps = []
+
+        descendants = False
+        pos = 0
+        while True:
+            m = _step_pattern.match(query, pos)
+            if m is None: self._error('Expected a step at position %d' % pos)
+            if self.tuple_length is not None: self._error('Only the last step may be grouped')
+            selector = m.group('selector')
+            predicate = self._compile_predicates(m.group('predicates'))
+            if m.group('tuple_length') is not None:
+                self.tuple_length = int(m.group('tuple_length'))
+                if self.tuple_length == 0: self._error('Tuple length must be positive')
+
+            if selector == '**':
+                if predicate is not None or self.tuple_length is not None: self._error('** cannot have predicates or be grouped')
+                descendants = True
+            else:
+                self._steps.append(self._compile_step(selector, predicate, descendants))
+                descendants = False
+
+            pos = m.end()
+            if pos == len(query): break
+            if query[pos] != '/': self._error('Expected "/" at position %d' % pos)
+            pos += 1
+
+        if descendants:
+            # Trailing **: everything below.
+            self._steps.append(self._compile_step('*', None, True))
+
+    def __repr__(self):
+        return 'Query(%r)' % self.query
+
+    def _error(self, message):
+        raise ParseError('Invalid query "%s": %s.' % (self.query, message))
+
+    def _compile_step(self, selector, predicate, descendants):
+        """Returns a function from an iterable of Trees to an iterator over (Tree, index) of the selected items."""
+        if selector.startswith('"'):
+            return _key_step(pyradox.token.make_string(selector), predicate, descendants)
+        elif selector == '*':
+            key_test = None
+        elif selector.startswith('#'):
+            key_test = _type_tests.get(selector[1:].lower())
+            if key_test is None: self._error('Unknown type "%s"' % selector[1:])
+        elif '*' in selector or '?' in selector:
+            pattern = re.compile(fnmatch.translate(selector.lower()))
+            key_test = lambda key: pattern.match(str(key).lower()) is not None
+        else:
+            return _key_step(_make_key(selector), predicate, descendants)
+
+        if descendants: return _descendants_step(key_test, predicate)
+        else: return _children_step(key_test, predicate)
+
+    def _compile_predicates(self, predicates):
+        """Returns a function which tests a value against all the predicates, or None if there are none."""
+        tests = []
+        pos = 0
+        while pos < len(predicates):
+            m = _predicate_pattern.match(predicates, pos)
+            if m is None: self._error('Invalid predicate "%s"' % predicates[pos:].strip())
+            pos = m.end()
+            key, op, value = m.group('key', 'operator', 'value')
+            if key.startswith('#'):
+                if op is not None: self._error('Type predicates cannot have an operator')
+                test = _type_tests.get(key[1:].lower())
+                if test is None: self._error('Unknown type "%s"' % key[1:])
+                tests.append(test)
+                continue
+
+            if key.startswith('"'): key = pyradox.token.make_string(key)
+            elif key: key = _make_key(key)
+            elif op is None: self._error('Empty predicate')
+            else: key = None # [op literal] tests the value itself.
+
+            if op is None:
+                tests.append(_has_key_test(key))
+            else:
+                value = pyradox.token.make_primitive(value, default_token_type = 'str')
+                tests.append(_comparison_test(key, _comparisons[op], value))
+
+        if not tests: return None
+        elif len(tests) == 1: return tests[0]
+        else: return lambda value: all(test(value) for test in tests)
+
+    def select_items(self, *trees):
+        """Iterates over (Tree, index) of the items matching the query in each of the trees in turn."""
+        steps = self._steps
+        items = steps[0](trees)
+        for step in steps[1:]:
+            items = step(_tree_values(items))
+        return items
+
+    def select(self, *trees):
+        """Iterates over the values matching the query in each of the trees in turn, or tuples of them if the query is grouped."""
+        items = self.select_items(*trees)
+        if self.tuple_length is None:
+            return (tree._values[i] for tree, i in items)
+        else:
+            return _group(items, self.tuple_length)
+
+def _make_key(key_string):
+    """Converts an unquoted key as the parser does."""
+    token_type = pyradox.token.primitive_type_of(key_string)
+    if token_type in pyradox.token.key_constructors:
+        return pyradox.token.key_constructors[token_type](key_string)
+    return key_string
+
+def _has_key_test(key):
+    return lambda value: isinstance(value, pyradox.datatype.tree.Tree) and value.contains(key)
+
+def _comparison_test(key, compare, spec):
+    def test(value):
+        if key is not None:
+            if not isinstance(value, pyradox.datatype.tree.Tree): return False
+            value = value.find(key, reverse = True)
+            if value is None: return False
+        try:
+            return compare(value, spec)
+        except TypeError:
+            # Incomparable types.
+            return False
+    return test
+
+def _key_step(key, predicate, descendants):
+    def step(trees):
+        for tree in trees:
+            for item in tree._find_all(key, recurse = descendants):
+                if predicate is None or predicate(item[0]._values[item[1]]): yield item
+    return step
+
+def _children_step(key_test, predicate):
+    def step(trees):
+        for tree in trees:
+            keys = tree._keys
+            values = tree._values
+            for i in range(len(keys)):
+                if key_test is not None and not key_test(keys[i]): continue
+                if predicate is not None and not predicate(values[i]): continue
+                yield tree, i
+    return step
+
+def _descendants_step(key_test, predicate):
+    def step(trees):
+        for tree in trees:
+            for item in _walk(tree):
+                subtree, i = item
+                if key_test is not None and not key_test(subtree._keys[i]): continue
+                if predicate is not None and not predicate(subtree._values[i]): continue
+                yield item
+    return step
+
+def _walk(tree):
+    """Iterates over (Tree, index) of every item at any depth, each item preceding the items of its value as in find_all."""
+    Tree = pyradox.datatype.tree.Tree
+    stack = [(tree, iter(range(len(tree._keys))))]
+    while stack:
+        tree, it = stack[-1]
+        i = next(it, None)
+        if i is None:
+            stack.pop()
+            continue
+        yield tree, i
+        value = tree._values[i]
+        if isinstance(value, Tree):
+            stack.append((value, iter(range(len(value._keys)))))
+
+def _tree_values(items):
+    Tree = pyradox.datatype.tree.Tree
+    for tree, i in items:
+        value = tree._values[i]
+        if isinstance(value, Tree): yield value
+
+def _group(items, tuple_length):
+    partial = []
+    for tree, i in items:
+        partial.append(tree._values[i])
+        if len(partial) >= tuple_length:
+            yield tuple(partial)
+            partial = []
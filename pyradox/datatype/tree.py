@@ -1,5 +1,6 @@
 from pyradox.error import *
 import pyradox.datatype.color
+import pyradox.datatype.query
 import pyradox.datatype.time
 import pyradox.datatype.util
 import pyradox.token
@@ -9,6 +10,7 @@ import os
 import inspect
 import copy
 import warnings
+import weakref
 
 class Tree():
     """
@@ -17,117 +19,48 @@ class Tree():
     Keys are stored with case but are matched non-case-sensitive.
     """
     
-    class _Item():
-        """
-        Internal class to keep track of items.
-        pre_comments appear before the item, one per line.
-        line_comments appear on the same line as the item.
-        """
-        def __init__(self, key, value, operator = None, in_group = False, pre_comments = None, line_comment = None):
-            #if not isinstance(key, allowable_key_types):
-            #    raise ValueError('Key %s is not of allowable type.' % key)
-                
-            self.key = key
-            self.set_value(value)
-            
-            if pre_comments is None: self.pre_comments = []
-            else: self.pre_comments = pre_comments
-            
-            self.line_comment = line_comment
-            
-            if operator is None: self.operator = '='
-            else: self.operator = operator
-            
-            self.in_group = in_group
-        
-        def set_value(self, value):
-            value = pyradox.datatype.util.to_pyradox(value)
-            #if not isinstance(value, allowable_value_types):
-            #    raise ValueError('Value %s is not of allowable type.' % value)
-            self.value = value
-
-        def prettyprint(self, level, indent_string, include_comments):
-            result = ''
-            if include_comments:
-                for pre_comment in self.pre_comments:
-                    result += '%s#%s\n' % (indent_string * level, pre_comment)
-            
-            # Output key.
-            result += '%s%s %s ' % (indent_string * level, self.key, self.operator)
-            
-            # Output value.
-            if isinstance(self.value, Tree):
-                result += '{\n'
-                result += self.value.prettyprint(level + 1)
-                result += indent_string * level + '}'
-            else:
-                result += pyradox.token.make_token_string(self.value)
-            
-            if include_comments and self.line_comment is not None:
-                result += " #%s" % (self.line_comment)
-                
-            result += '\n'
-            
-            return result
-            
-        def prettyprint_group(self, level, indent_string, include_comments):
-            """
-            Some trickiness here. Assumes that any indentation for the first line has already been performed.
-            If there are no comments and the value is not a Tree, return (value string, False), so following values may be placed on the same line.
-            Otherwise, return (string ending in newline, True).
-            """
-            result = ''
-            need_indent = False
-            has_pre_comment = False
-            if include_comments:
-                for pre_comment in self.pre_comments:
-                    has_pre_comment = True
-                    result += '\n%s#%s' % (indent_string * level, pre_comment)
-            
-            if has_pre_comment or isinstance(self.value, Tree):
-                result += '\n%s' % (indent_string * level)
-            
-            # Output value.
-            if isinstance(self.value, Tree):
-                need_indent = True
-                result += '{\n'
-                result += self.value.prettyprint(level + 1)
-                result += indent_string * level + '}'
-            else:
-                result += pyradox.token.make_token_string(self.value) + ' '
-            
-            if include_comments and self.line_comment is not None:
-                need_indent = True
-                result += "#%s" % (self.line_comment)
-            
-            if need_indent:
-                result += '\n'
-            
-            return result, need_indent
-            
+    # Items are stored column-wise, since a parsed file has very many small Trees whose items mostly have no comments,
+    # operator '=' and no group:
+    #   _keys, _values: Lists with one entry per item.
+    #   _operators: None if all operators are '=', otherwise a list with one entry per item.
+    #   _groups: None if no items are in groups, otherwise a bytearray which is nonzero for items in a group.
+    #   _comments: None if no items have comments, otherwise a dict from position to [pre_comments, line_comment].
+    #   _end_comments: None or a list, as end_comments.
+    #   _index: None, False if some key cannot be indexed, or [index, number of items covered by the index]. See _positions.
+    #   _recursive_index: None, or [forward index, reverse index] once searched recursively since it or a tree in it last changed. See _recursive_paths.
+    #   _parent: None, the Tree this one is a value of, or a list of them (once per item) if it is a value of several. See _modify.
+    #   _shared: None, or a weak reference to the _Snapshot through which copies of this tree share its columns. See _copy.
+    #   _source: Only used by subclasses, which leave the other slots unset until their contents are needed.
+    __slots__ = ('_keys', '_values', '_operators', '_groups', '_comments', '_end_comments', '_index', '_recursive_index',
+        '_parent', '_shared', '_source')
+    _column_names = ('_keys', '_values', '_operators', '_groups', '_comments', '_end_comments')
+    
+    # The index maps match_key(key) to the positions of the items with that key, in order.
+    # It is built on the first lookup once a tree has at least _index_min_length items, and extended as items are appended.
+    # Methods that insert, remove or rekey items discard it.
+    _index_min_length = 8
+    
+    # Number of pieces write collects before writing them to the file.
+    _write_chunk_length = 4096
     
     def __init__(self, source = None, end_comments = None):
         """Creates an tree from another Tree, a dict, or a key, value iterator if given, or an empty tree otherwise."""
+        self._parent = None
+        self._set_columns(([], [], None, None, None, end_comments))
         if source is None:
-            self._data = []
+            pass
         elif isinstance(source, Tree):
-            self._data = copy.deepcopy(source._data)
+            self._extend(source._copy())
         elif isinstance(source, dict):
             self._from_python(source)
         else:
-            self._data = [Tree._Item(key, value) for (key, value) in source]
-        
-        if end_comments is None:
-            self.end_comments = []
-        else:
-            self.end_comments = end_comments
+            for (key, value) in source:
+                self.append(key, value)
     
     def _from_python(self, python_dict):
         """
         Recommended to use Python 3.6 or later, whose dicts preserve order.
         """
-        self._data = []
-        
         for key, value in python_dict.items():
             if isinstance(value, dict):
                 self.append(key, Tree(value))
@@ -137,143 +70,469 @@ class Tree():
             else:
                 self.append(key, value)
     
+    def _columns(self):
+        return (self._keys, self._values, self._operators, self._groups, self._comments, self._end_comments)
+    
+    def _set_columns(self, columns):
+        """Sets new columns. Their Tree values should be linked to this tree with _link_values."""
+        self._keys, self._values, self._operators, self._groups, self._comments, self._end_comments = columns
+        self._index = None
+        self._recursive_index = None
+        self._shared = None
+    
+    def _link_values(self, values, previous = None):
+        """Records this tree as the parent of the Trees among values, in place of previous if given."""
+        for value in values:
+            if isinstance(value, Tree):
+                if previous is not None: value._remove_parent(previous)
+                value._add_parent(self)
+    
+    def _add_parent(self, parent):
+        if self._parent is None: self._parent = parent
+        elif type(self._parent) is list: self._parent.append(parent)
+        else: self._parent = [self._parent, parent]
+    
+    def _remove_parent(self, parent):
+        if self._parent is parent:
+            self._parent = None
+        elif type(self._parent) is list:
+            for i, item in enumerate(self._parent):
+                if item is parent:
+                    del self._parent[i]
+                    break
+            if len(self._parent) == 1: self._parent = self._parent[0]
+    
+    def __getstate__(self):
+        """The index and parent links are not copied or pickled; they are rebuilt on demand and on loading respectively."""
+        return (None, {
+            '_keys' : self._keys,
+            '_values' : self._values,
+            '_operators' : self._operators,
+            '_groups' : self._groups,
+            '_comments' : self._comments,
+            '_end_comments' : self._end_comments,
+            '_index' : None,
+            '_recursive_index' : None,
+            })
+    
+    def __setstate__(self, state):
+        slots = state[1]
+        self._parent = None
+        self._set_columns(tuple(slots[name] for name in Tree._column_names))
+        self._link_values(self._values)
+    
+    def _copy(self):
+        """
+        Returns a deep copy of this tree in time independent of its size, by copy-on-write.
+        The copy is a _SharedTree, which refers to this tree's columns until it is first accessed and then copies its top level,
+        in turn sharing each of its Tree values. Before this tree or any tree containing it is next modified,
+        it gives its copies a copy of its top level instead (see _modify), so references into this tree remain part of it.
+        So only the levels that are actually used are ever copied.
+        Times, Colors and pre_comments lists that were obtained before the copy and are then modified in place are not tracked.
+        """
+        if type(self) is _SharedTree:
+            # Not yet accessed, so its snapshot can be shared again.
+            snapshot = self._source
+        else:
+            snapshot = self._shared and self._shared()
+            if snapshot is None:
+                snapshot = _Snapshot(self._columns())
+                self._shared = weakref.ref(snapshot)
+        
+        result = Tree.__new__(_SharedTree)
+        result._source = snapshot
+        result._parent = None
+        return result
+    
+    def _modify(self):
+        """
+        Called before the columns of this tree are modified or handed out to be modified.
+        Gives any copies of this tree or the trees containing it a copy of their columns first (see _copy),
+        and discards the recursive indexes that cover this tree.
+        """
+        parent = self._parent
+        if parent is not None:
+            if type(parent) is list:
+                for tree in parent: tree._modify()
+            else:
+                parent._modify()
+        
+        if self._shared is not None:
+            snapshot = self._shared()
+            self._shared = None
+            if snapshot is not None: snapshot.columns = _copy_columns(self._columns())
+        self._recursive_index = None
+    
+    def _positions(self, key):
+        """
+        Returns the positions of the items matching key, in order, using the index.
+        Returns None if the tree is too small to be worth indexing or the key cannot be indexed, in which case callers should scan.
+        """
+        keys = self._keys
+        if len(keys) < Tree._index_min_length or self._index is False: return None
+        match_key = pyradox.datatype.util.match_key
+        
+        if self._index is None or self._index[1] > len(keys):
+            self._index = [{}, 0]
+        index, index_length = self._index
+        
+        try:
+            for i in range(index_length, len(keys)):
+                index.setdefault(match_key(keys[i]), []).append(i)
+        except TypeError:
+            # Unhashable key. Later lookups scan until the items are rearranged.
+            self._index = False
+            return None
+        self._index[1] = len(keys)
+        
+        try:
+            positions = index.get(match_key(key), ())
+        except TypeError:
+            return None
+        if isinstance(key, pyradox.datatype.time.Time):
+            positions = [i for i in positions if pyradox.datatype.util.match(key, keys[i])]
+        return positions
+    
+    def _recursive_paths(self, key, reverse):
+        """
+        Returns the paths of the items matching key anywhere in the tree, in the order a recursive scan finds them.
+        Each path is a tuple of positions, one per level, starting from this tree.
+        Returns None if the key cannot be indexed, or this is the first recursive lookup since this tree or any tree in it last changed,
+        in which case callers should scan. So one-off lookups do not pay for building the index.
+        Changes discard the indexes of the trees containing the changed tree; see _modify.
+        """
+        state = self._recursive_index
+        if state is None:
+            self._recursive_index = [None, None]
+            return None
+        
+        side = 1 if reverse else 0
+        index = state[side]
+        if index is None:
+            try:
+                index = self._build_recursive_index(reverse)
+            except TypeError:
+                # Unhashable key.
+                index = False
+            state[side] = index
+        if index is False: return None
+        
+        try:
+            paths = index.get(pyradox.datatype.util.match_key(key), ())
+        except TypeError:
+            return None
+        if isinstance(key, pyradox.datatype.time.Time):
+            paths = [path for path in paths if pyradox.datatype.util.match(key, self._key_at_path(path))]
+        return paths
+    
+    def _key_at_path(self, path):
+        tree = self
+        for i in path[:-1]: tree = tree._values[i]
+        return tree._keys[path[-1]]
+    
+    def _build_recursive_index(self, reverse):
+        """Returns a dict from match_key(key) to the paths of all items with that key, in the order of a recursive scan."""
+        match_key = pyradox.datatype.util.match_key
+        index = {}
+        
+        def positions(tree):
+            it = range(len(tree._keys))
+            if reverse: it = reversed(it)
+            return iter(it)
+        
+        # Each item precedes the items of its value, as in _find_all.
+        stack = [(self, (), positions(self))]
+        while stack:
+            tree, path, it = stack[-1]
+            i = next(it, None)
+            if i is None:
+                stack.pop()
+                continue
+            item_path = path + (i,)
+            index.setdefault(match_key(tree._keys[i]), []).append(item_path)
+            value = tree._values[i]
+            if isinstance(value, Tree):
+                stack.append((value, item_path, positions(value)))
+        return index
+    
+    @property
+    def end_comments(self):
+        """Comments after the last item."""
+        self._modify()
+        if self._end_comments is None: self._end_comments = []
+        return self._end_comments
+    
+    @end_comments.setter
+    def end_comments(self, end_comments):
+        self._modify()
+        self._end_comments = end_comments
+    
     # iterator methods
     def keys(self):
         """Iterator over the keys of this tree."""
-        for item in self._data: yield item.key
-
+        for key in self._keys: yield key
+    
     def values(self):
         """Iterator over the values of this tree."""
-        for item in self._data: yield item.value
-
+        for value in self._values: yield value
+    
     def items(self, comments = False):
         """
         Iterator over (key, value) pairs of this tree.
         """
-        for item in self._data: yield item.key, item.value
-        
+        for key, value in zip(self._keys, self._values): yield key, value
+    
     def item_comments(self):
-        """Iterator over (pre_comments, line_comment) in this tree."""
-        for item in self._data: yield item.pre_comments, item.line_comment
-
+        """Iterator over (pre_comments, line_comment) in this tree. pre_comments is as get_pre_comments_at."""
+        for i in range(len(self._keys)): yield self.get_pre_comments_at(i), self.get_line_comment_at(i)
+    
     def __contains__(self, key):
         """True iff key is in (the top level of) the tree."""
         return self.contains(key)
-        
+    
     def contains(self, key, *args, **kwargs):
         """True iff key is in the tree. recurse = True for recursive."""
         return self.find(key, *args, **kwargs) is not None
-
+    
     def __iter__(self):
         """Iterator over the keys of this tree."""
         for key in self.keys(): yield key
-        
+    
     def __len__(self):
         """Number of key-value pairs."""
-        return len(self._data)
-
+        return len(self._keys)
+    
     # read/find methods
     def at(self, i):
         """Return (key, value) by index"""
-        item = self._data[i]
-        return item.key, item.value
-
+        return self._keys[i], self._values[i]
+    
     def key_at(self, i):
         """Return the ith key."""
-        return self._data[i].key
-
+        return self._keys[i]
+    
     def value_at(self, i):
         """Return the ith value."""
-        return self._data[i].value
-
+        return self._values[i]
+    
     def index(self, key, reverse = True):
         """Returns the index of the key. Last by default."""
-        it = enumerate(self._data)
-        if reverse: it = reversed(it)
-        for i, item in it:
-            if pyradox.datatype.util.match(key, item.key): return i
-        raise ValueError('Tree does not contain key %s.' % key)
+        positions = self._positions(key)
+        if positions:
+            if reverse: return positions[-1]
+            else: return positions[0]
+        elif positions is not None:
+            raise ValueError('Tree does not contain key %s.' % key)
         
+        it = enumerate(self._keys)
+        if reverse: it = reversed(list(it))
+        for i, item_key in it:
+            if pyradox.datatype.util.match(key, item_key): return i
+        raise ValueError('Tree does not contain key %s.' % key)
+    
     def count(self, key):
         """Count the number of items with matching key."""
+        positions = self._positions(key)
+        if positions is not None: return len(positions)
+        
         result = 0
-        for i, item in enumerate(self._data):
-            if pyradox.datatype.util.match(key, item.key): result += 1
+        for item_key in self._keys:
+            if pyradox.datatype.util.match(key, item_key): result += 1
         return result
-        
+    
     def _find(self, key, *args, **kwargs):
-        """Internal single find function. Returns a _Item."""
+        """Internal single find function. Returns (Tree, index) of the item."""
         it = self._find_all(key, *args, **kwargs)
         result = next(it, None)
         if result is None: raise KeyError('Key %s not found.' % key)
-        return result 
-        
+        return result
+    
     def _find_all(self, key, reverse = False, recurse = False):
-        """Internal iterative find function. Iterates over _Items."""
-        it = self._data
-        if reverse: it = reversed(it)
-        for item in it:
-            if pyradox.datatype.util.match(key, item.key): yield item
-            if recurse and isinstance(item.value, Tree):
-                for subitem in item.value._find_all(key, reverse = reverse, recurse = recurse): yield subitem
+        """Internal iterative find function. Iterates over (Tree, index) of each item."""
+        if recurse:
+            paths = self._recursive_paths(key, reverse)
+            if paths is not None:
+                for path in paths:
+                    tree = self
+                    for i in path[:-1]: tree = tree._values[i]
+                    yield tree, path[-1]
+                return
+        else:
+            positions = self._positions(key)
+            if positions is not None:
+                if reverse: positions = reversed(positions)
+                for i in positions: yield self, i
+                return
         
+        for item in self._scan(key, reverse, recurse): yield item
+    
+    def _scan(self, key, reverse, recurse):
+        """As _find_all, but without using or building indexes, so subtrees are not given recursive indexes of their own."""
+        keys = self._keys
+        values = self._values
+        it = range(len(keys))
+        if reverse: it = reversed(it)
+        for i in it:
+            if pyradox.datatype.util.match(key, keys[i]): yield self, i
+            if recurse and isinstance(values[i], Tree):
+                for subitem in values[i]._scan(key, reverse, recurse): yield subitem
+    
     def find(self, key, default = None, *args, **kwargs):
         """Return the first or last value corresponding to a key or None if not found"""
         it = self.find_all(key, *args, **kwargs)
         return next(it, default)
-
+    
     def find_all(self, key, tuple_length = None, *args, **kwargs):
         """Return all values corresponding to a key. If set, tuple_length parameter causes this to yield tuples."""
         if tuple_length is None:
-            for item in self._find_all(key, *args, **kwargs): 
-                yield item.value
+            for tree, i in self._find_all(key, *args, **kwargs):
+                yield tree._values[i]
         else:
             partial = []
-            for item in self._find_all(key, *args, **kwargs):
-                partial.append(item.value)
+            for tree, i in self._find_all(key, *args, **kwargs):
+                partial.append(tree._values[i])
                 if len(partial) >= tuple_length:
                     yield tuple(x for x in partial)
                     partial = []
-
+    
     def __getitem__(self, key):
         """Return the LAST value corresponding to a key or None if not found"""
         return self.find(key, reverse = True)
-
+    
+    def select(self, query):
+        """
+        Iterates over the values matching a path query, e.g. 'state/*/history/buildings/#int/naval_base'.
+        query: A string or compiled query. See pyradox.datatype.query for the syntax.
+        """
+        return pyradox.datatype.query.compile_query(query).select(self)
+    
     # write methods
-    def append(self, key, value, **kwargs):
+    def append(self, key, value, operator = None, in_group = False, pre_comments = None, line_comment = None):
         """Append a new key, value pair"""
-        self._data.append(Tree._Item(key, value, **kwargs))
-
+        self._modify()
+        self._append(key, pyradox.datatype.util.to_pyradox(value), operator, in_group, pre_comments, line_comment)
+    
+    def _append(self, key, value, operator = None, in_group = False, pre_comments = None, line_comment = None):
+        """Appends an item without converting its value. Used by the parsers, so does not call _modify."""
+        i = len(self._keys)
+        self._keys.append(key)
+        self._values.append(value)
+        if isinstance(value, Tree): value._add_parent(self)
+        
+        if operator is not None and operator != '=' and self._operators is None:
+            self._operators = ['='] * i
+        if self._operators is not None:
+            self._operators.append(operator or '=')
+        
+        if in_group and self._groups is None:
+            self._groups = bytearray(i)
+        if self._groups is not None:
+            self._groups.append(bool(in_group))
+        
+        if pre_comments or line_comment is not None:
+            if self._comments is None: self._comments = {}
+            self._comments[i] = [pre_comments or [], line_comment]
+    
+    def _extend(self, other):
+        """Appends all items of other, which should not be used afterwards."""
+        self._modify()
+        # Its values are moved to this tree, so its copies need their own.
+        other._modify()
+        self._link_values(other._values, other)
+        count = len(self._keys)
+        other_count = len(other._keys)
+        self._keys += other._keys
+        self._values += other._values
+        
+        if self._operators is not None or other._operators is not None:
+            self._operators = (self._operators or ['='] * count) + (other._operators or ['='] * other_count)
+        
+        if self._groups is not None or other._groups is not None:
+            self._groups = (self._groups or bytearray(count)) + (other._groups or bytearray(other_count))
+        
+        if other._comments:
+            if self._comments is None: self._comments = {}
+            for i, entry in other._comments.items():
+                self._comments[count + i] = entry
+    
     def insert(self, i, key, value):
         """Insert a new key, value pair at a numeric position"""
-        self._data.insert(i, Tree._Item(key, value))
-
+        # Same position as list.insert.
+        count = len(self._keys)
+        if i < 0: i = max(0, count + i)
+        else: i = min(i, count)
+        
+        self._modify()
+        value = pyradox.datatype.util.to_pyradox(value)
+        if isinstance(value, Tree): value._add_parent(self)
+        self._keys.insert(i, key)
+        self._values.insert(i, value)
+        if self._operators is not None: self._operators.insert(i, '=')
+        if self._groups is not None: self._groups.insert(i, 0)
+        if self._comments:
+            self._comments = {(j + 1 if j >= i else j) : entry for j, entry in self._comments.items()}
+        self._index = None
+    
+    def _replace(self, i, key, value):
+        """Replaces the ith item with a new one."""
+        self._modify()
+        value = pyradox.datatype.util.to_pyradox(value)
+        if isinstance(value, Tree): value._add_parent(self)
+        if isinstance(self._values[i], Tree): self._values[i]._remove_parent(self)
+        self._keys[i] = key
+        self._values[i] = value
+        if self._operators is not None: self._operators[i] = '='
+        if self._groups is not None: self._groups[i] = 0
+        if self._comments: self._comments.pop(i, None)
+    
+    def _remove(self, i):
+        """Removes the ith item."""
+        self._modify()
+        if isinstance(self._values[i], Tree): self._values[i]._remove_parent(self)
+        del self._keys[i]
+        del self._values[i]
+        if self._operators is not None: del self._operators[i]
+        if self._groups is not None: del self._groups[i]
+        if self._comments:
+            self._comments.pop(i, None)
+            self._comments = {(j - 1 if j > i else j) : entry for j, entry in self._comments.items()}
+        self._index = None
+    
     def __setitem__(self, key, value):
         """Replaces the LAST item with the key if it exists; otherwise appends it"""
-        for i, item in reversed(list(enumerate(self._data))):
-            if pyradox.datatype.util.match(key, item.key):
-                self._data[i] = Tree._Item(key, value)
+        positions = self._positions(key)
+        if positions:
+            self._replace(positions[-1], key, value)
+            return
+        elif positions is not None:
+            self.append(key, value)
+            return
+        
+        for i in reversed(range(len(self._keys))):
+            if pyradox.datatype.util.match(key, self._keys[i]):
+                self._replace(i, key, value)
                 return
         else:
             self.append(key, value)
-
+    
     def __delitem__(self, key, reverse = True):
         """Delete an item from the tree by key."""
         # TODO: delete all?
         idx = self.index(key, reverse = reverse)
-        if idx is not None: del self._data[idx]
+        if idx is not None: self._remove(idx)
     
     def __iadd__(self, other):
-        other = Tree(other)
-        for item in other._data:
-            self._data.append(copy.deepcopy(item))
+        if isinstance(other, Tree):
+            self._extend(other._copy())
+        else:
+            self._extend(Tree(other))
         return self
-            
+    
     def __add__(self, other):
-        result = copy.deepcopy(self)
+        result = self._copy()
         result += other
         return result
-
+    
     def update(self, other):
         """
         Shallow update.
@@ -287,7 +546,7 @@ class Tree():
         """
         for key, value in other.items():
             if key not in self:
-                self.append(key, copy.deepcopy(value))
+                self.append(key, _copy_value(value))
     
     def inherit(self, other):
         """
@@ -298,7 +557,7 @@ class Tree():
             if value == "inherit":
                 if key not in other:
                     raise ValueError("Parent lacks key " + key)
-                self[key] = copy.deepcopy(other[key])
+                self[key] = _copy_value(other[key])
             elif isinstance(value, Tree):
                 if key in other:
                     other_value = other[key]
@@ -308,106 +567,269 @@ class Tree():
                     # Check if there are dangling inherits.
                     other_value = Tree()
                 value.inherit(other_value)
-        
-    def merge_item(self, key, value, merge_levels = 0):
-        if key in self and isinstance(self[key], Tree):
-            self[key].merge(value, merge_levels)
+    
+    def merge_item(self, key, value, merge_levels = 0, move = False):
+        """
+        Merges value into the last Tree value with the key if both are Trees; otherwise replaces the last value with the key, or appends it.
+        move: As merge.
+        """
+        existing = self.find(key, reverse = True)
+        if isinstance(existing, Tree) and isinstance(value, (Tree, dict)):
+            existing.merge(value, merge_levels, move = move)
         else:
-            self[key] = copy.deepcopy(value)
+            if not move: value = _copy_value(value)
+            self[key] = value
     
-    def merge(self, other, merge_levels = 0):
+    def merge(self, other, merge_levels = 0, move = False):
         """
         Recursively merges another tree into this one.
         merge_levels = 0: Same as adding a copy of the other tree onto the end of this one.
         merge_levels > 0: Tree values will be recursively merged for this many levels, at which point it will add a copy as above.
         merge_levels = -1: Fully recursive.
+        move: If True, the contents of other are moved into this tree rather than copied. other should not be used afterwards.
         """
+        if not isinstance(other, Tree):
+            other = Tree(other)
+            move = True
+        
         if merge_levels == 0:
-            self += copy.deepcopy(other)
+            if move: self._extend(other)
+            else: self._extend(other._copy())
         else:
             for key, value in other.items():
-                self.merge_item(key, value, merge_levels - 1)
+                self.merge_item(key, value, merge_levels - 1, move = move)
     
     # comments
     
+    def _comment_entry(self, i):
+        """Returns the [pre_comments, line_comment] of the ith item, adding it if necessary."""
+        i = range(len(self._keys))[i]
+        self._modify()
+        if self._comments is None: self._comments = {}
+        entry = self._comments.get(i)
+        if entry is None:
+            entry = self._comments[i] = [[], None]
+        return entry
+    
     def get_pre_comments(self, key):
-        return self._find(key).pre_comments
+        tree, i = self._find(key)
+        return tree.get_pre_comments_at(i)
     
     def get_line_comment(self, key):
-        return self._find(key).line_comment
+        tree, i = self._find(key)
+        return tree.get_line_comment_at(i)
     
     def set_pre_comments(self, key, pre_comments):
-        self._find(key).pre_comments = pre_comments
+        tree, i = self._find(key)
+        tree.set_pre_comments_at(i, pre_comments)
     
     def set_line_comment(self, key, line_comment):
-        self._find(key).line_comment = line_comment
-        
+        tree, i = self._find(key)
+        tree.set_line_comment_at(i, line_comment)
+    
     def get_pre_comments_at(self, i):
-        return self._data[i].pre_comments
+        """
+        Returns the ith item's pre_comments list, which may be modified in place.
+        If it has none, the list is only added to the item once it is modified, so reading comments does not add entries.
+        """
+        i = range(len(self._keys))[i]
+        if self._comments and i in self._comments:
+            self._modify()
+            return self._comments[i][0]
+        return _PendingComments(self, i)
     
     def get_line_comment_at(self, i):
-        return self._data[i].line_comment
+        i = range(len(self._keys))[i]
+        if not self._comments or i not in self._comments: return None
+        return self._comments[i][1]
     
     def set_pre_comments_at(self, i, pre_comments):
-        self._data[i].pre_comments = pre_comments
+        self._comment_entry(i)[0] = pre_comments
     
     def set_line_comment_at(self, i, line_comment):
-        self._data[i].line_comment = line_comment
-        
+        self._comment_entry(i)[1] = line_comment
+    
     # operators
     
     def get_operator(self, key):
-        return self._find(key).operator
-        
+        tree, i = self._find(key)
+        return tree.get_operator_at(i)
+    
     def set_operator(self, key, operator):
-        self._find(key).operator = operator
-        
+        tree, i = self._find(key)
+        tree.set_operator_at(i, operator)
+    
     def get_operator_at(self, i):
-        return self._data[i].operator
-        
+        self._keys[i] # Check bounds.
+        if self._operators is None: return '='
+        return self._operators[i]
+    
     def set_operator_at(self, i, operator):
-        self._data[i].operator = operator
+        self._keys[i] # Check bounds.
+        self._modify()
+        if operator is None: operator = '='
+        if self._operators is None:
+            if operator == '=': return
+            self._operators = ['='] * len(self._keys)
+        self._operators[i] = operator
     
     # string output methods
     def __str__(self):
         """Produces a string in the original .txt format."""
         return self.prettyprint(0)
-
-    def prettyprint(self, level = 0, indent_string = '    ', include_comments = True):
-        result = ''
+    
+    def _item_pre_comments(self, i):
+        """Returns the pre_comments of the ith item for reading, without adding an entry for them."""
+        if not self._comments or i not in self._comments: return ()
+        return self._comments[i][0]
+    
+    def _write_item(self, i, out, level, indent_string, include_comments):
+        key = self._keys[i]
+        value = self._values[i]
+        operator = '=' if self._operators is None else self._operators[i]
+        indent = indent_string * level
+        
+        if include_comments:
+            for pre_comment in self._item_pre_comments(i):
+                out('%s#%s\n' % (indent, pre_comment))
+        
+        # Output key.
+        out('%s%s %s ' % (indent, key, operator))
+        
+        # Output value. Subtrees always use the default indent_string and include comments.
+        if isinstance(value, Tree):
+            out('{\n')
+            value._write(out, level + 1, '    ', True)
+            out(indent + '}')
+        else:
+            out(pyradox.token.make_token_string(value))
+        
+        if include_comments and self._comments and i in self._comments:
+            line_comment = self._comments[i][1]
+            if line_comment is not None:
+                out(" #%s" % (line_comment))
+        
+        out('\n')
+    
+    def _write_group_item(self, i, out, level, indent_string, include_comments):
+        """
+        Some trickiness here. Assumes that any indentation for the first line has already been performed.
+        If there are no comments and the value is not a Tree, outputs the value without a newline and returns False, so following values may be placed on the same line.
+        Otherwise, outputs a string ending in newline and returns True.
+        """
+        value = self._values[i]
+        indent = indent_string * level
+        
+        need_indent = False
+        has_pre_comment = False
+        if include_comments:
+            for pre_comment in self._item_pre_comments(i):
+                has_pre_comment = True
+                out('\n%s#%s' % (indent, pre_comment))
+        
+        if has_pre_comment or isinstance(value, Tree):
+            out('\n' + indent)
+        
+        # Output value.
+        if isinstance(value, Tree):
+            need_indent = True
+            out('{\n')
+            value._write(out, level + 1, '    ', True)
+            out(indent + '}')
+        else:
+            out(pyradox.token.make_token_string(value) + ' ')
+        
+        if include_comments and self._comments and i in self._comments:
+            line_comment = self._comments[i][1]
+            if line_comment is not None:
+                need_indent = True
+                out("#%s" % (line_comment))
+        
+        if need_indent:
+            out('\n')
+        
+        return need_indent
+    
+    def _write(self, out, level, indent_string, include_comments):
+        """
+        Outputs this tree in the original .txt format by calling out with each piece.
+        """
         group_key = None # The key corresponding to the current group. None if no group in progress.
+        keys = self._keys
+        values = self._values
+        operators = self._operators
+        groups = self._groups or bytes(len(keys))
+        comments = self._comments if include_comments else None
+        match = pyradox.datatype.util.match
+        make_token_string = pyradox.token.make_token_string
+        indent = indent_string * level
         
-        for item in self._data:
+        for i, key in enumerate(keys):
             if group_key is not None: # Last item was in a group.
-                if item.in_group and pyradox.datatype.util.match(item.key, group_key):
+                if groups[i] and match(key, group_key):
                     # Continue the previous group.
                     if needs_indent:
-                        result += indent_string * (level + 1)
-                    group_string, needs_indent = item.prettyprint_group(level = level + 1, indent_string = indent_string, include_comments = include_comments)
-                    result += group_string
+                        out(indent_string * (level + 1))
+                    value = values[i]
+                    if (comments and i in comments) or isinstance(value, Tree):
+                        needs_indent = self._write_group_item(i, out, level + 1, indent_string, include_comments)
+                    else:
+                        # Same as _write_group_item for a value without comments.
+                        out(make_token_string(value) + ' ')
+                        needs_indent = False
                     continue
                 else:
                     # End the group.
                     group_key = None
-                    result += ' }\n'
-            if item.in_group:
+                    out(' }\n')
+            if groups[i]:
                 # Start a group.
-                group_key = item.key
-                result += '%s%s %s { ' % (indent_string * level, item.key, item.operator)
-                group_string, needs_indent = item.prettyprint_group(level = level + 1, indent_string = indent_string, include_comments = include_comments)
-                result += group_string
+                group_key = key
+                out('%s%s %s { ' % (indent_string * level, key, self.get_operator_at(i)))
+                needs_indent = self._write_group_item(i, out, level + 1, indent_string, include_comments)
+            elif comments and i in comments:
+                self._write_item(i, out, level, indent_string, include_comments)
             else:
-                result += item.prettyprint(level = level, indent_string = indent_string, include_comments = include_comments)
+                # Same as _write_item for an item without comments.
+                value = values[i]
+                operator = '=' if operators is None else operators[i]
+                if isinstance(value, Tree):
+                    out('%s%s %s {\n' % (indent, key, operator))
+                    value._write(out, level + 1, '    ', True)
+                    out(indent + '}\n')
+                else:
+                    out('%s%s %s %s\n' % (indent, key, operator, make_token_string(value)))
         
         # If last item was in a group, close it.
         if group_key is not None:
-            result += '}\n'
-            
-        for end_comment in self.end_comments:
-            result += '%s#%s\n' % (indent_string * level, end_comment)
-
-        return result
+            out('}\n')
+        
+        for end_comment in self._end_comments or ():
+            out('%s#%s\n' % (indent_string * level, end_comment))
+    
+    def prettyprint(self, level = 0, indent_string = '    ', include_comments = True):
+        result = []
+        self._write(result.append, level, indent_string, include_comments)
+        return ''.join(result)
+    
+    def write(self, fp, level = 0, indent_string = '    ', include_comments = True):
+        """
+        Writes the same output as prettyprint to a text file-like object (such as an open file or io.StringIO),
+        in chunks of about _write_chunk_length pieces rather than building the whole string.
+        """
+        buffer = []
+        append = buffer.append
+        chunk_length = Tree._write_chunk_length
+        
+        def out(piece):
+            append(piece)
+            if len(buffer) >= chunk_length:
+                fp.write(''.join(buffer))
+                buffer.clear()
         
+        self._write(out, level, indent_string, include_comments)
+        fp.write(''.join(buffer))
+    
     # mutator methods
     
     def replaced_key_with_subkey(self, key, subkey):
@@ -415,14 +837,16 @@ class Tree():
         For every self[key], replace the key for that item with self[key][subkey].
         """
         
-        for item in self._find_all(key):
-            item.key = item.value[subkey]
-            
+        self._modify()
+        for tree, i in self._find_all(key):
+            tree._keys[i] = tree._values[i][subkey]
+        self._index = None
+    
     def replace_key_with_subkey(self, key, subkey):
         """
         Non-destructive version of replaced_key_with_subkey. Returns a copy.
         """
-        result = copy.deepcopy(self)
+        result = self._copy()
         result.replaced_key_with_subkey(key, subkey)
         return result
     
@@ -432,23 +856,32 @@ class Tree():
         
         Non-destructive (returns a copy).
         """
-
+        
         # Compute dictionary of substitutions.
         sub = {}
         for key, value in self.items():
             if isinstance(key, str) and key[0] == '@':
                 sub[key] = value
         
-        result = copy.deepcopy(self)
-        result._apply_defines_internal(sub)
+        result = self._copy()
+        # Only the subtrees of the copy that contain substitutions are copied.
+        for path in list(self._define_paths(sub)):
+            tree = result
+            for i in path[:-1]: tree = tree._values[i]
+            i = path[-1]
+            tree._modify()
+            value = pyradox.datatype.util.to_pyradox(_copy_value(sub[tree._values[i]]))
+            if isinstance(value, Tree): value._add_parent(tree)
+            tree._values[i] = value
         return result
     
-    def _apply_defines_internal(self, sub):
-        for item in self._data:
-            if item.value in sub:
-                item.set_value(copy.deepcopy(sub[item.value]))
-            elif isinstance(item.value, Tree):
-                item.value._apply_defines_internal(sub)
+    def _define_paths(self, sub, path = ()):
+        """Iterates over the paths of the values to be substituted, as _recursive_paths."""
+        for i, value in enumerate(self._values):
+            if value in sub:
+                yield path + (i,)
+            elif isinstance(value, Tree):
+                yield from value._define_paths(sub, path + (i,))
     
     def resolve_references(self):
         """
@@ -463,7 +896,7 @@ class Tree():
                     replacement = self[value]
                     if not isinstance(replacement, str):
                         converged = False
-                        self[key] = copy.deepcopy(replacement)
+                        self[key] = _copy_value(replacement)
     
     # conversion methods
     
@@ -485,23 +918,25 @@ class Tree():
         
         result = {}
         group_key = None # The key corresponding to the current group. None if no group in progress.
+        groups = self._groups or bytes(len(self._keys))
         
-        for item in self._data:
-            python_key = pyradox.datatype.util.to_python(item.key, duplicate_action = duplicate_action)
-            python_value = pyradox.datatype.util.to_python(item.value, duplicate_action = duplicate_action)
+        for i, (key, value) in enumerate(self.items()):
+            in_group = groups[i]
+            python_key = pyradox.datatype.util.to_python(key, duplicate_action = duplicate_action)
+            python_value = pyradox.datatype.util.to_python(value, duplicate_action = duplicate_action)
             if group_key is not None: # Last item was in a one_group.
-                if item.in_group and pyradox.datatype.util.match(item.key, group_key) and not isinstance(item.value, Tree):
+                if in_group and pyradox.datatype.util.match(key, group_key) and not isinstance(value, Tree):
                     # Continue the previous one_group.
                     result[python_key].append(python_value)
                     continue
                 else:
                     # End the one_group.
                     group_key = None
-            if item.in_group and duplicate_action == 'one_group':
+            if in_group and duplicate_action == 'one_group':
                 if python_key in result:
                     raise ValueError('to_python produced duplicate for key "%s". All but the last value will be overwritten.' % python_key)
                 # Start a group.
-                group_key = item.key
+                group_key = key
                 result[python_key] = []
                 result[python_key].append(python_value)
             else:
@@ -520,10 +955,10 @@ class Tree():
                         raise ValueError('to_python produced duplicate for key "%s". All but the last value will be overwritten.' % python_key)
                 else:
                     result[python_key] = python_value
-            
+        
         return result
     
-
+    
     # other methods
     def at_time(self, time = False, merge_levels = -1):
         """
@@ -537,15 +972,100 @@ class Tree():
         
         result = Tree()
         # non-dates
-        for item in self._data:
-            if not isinstance(item.key, pyradox.datatype.time.Time):
-                result.append(item.key, copy.deepcopy(item.value))
-
+        for key, value in self.items():
+            if not isinstance(key, pyradox.datatype.time.Time):
+                result.append(key, _copy_value(value))
+        
         # dates
         if time is False: return result
         
-        for item in self._data:
-            if isinstance(item.key, pyradox.datatype.time.Time):
-                if time is True or item.key <= time:
-                    result.merge(item.value, merge_levels = merge_levels)
+        for key, value in self.items():
+            if isinstance(key, pyradox.datatype.time.Time):
+                if time is True or key <= time:
+                    result.merge(value, merge_levels = merge_levels)
         return result
+
+class _PendingComments(list):
+    """
+    The empty pre_comments list of an item without comments, as returned by get_pre_comments_at.
+    On its first modification, it becomes the item's pre_comments list, provided the item is still at the same position.
+    """
+    
+    __slots__ = ('_tree', '_i')
+    
+    def __init__(self, tree, i):
+        self._tree = tree
+        self._i = i
+    
+    def _attach(self):
+        tree = self._tree
+        if tree is not None:
+            self._tree = None
+            entry = tree._comment_entry(self._i)
+            if not entry[0]: entry[0] = self
+    
+    def __reduce_ex__(self, protocol):
+        return (list, (list(self),))
+
+def _attach_first(name):
+    method = getattr(list, name)
+    def result(self, *args):
+        self._attach()
+        return method(self, *args)
+    result.__name__ = name
+    return result
+
+for name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse', '__setitem__', '__delitem__', '__iadd__', '__imul__'):
+    setattr(_PendingComments, name, _attach_first(name))
+
+class _Snapshot():
+    """The columns shared by the copies of a tree, which are never modified. See _copy."""
+    
+    __slots__ = ('columns', '__weakref__')
+    
+    def __init__(self, columns):
+        self.columns = columns
+
+class _SharedTree(Tree):
+    """
+    A copy of a tree that has not been accessed yet. See _copy.
+    Its _source is the _Snapshot it was copied from. On first access, it copies its top level from that,
+    sharing each of its Tree values in turn, and becomes an ordinary Tree.
+    """
+    
+    __slots__ = ()
+    
+    def __getattr__(self, name):
+        # Only called for unset slots.
+        if name == '_source' or name not in Tree.__slots__: raise AttributeError(name)
+        self._unshare()
+        return getattr(self, name)
+    
+    def _unshare(self):
+        columns = self._source.columns
+        del self._source
+        self._set_columns(_copy_columns(columns))
+        self._link_values(self._values)
+        self.__class__ = Tree
+    
+    def __reduce_ex__(self, protocol):
+        self._unshare()
+        return self.__reduce_ex__(protocol)
+
+def _copy_value(value):
+    """Returns a deep copy of a key or value. Trees are copied by _copy."""
+    if isinstance(value, (str, int, float)): return value
+    elif isinstance(value, Tree): return value._copy()
+    else: return copy.deepcopy(value)
+
+def _copy_columns(columns):
+    """Returns a copy of the top level of a tree's columns, copying its Tree values by _copy."""
+    keys, values, operators, groups, comments, end_comments = columns
+    return (
+        [_copy_value(key) for key in keys],
+        [_copy_value(value) for value in values],
+        operators and list(operators),
+        groups and bytearray(groups),
+        comments and {i : [list(pre_comments), line_comment] for i, (pre_comments, line_comment) in comments.items()},
+        end_comments and list(end_comments),
+        )
@@ -19,6 +19,15 @@ def to_pyradox(value):
     else:
         return value
 
+def match_key(x):
+    """
+    Returns a hashable key such that match(x, spec) implies match_key(x) == match_key(spec).
+    Times are mutable and so cannot be hashed; they all have the same key, and must be compared with match to tell them apart.
+    """
+    if isinstance(x, str): return x.lower()
+    elif isinstance(x, pyradox.datatype.time.Time): return pyradox.datatype.time.Time
+    else: return x
+
 def match(x, spec):
     if isinstance(spec, str) and isinstance(x, str): return x.lower() == spec.lower()
     else: return x == spec
\ No newline at end of file
@@ -0,0 +1,382 @@
+import pyradox
+from pyradox.error import *
+
+import array
+import itertools
+import struct
+import sys
+
+"""
+Compact binary format for Trees, which preserves everything prettyprint outputs (including Times, Colors, operators, groups and comments),
+and allows a single top-level subtree to be loaded without decoding the rest.
+It is decoded with struct and array only, so loading data from elsewhere cannot run code.
+
+Layout (all integers little-endian):
+    MAGIC and FORMAT_VERSION, then the string table, the root block, and a block for each Tree value of the root in order,
+    each preceded by its length as a uint32.
+    The string table is the number of distinct strings as a uint32, their lengths as uint32s, and then their UTF-8 text.
+    It holds the keys and values, operators and comments, and the text of Times, Colors and integers too large for int64.
+    Each block holds a Tree and all Trees nested in it, numbered in breadth-first order,
+    so that the Tree values of its items are Trees 1, 2, ... in item order.
+    The root block holds only the root; its Tree values are the blocks that follow.
+    The items of all Trees in a block are numbered in order.
+    A block starts with the length of each of the following arrays as a uint32, followed by the arrays themselves:
+        counts: uint32, the number of items of each Tree.
+        key_tags, value_tags: uint8, one tag per item giving the type of its key/value.
+        For each tag in order, the data of the keys and then the values with that tag:
+            TAG_STR: uint32 string indexes. TAG_INT: int64. TAG_FLOAT: float64. TAG_BOOL: uint8.
+            TAG_TIME, TAG_COLOR, TAG_BIG_INT: uint32 string indexes of their text. TAG_TREE: empty.
+        operators: uint32 string indexes of the operator of each item. Empty if they are all '='.
+        groups: uint8, nonzero for items that are in a group. Empty if there are none.
+        comments: uint32 (item, number of pre_comments, their string indexes..., line_comment string index + 1 or 0) runs.
+        end_comments: uint32 (Tree, number of end_comments, their string indexes...) runs.
+"""
+
+MAGIC = b'PDXT'
+
+# Increase whenever the layout changes. Data in any other version cannot be loaded.
+FORMAT_VERSION = 4
+
+# Tags.
+TAG_STR = 0
+TAG_INT = 1
+TAG_FLOAT = 2
+TAG_BOOL = 3
+TAG_TIME = 4
+TAG_COLOR = 5
+TAG_BIG_INT = 6
+TAG_TREE = 7
+TAG_COUNT = 8
+
+_uint32 = struct.Struct('<I')
+_UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+_tag_typecodes = [_UINT32, 'q', 'd', 'B', _UINT32, _UINT32, _UINT32, 'B']
+_block_typecodes = [_UINT32, 'B', 'B'] + _tag_typecodes + [_UINT32, 'B', _UINT32, _UINT32]
+_block_header = struct.Struct('<%dI' % len(_block_typecodes))
+_byteswap = sys.byteorder != 'little'
+
+class _TagsByType(dict):
+    """The tag of each type, working out those of subclasses (e.g. LazyTree) when first seen."""
+    def __missing__(self, value_type):
+        # bool before int, since bool is a subclass of int.
+        for base, tag in ((bool, TAG_BOOL), (int, TAG_INT), (float, TAG_FLOAT), (str, TAG_STR),
+                          (pyradox.Time, TAG_TIME), (pyradox.Color, TAG_COLOR), (pyradox.Tree, TAG_TREE)):
+            if issubclass(value_type, base):
+                self[value_type] = tag
+                return tag
+        raise TypeError('Cannot encode values of type %s.' % value_type.__name__)
+
+_tags_by_type = _TagsByType()
+
+def dumps_tree(tree, comments = True):
+    """Returns the Tree in binary format as bytes. comments = False omits comments."""
+    strings = {}
+    blocks = [_dump_block(tree, strings, comments, nest = False)]
+    for value in tree._values:
+        if isinstance(value, pyradox.Tree):
+            blocks.append(_dump_block(value, strings, comments))
+
+    lengths = array.array(_UINT32, map(len, strings))
+    if _byteswap: lengths.byteswap()
+    string_table = _uint32.pack(len(lengths)) + lengths.tobytes() + ''.join(strings).encode('utf-8', 'surrogatepass')
+
+    chunks = [MAGIC, bytes([FORMAT_VERSION])]
+    for block in [string_table] + blocks:
+        chunks.append(_uint32.pack(len(block)))
+        chunks.append(block)
+    return b''.join(chunks)
+
+def dump_tree(tree, fp, comments = True):
+    """Writes the Tree in binary format to a file opened in binary mode."""
+    fp.write(dumps_tree(tree, comments = comments))
+
+def loads_tree(data, key_path = ()):
+    """
+    Loads a Tree from binary format.
+    key_path: A sequence of keys. If supplied, only the subtree at that path is loaded,
+        following the last item with each key as tree[key] would. Returns None if there is no such subtree.
+    """
+    data = memoryview(data)
+    if len(data) <= len(MAGIC) or data[:len(MAGIC)] != MAGIC:
+        raise ParseError('Data is not a binary Tree.')
+    version = data[len(MAGIC)]
+    if version != FORMAT_VERSION:
+        raise ParseError('Binary Tree is format version %d, but only version %d can be loaded.' % (version, FORMAT_VERSION))
+
+    try:
+        block, pos = _next_block(data, len(MAGIC) + 1)
+        strings = _load_strings(block)
+        block, pos = _next_block(data, pos)
+        root, positions = _load_block(block, strings, nest = False)
+
+        if key_path:
+            try:
+                index = root.index(key_path[0])
+            except ValueError:
+                return None
+            if index not in positions: return None
+            for i in positions:
+                block, pos = _next_block(data, pos)
+                if i == index: break
+            subtree, subtree_positions = _load_block(block, strings)
+            return _find_tree(subtree, key_path[1:])
+
+        values = root._values
+        for i in positions:
+            block, pos = _next_block(data, pos)
+            values[i], subtree_positions = _load_block(block, strings)
+            values[i]._parent = root
+        return root
+    except (IndexError, KeyError, ValueError, struct.error) as e:
+        raise ParseError('Binary Tree is corrupt: %s' % e)
+
+def load_tree(fp, key_path = ()):
+    """Reads a Tree in binary format from a file opened in binary mode. key_path is as loads_tree."""
+    return loads_tree(fp.read(), key_path = key_path)
+
+def _dump_block(tree, strings, comments, nest = True):
+    """
+    Returns the block for tree, adding its strings to strings, a dict from each string to its index in the string table.
+    If not nest, its Tree values are left out, to be written as blocks of their own.
+    """
+    tag_of = _tags_by_type.__getitem__
+    trees = [tree]
+    keys = []
+    values = []
+    value_tags = bytearray()
+    operators = []
+    groups = []
+    comment_items = []
+    end_comment_items = []
+
+    for tree_index, subtree in enumerate(trees):
+        start = len(keys)
+        keys += subtree._keys
+        subtree_values = subtree._values
+        values += subtree_values
+        subtree_tags = bytes(map(tag_of, map(type, subtree_values)))
+        value_tags += subtree_tags
+        if nest and TAG_TREE in subtree_tags:
+            trees += itertools.compress(subtree_values, map(TAG_TREE.__eq__, subtree_tags))
+
+        if subtree._operators is not None:
+            operators += ['='] * (start - len(operators))
+            operators += subtree._operators
+        if subtree._groups is not None:
+            groups += bytes(start - len(groups))
+            groups += subtree._groups
+        if comments:
+            if subtree._comments:
+                comment_items += [(start + i, entry) for i, entry in sorted(subtree._comments.items())]
+            if subtree._end_comments:
+                end_comment_items.append((tree_index, subtree._end_comments))
+
+    if operators: operators += ['='] * (len(keys) - len(operators))
+    if groups: groups += bytes(len(keys) - len(groups))
+    key_tags = _check_int_range(bytearray(map(tag_of, map(type, keys))), keys)
+    value_tags = _check_int_range(value_tags, values)
+
+    # The data of each tag, first for the keys and then for the values.
+    streams = []
+    for tag in range(TAG_COUNT):
+        if tag == TAG_STR and key_tags.count(TAG_STR) == len(keys):
+            data = list(keys)
+        else:
+            data = list(itertools.compress(keys, map(tag.__eq__, key_tags))) if tag in key_tags else []
+        if tag in value_tags: data += itertools.compress(values, map(tag.__eq__, value_tags))
+        if tag == TAG_TIME:
+            data = ['.'.join(map(str, x.data)) for x in data]
+        elif tag == TAG_COLOR:
+            data = [' '.join([x.colorspace] + [repr(c) for c in x.channels]) for x in data]
+        elif tag == TAG_BIG_INT:
+            data = list(map(str, data))
+        elif tag == TAG_TREE:
+            data = []
+        streams.append(data)
+
+    comment_data = []
+    for item, (pre_comments, line_comment) in comment_items:
+        comment_data += [item, len(pre_comments)]
+        comment_data += pre_comments
+        comment_data.append(line_comment)
+    end_comment_data = []
+    for tree_index, end_comments in end_comment_items:
+        end_comment_data += [tree_index, len(end_comments)]
+        end_comment_data += end_comments
+
+    # Replace strings with their indexes.
+    string_streams = [streams[TAG_STR], streams[TAG_TIME], streams[TAG_COLOR], streams[TAG_BIG_INT], operators]
+    new_strings = itertools.chain(itertools.chain.from_iterable(string_streams), (x for x in comment_data + end_comment_data if isinstance(x, str)))
+    for string in dict.fromkeys(new_strings):
+        if string not in strings: strings[string] = len(strings)
+    string_index = strings.__getitem__
+    for tag in (TAG_STR, TAG_TIME, TAG_COLOR, TAG_BIG_INT):
+        streams[tag] = map(string_index, streams[tag])
+    operators = map(string_index, operators)
+    # Line comments are stored as their index + 1, or 0 if there are none.
+    line_comment_index = lambda x: 0 if x is None else strings[x] + 1
+    pos = 0
+    while pos < len(comment_data):
+        count = comment_data[pos + 1]
+        comment_data[pos + 2:pos + 2 + count] = map(string_index, comment_data[pos + 2:pos + 2 + count])
+        comment_data[pos + 2 + count] = line_comment_index(comment_data[pos + 2 + count])
+        pos += count + 3
+    pos = 0
+    while pos < len(end_comment_data):
+        count = end_comment_data[pos + 1]
+        end_comment_data[pos + 2:pos + 2 + count] = map(string_index, end_comment_data[pos + 2:pos + 2 + count])
+        pos += count + 2
+
+    arrays = [map(len, trees), key_tags, value_tags] + streams + [operators, groups, comment_data, end_comment_data]
+    arrays = [array.array(typecode, data) for typecode, data in zip(_block_typecodes, arrays)]
+    if _byteswap:
+        for data in arrays: data.byteswap()
+    return _block_header.pack(*map(len, arrays)) + b''.join(data.tobytes() for data in arrays)
+
+def _check_int_range(tags, column):
+    """Changes the tags of ints too large for int64 to TAG_BIG_INT, and returns tags."""
+    if TAG_INT in tags:
+        ints = list(itertools.compress(column, map(TAG_INT.__eq__, tags)))
+        if min(ints) < -2 ** 63 or max(ints) >= 2 ** 63:
+            for i, tag in enumerate(tags):
+                if tag == TAG_INT and not -2 ** 63 <= column[i] < 2 ** 63: tags[i] = TAG_BIG_INT
+    return tags
+
+def _next_block(data, pos):
+    """Returns (the block at pos, position after the block)."""
+    (length,) = _uint32.unpack_from(data, pos)
+    pos += _uint32.size
+    if pos + length > len(data): raise ValueError('block extends past the end of the data')
+    return data[pos:pos + length], pos + length
+
+def _unpack_arrays(block, typecodes, header):
+    """
+    Returns (arrays, position after them) for arrays preceded by their lengths, as packed by header.
+    Empty arrays are returned as (), and uint8 arrays as bytes.
+    """
+    pos = header.size
+    result = []
+    for typecode, length in zip(typecodes, header.unpack_from(block)):
+        if length == 0:
+            result.append(())
+            continue
+        if typecode == 'B':
+            data = bytes(block[pos:pos + length])
+        else:
+            data = array.array(typecode)
+            data.frombytes(block[pos:pos + length * data.itemsize])
+            if _byteswap: data.byteswap()
+        if len(data) != length: raise ValueError('array extends past the end of its block')
+        result.append(data)
+        pos += length * data.itemsize if typecode != 'B' else length
+    return result, pos
+
+def _load_strings(block):
+    (lengths,), pos = _unpack_arrays(block, [_UINT32], _uint32)
+    text = str(block[pos:], 'utf-8', 'surrogatepass')
+    offsets = list(itertools.accumulate(lengths, initial = 0))
+    if offsets[-1] != len(text): raise ValueError('string table has the wrong length')
+    return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+def _make_time(text):
+    # The Time was valid when dumped, so it is not validated again.
+    time = pyradox.Time.__new__(pyradox.Time)
+    time.__dict__['data'] = list(map(int, text.split('.')))
+    return time
+
+def _make_color(text):
+    colorspace, *channels = text.split(' ')
+    datatype = pyradox.Color.COLORSPACE_DATA_TYPES[colorspace]
+    color = pyradox.Color.__new__(pyradox.Color)
+    color.__dict__.update(colorspace = colorspace, channels = [datatype(c) for c in channels])
+    return color
+
+def _load_block(block, strings, nest = True):
+    """
+    Returns (Tree, positions of its Tree values) for a block.
+    If not nest, its Tree values are None, to be replaced by the following blocks.
+    """
+    arrays, pos = _unpack_arrays(block, _block_typecodes, _block_header)
+    if pos != len(block): raise ValueError('block has the wrong length')
+    counts, key_tags, value_tags = arrays[:3]
+    streams = arrays[3:3 + TAG_COUNT]
+    operators, groups, comment_data, end_comment_data = arrays[3 + TAG_COUNT:]
+
+    item_count = len(key_tags)
+    if sum(counts) != item_count or len(value_tags) != item_count or len(counts) == 0:
+        raise ValueError('block has the wrong number of items')
+    new_tree = pyradox.Tree.__new__
+    trees = [new_tree(pyradox.Tree) for count in counts]
+    trees[0]._parent = None
+    tree_count = value_tags.count(TAG_TREE)
+    if len(trees) != (tree_count + 1 if nest else 1):
+        raise ValueError('block has the wrong number of Trees')
+
+    # Each tag's data is consumed in order, first by the keys and then by the values, as it was written.
+    iterators = [
+        map(strings.__getitem__, streams[TAG_STR]),
+        iter(streams[TAG_INT]),
+        iter(streams[TAG_FLOAT]),
+        map(bool, streams[TAG_BOOL]),
+        map(_make_time, map(strings.__getitem__, streams[TAG_TIME])),
+        map(_make_color, map(strings.__getitem__, streams[TAG_COLOR])),
+        map(int, map(strings.__getitem__, streams[TAG_BIG_INT])),
+        iter(trees[1:]) if nest else itertools.repeat(None, tree_count),
+        ]
+    # A tag with too little data ends the list early, and any other tag raises IndexError.
+    if key_tags.count(TAG_STR) == item_count:
+        # All keys are strings, as they usually are.
+        keys = list(itertools.islice(iterators[TAG_STR], item_count))
+    else:
+        keys = list(map(next, map(iterators.__getitem__, key_tags)))
+    values = list(map(next, map(iterators.__getitem__, value_tags)))
+    if len(keys) != item_count or len(values) != item_count or any(next(it, None) is not None for it in iterators[:-1]):
+        raise ValueError('block has the wrong amount of data')
+
+    if len(operators) not in (0, item_count) or len(groups) not in (0, item_count):
+        raise ValueError('block has the wrong number of operators or group flags')
+    starts = list(itertools.accumulate(counts, initial = 0))
+    # Each tree's Tree values come from trees[1:] in order.
+    children = iter(trees[1:])
+    for tree, start, end in zip(trees, starts, starts[1:]):
+        tree_operators = None
+        if operators:
+            tree_operators = [strings[x] for x in operators[start:end]]
+            if tree_operators.count('=') == end - start: tree_operators = None
+        tree_groups = None
+        if groups and 1 in groups[start:end]: tree_groups = bytearray(groups[start:end])
+        tree._set_columns((keys[start:end], values[start:end], tree_operators, tree_groups, None, None))
+        if nest and end > start:
+            for child in itertools.islice(children, value_tags.count(TAG_TREE, start, end)): child._parent = tree
+
+    # Comments are in item order.
+    tree_index = 0
+    pos = 0
+    while pos < len(comment_data):
+        item = comment_data[pos]
+        if item >= item_count: raise IndexError('item %d out of range' % item)
+        while item >= starts[tree_index + 1]: tree_index += 1
+        tree = trees[tree_index]
+        i = item - starts[tree_index]
+        count = comment_data[pos + 1]
+        pre_comments = [strings[x] for x in comment_data[pos + 2:pos + 2 + count]]
+        line_comment = comment_data[pos + 2 + count]
+        if tree._comments is None: tree._comments = {}
+        tree._comments[i] = [pre_comments, None if line_comment == 0 else strings[line_comment - 1]]
+        pos += count + 3
+
+    pos = 0
+    while pos < len(end_comment_data):
+        tree = trees[end_comment_data[pos]]
+        count = end_comment_data[pos + 1]
+        tree.end_comments = [strings[x] for x in end_comment_data[pos + 2:pos + 2 + count]]
+        pos += count + 2
+
+    return trees[0], [i for i, tag in enumerate(value_tags) if tag == TAG_TREE]
+
+def _find_tree(tree, key_path):
+    """Follows key_path from tree as tree[key] would, returning None if it does not lead to a Tree."""
+    for key in key_path:
+        tree = tree.find(key, reverse = True)
+        if not isinstance(tree, pyradox.Tree): return None
+    return tree
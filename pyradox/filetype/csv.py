@@ -1,4 +1,5 @@
 import pyradox
+import pyradox.cache
 import pyradox.format
 import pyradox.token
 import pyradox.filetype.table
@@ -24,7 +25,10 @@ def parse_file(path, game = None, path_relative_to_game = True, headings = None)
         pass
     else:
         path, game = pyradox.config.combine_path_and_game(path, game)
-   
+    
+    return pyradox.cache.cached(path, ('csv', encoding, headings), _parse_file, path, headings)
+
+def _parse_file(path, headings):
     with open(path, encoding=encoding) as f:
         lines = [line for line in f.readlines() if not re.match('#.*', line)]
     return parse(lines, path, headings = headings)
@@ -1,19 +1,216 @@
+import pyradox
+
+import io
 import json
 
-def dump_tree(tree, fp, duplicate_action = 'list', **kwargs):
-    """ 
+def dump_tree(tree, fp, duplicate_action = 'list', lines = False, **kwargs):
+    """
     Dumps a Tree as json.dump.
-    First converts to_python using duplicate_action.
-    Additional kwargs are sent to json.dump.
+    The output is the same as json.dump of tree.to_python(duplicate_action = duplicate_action),
+    but is written as the tree is walked rather than converting the whole tree first.
+    If a duplicate raises an error, anything before it has already been written.
+    lines: If True, writes each top-level entry as a separate object on its own line (JSON lines), e.g. {"key": value}.
+        indent must not be used.
+    Additional kwargs are sent to json.JSONEncoder, as json.dump.
+    """
+    encoder = _TreeEncoder(fp, duplicate_action, **kwargs)
+    if lines:
+        encoder.write_lines(tree)
+    else:
+        encoder.write_tree(tree, 0)
+    encoder.flush(True)
+
+def dumps_tree(tree, duplicate_action = 'list', lines = False, **kwargs):
     """
-    obj = tree.to_python(duplicate_action = duplicate_action)
-    json.dump(obj, fp, **kwargs)
-    
-def dumps_tree(tree, duplicate_action = 'list', **kwargs):
-    """ 
-    Dumps a Tree as json.dumps.
-    First converts to_python using duplicate_action.
-    Additional kwargs are sent to json.dumps.
+    Dumps a Tree as json.dumps. Arguments are as dump_tree.
     """
-    obj = tree.to_python(duplicate_action = duplicate_action)
-    return json.dumps(obj, **kwargs)
\ No newline at end of file
+    fp = io.StringIO()
+    dump_tree(tree, fp, duplicate_action = duplicate_action, lines = lines, **kwargs)
+    return fp.getvalue()
+
+class _TreeEncoder():
+    """Writes Trees as JSON, formatted as json.dump would format the result of to_python."""
+
+    # Number of pieces collected before writing them to the file.
+    chunk_length = 4096
+
+    def __init__(self, fp, duplicate_action, cls = None, **kwargs):
+        allowed_duplicate_actions = ['error', 'overwrite', 'one_group', 'list']
+        if duplicate_action not in allowed_duplicate_actions:
+            raise ValueError('Invalid duplicate action "%s". Must be one of %s.' % (duplicate_action, allowed_duplicate_actions))
+
+        self.fp = fp
+        self.duplicate_action = duplicate_action
+        self.buffer = []
+
+        # Scalars and keys are encoded by the standard encoder, which handles ensure_ascii, allow_nan, default, etc.
+        self.encoder = (cls or json.JSONEncoder)(**kwargs)
+        if self.encoder.ensure_ascii:
+            self.encode_string = json.encoder.encode_basestring_ascii
+        else:
+            self.encode_string = json.encoder.encode_basestring
+        self.indent = self.encoder.indent
+        if self.indent is not None and not isinstance(self.indent, str):
+            self.indent = ' ' * self.indent
+
+    def flush(self, force = False):
+        if force or len(self.buffer) >= self.chunk_length:
+            self.fp.write(''.join(self.buffer))
+            self.buffer.clear()
+
+    def write_lines(self, tree):
+        if self.indent is not None:
+            raise ValueError('JSON lines output cannot be indented.')
+        out = self.buffer.append
+        items = self.layout(tree).items()
+        if self.encoder.sort_keys: items = sorted(items)
+        for key, position in items:
+            key = self.encode_key(key)
+            if key is None: continue
+            out('{%s%s' % (key, self.encoder.key_separator))
+            self.write_entry(tree, position, 0)
+            out('}\n')
+            self.flush()
+
+    def write_tree(self, tree, level):
+        out = self.buffer.append
+        layout = self.layout(tree)
+        if not layout:
+            out('{}')
+            return
+
+        out('{')
+        item_separator = self.encoder.item_separator
+        if self.indent is not None:
+            level += 1
+            newline_indent = '\n' + self.indent * level
+            item_separator += newline_indent
+            out(newline_indent)
+
+        items = layout.items()
+        if self.encoder.sort_keys: items = sorted(items)
+        first = True
+        for key, position in items:
+            key = self.encode_key(key)
+            if key is None: continue
+            if first: first = False
+            else: out(item_separator)
+            out(key)
+            out(self.encoder.key_separator)
+            self.write_entry(tree, position, level)
+
+        if self.indent is not None:
+            level -= 1
+            out('\n' + self.indent * level)
+        out('}')
+        self.flush()
+
+    def write_entry(self, tree, position, level):
+        """Writes the value at position, or a list of the values if position is a list."""
+        if not isinstance(position, list):
+            self.write_value(tree._values[position], level)
+            return
+
+        out = self.buffer.append
+        out('[')
+        separator = self.encoder.item_separator
+        if self.indent is not None:
+            level += 1
+            newline_indent = '\n' + self.indent * level
+            separator += newline_indent
+            out(newline_indent)
+
+        for j, i in enumerate(position):
+            if j > 0: out(separator)
+            self.write_value(tree._values[i], level)
+
+        if self.indent is not None:
+            level -= 1
+            out('\n' + self.indent * level)
+        out(']')
+
+    def write_value(self, value, level):
+        if isinstance(value, pyradox.Tree):
+            self.write_tree(value, level)
+        else:
+            # Checked for each value, so long lists and flat trees are written in chunks too.
+            buffer = self.buffer
+            buffer.append(self.encode_value(pyradox.datatype.util.to_python(value)))
+            if len(buffer) >= self.chunk_length: self.flush(True)
+
+    def encode_value(self, value):
+        # Shortcuts for the common types, since JSONEncoder.encode sets up a new encoder for each non-str value.
+        if isinstance(value, str):
+            return self.encode_string(value)
+        elif value is True:
+            return 'true'
+        elif value is False:
+            return 'false'
+        elif type(value) is int:
+            return int.__repr__(value)
+        else:
+            return self.encoder.encode(value)
+
+    def encode_key(self, key):
+        """Returns the encoded key as json.dump would, or None if it is skipped."""
+        if isinstance(key, str):
+            pass
+        elif isinstance(key, float):
+            key = self.encoder.encode(key)
+        elif key is True:
+            key = 'true'
+        elif key is False:
+            key = 'false'
+        elif key is None:
+            key = 'null'
+        elif isinstance(key, int):
+            key = int.__repr__(key)
+        elif self.encoder.skipkeys:
+            return None
+        else:
+            raise TypeError('keys must be str, int, float, bool or None, not %s' % key.__class__.__name__)
+        return self.encode_string(key)
+
+    def layout(self, tree):
+        """
+        Returns a dict with the keys of tree.to_python(duplicate_action), in the same order,
+        and for each the position of its value in the tree, or a list of positions if its value is a list.
+        Only the keys of the tree are examined.
+        """
+        duplicate_action = self.duplicate_action
+        result = {}
+        group_key = None # The key corresponding to the current group. None if no group in progress.
+        keys = tree._keys
+        values = tree._values
+        groups = tree._groups or bytes(len(keys))
+
+        for i, key in enumerate(keys):
+            in_group = groups[i]
+            python_key = pyradox.datatype.util.to_python(key)
+            if group_key is not None: # Last item was in a one_group.
+                if in_group and pyradox.datatype.util.match(key, group_key) and not isinstance(values[i], pyradox.Tree):
+                    # Continue the previous one_group.
+                    result[python_key].append(i)
+                    continue
+                else:
+                    # End the one_group.
+                    group_key = None
+            if in_group and duplicate_action == 'one_group':
+                if python_key in result:
+                    raise ValueError('to_python produced duplicate for key "%s". All but the last value will be overwritten.' % python_key)
+                # Start a group.
+                group_key = key
+                result[python_key] = [i]
+            elif python_key in result:
+                if duplicate_action == 'list':
+                    if not isinstance(result[python_key], list):
+                        result[python_key] = [result[python_key]]
+                    result[python_key].append(i)
+                elif duplicate_action == 'overwrite':
+                    result[python_key] = i
+                else:
+                    raise ValueError('to_python produced duplicate for key "%s". All but the last value will be overwritten.' % python_key)
+            else:
+                result[python_key] = i
+
+        return result
@@ -1,10 +1,22 @@
 import pyradox
+import pyradox.cache
 import pyradox.config
 import pyradox.token
+from pyradox.cache import gc_paused
 from pyradox.error import *
 
+import array
+import bisect
+import codecs
+import collections
+import concurrent.futures
+import copy
+import itertools
+import mmap
 import re
 import os
+import pickle
+import sys
 import warnings
 
 game_encodings = {
@@ -27,11 +39,71 @@ def readlines(filename, encodings):
             warnings.warn(ParseWarning("Failed to decode input file %s using codec %s." % (filename, encoding)))
     raise ParseError("All codecs failed for input file %s." % filename)
 
-def parse(s, filename="<string>"):
-    """Parse a string."""
-    lines = s.splitlines()
-    token_data = lex(lines, filename)
-    return parse_tree(token_data, filename)
+def iter_lines(f, filename, encodings, chunk_size = 1 << 16):
+    """
+    Iterates over the lines of a file opened in binary mode, as readlines would return them, decoding it a chunk at a time.
+    The encoding is utf_8_sig if the file starts with a byte order mark, and otherwise the first of encodings that can decode the first chunk.
+    If a later chunk fails to decode, the rest of the file is decoded with the next of encodings instead.
+    """
+    chunk = f.read(max(chunk_size, len(codecs.BOM_UTF8)))
+    if chunk[:3] == codecs.BOM_UTF8:
+        encodings = ['utf_8_sig']
+    encoding_index = 0
+    decoder = codecs.getincrementaldecoder(encodings[0])()
+    pending = '' # Start of a line not yet ended.
+    while True:
+        final = len(chunk) == 0
+        # Bytes of an incomplete character held over from the previous chunk.
+        buffered = decoder.getstate()[0]
+        try:
+            text = pending + decoder.decode(chunk, final)
+        except UnicodeDecodeError:
+            warnings.warn(ParseWarning("Failed to decode input file %s using codec %s." % (filename, encodings[encoding_index])))
+            encoding_index += 1
+            if encoding_index == len(encodings):
+                raise ParseError("All codecs failed for input file %s." % filename)
+            decoder = codecs.getincrementaldecoder(encodings[encoding_index])()
+            chunk = buffered + chunk
+            continue
+        
+        # Line breaks are normalized as in text mode. A carriage return at the end of a chunk may be followed by a newline in the next.
+        carry = ''
+        if not final and text.endswith('\r'):
+            text = text[:-1]
+            carry = '\r'
+        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        pending = lines.pop() + carry
+        for line in lines:
+            yield line + '\n'
+        
+        if final:
+            if pending: yield pending
+            return
+        chunk = f.read(chunk_size)
+
+def read(filename, encodings):
+    """Like readlines, but returns the whole file as a single string."""
+    for encoding in encodings:
+        try:
+            with open(filename, encoding=encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            warnings.warn(ParseWarning("Failed to decode input file %s using codec %s." % (filename, encoding)))
+    raise ParseError("All codecs failed for input file %s." % filename)
+
+def map_file(filename):
+    """Returns a read-only memory map of the file, which is closed once it is no longer referenced."""
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            return b''
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+def parse(s, filename="<string>", projection=None, lazy=False):
+    """Parse a string. projection and lazy are as parse_file."""
+    # Rejoining the lines normalizes line endings the same way the line-by-line lexer sees them.
+    token_data = lex_buffer('\n'.join(s.splitlines()), filename, strict_quotes = True)
+    return parse_tree(token_data, filename, projection = projection, lazy = lazy)
 
 def should_parse(fullpath, filename, filter_pattern = None):
     if not os.path.isfile(fullpath): return False
@@ -40,12 +112,20 @@ def should_parse(fullpath, filename, filter_pattern = None):
     if filter_pattern is not None and not re.search(filter_pattern, filename): return False
     return True
 
-def parse_file(path, game=None, path_relative_to_game=True, verbose=False):
+def parse_file(path, game=None, path_relative_to_game=True, verbose=False, projection=None, lazy=False, memory_map=False):
     """
     Parse a single file and return a Tree.
     path, game: 
         If game is None, path is a full path and the game is determined from that.
         Or game can be supplied, in which case path is a path relative to the game directory.
+    projection:
+        If supplied, only the selected items are parsed, and the rest of the file is skipped over. See compile_projection.
+    lazy:
+        If True, nested Trees are only parsed when their contents are first accessed. See LazyTree.
+    memory_map:
+        If True, the file is memory-mapped and lexed as bytes, decoding each token separately, rather than being read and decoded whole.
+        Uses much less memory for very large files such as saves. See lex_bytes.
+    If pyradox.config.cache_directory is set, results are cached there. See pyradox.cache.
     """
     if not path_relative_to_game:
         pass
@@ -53,42 +133,122 @@ def parse_file(path, game=None, path_relative_to_game=True, verbose=False):
         path, game = pyradox.config.combine_path_and_game(path, game)
     encodings = game_encodings[game]
     
-    lines = readlines(path, encodings)
     if verbose: print('Parsing file %s.' % path)
-    token_data = lex(lines, path)
-    return parse_tree(token_data, path)
+    if projection is None:
+        cache_options = ('txt', encodings, None)
+    elif callable(projection):
+        # Functions cannot be compared across runs.
+        return _parse_file(path, encodings, projection, lazy, memory_map)
+    else:
+        if isinstance(projection, (str, tuple)): projection = [projection]
+        cache_options = ('txt', encodings, sorted(repr(key_path) for key_path in projection))
+    
+    if lazy:
+        # A lazy Tree is only worth caching once it has been fully parsed, so only use existing entries.
+        result = pyradox.cache.load(path, cache_options)
+        if result is not None: return result
+        return _parse_file(path, encodings, projection, lazy, memory_map)
+    
+    return pyradox.cache.cached(path, cache_options, _parse_file, path, encodings, projection, lazy, memory_map)
+
+def _parse_file(path, encodings, projection, lazy, memory_map):
+    if memory_map:
+        token_data = lex_bytes(map_file(path), path, encodings)
+    else:
+        s = read(path, encodings)
+        token_data = lex_buffer(s, path)
+    return parse_tree(token_data, path, projection = projection, lazy = lazy)
+    
+def parse_files(paths, workers = None, **kwargs):
+    """
+    Iterate over parse_file(path, **kwargs) for each of paths, in order.
+    workers: 
+        If supplied, files are parsed by a pool of this many processes, and each result is produced as soon as it and all before it are ready.
+        Arguments must then be picklable, so a projection must be given as key paths rather than a function.
+    """
+    if workers is None:
+        for path in paths:
+            yield parse_file(path, **kwargs)
+        return
     
-def parse_dir(path, game=None, filter_pattern = None, *args, **kwargs):
-    """Given a directory, iterate over the content of the .txt files in that directory as Trees"""
+    paths = list(paths)
+    # Handing out several files at a time keeps the overhead low for directories of many small files.
+    chunksize = max(1, len(paths) // (4 * workers))
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        for data in executor.map(_parse_file_pickled, paths, itertools.repeat(kwargs), chunksize = chunksize):
+            # Unpickling is much faster with the garbage collector paused, which it cannot be in the executor's own thread.
+            with gc_paused():
+                tree = pickle.loads(data)
+            yield tree
+    finally:
+        executor.shutdown(cancel_futures = True)
+
+def _parse_file_pickled(path, kwargs):
+    tree = parse_file(path, **kwargs)
+    with gc_paused():
+        return pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+
+def parse_dir(path, game=None, filter_pattern = None, workers = None, **kwargs):
+    """
+    Given a directory, iterate over the content of the .txt files in that directory as Trees.
+    workers: As parse_files.
+    """
     path, game = pyradox.config.combine_path_and_game(path, game)
     
-    for filename in os.listdir(path):
-        fullpath = os.path.join(path, filename)
-        if should_parse(fullpath, filename, filter_pattern):
-            yield filename, parse_file(fullpath, game = game, *args, **kwargs)
+    filenames = [filename for filename in os.listdir(path) if should_parse(os.path.join(path, filename), filename, filter_pattern)]
+    trees = parse_files((os.path.join(path, filename) for filename in filenames), workers, game = game, **kwargs)
+    yield from zip(filenames, trees)
 
-def parse_merge(path, game=None, filter_pattern = None, merge_levels = 0, apply_defines = False, *args, **kwargs):
-    """Given a directory, return a Tree as if all .txt files in the directory were a single file"""
+def parse_merge(path, game=None, filter_pattern = None, merge_levels = 0, apply_defines = False, workers = None, **kwargs):
+    """
+    Given a directory, return a Tree as if all .txt files in the directory were a single file.
+    merge_levels: As Tree.merge.
+    workers: As parse_files. Files are still merged in directory order.
+    """
     path, game = pyradox.config.combine_path_and_game(path, game)
     
     result = pyradox.Tree()
-    for filename in os.listdir(path):
-        fullpath = os.path.join(path, filename)
-        if os.path.isfile(fullpath):
-            if should_parse(fullpath, filename, filter_pattern):
-                tree = parse_file(fullpath, game = game, *args, **kwargs)
-                if apply_defines:
-                    tree = tree.apply_defines()
-                result.merge(tree, merge_levels)
+    for filename, tree in parse_dir(path, game, filter_pattern, workers, **kwargs):
+        if apply_defines:
+            tree = tree.apply_defines()
+        # Each tree is freshly parsed, so its contents can be moved rather than copied.
+        result.merge(tree, merge_levels, move = True)
     return result
 
-def parse_walk(dirname, filter_pattern = None, *args, **kwargs):
-    """Given a directory, recursively iterate over the content of the .txt files in that directory as Trees"""
+def parse_walk(dirname, filter_pattern = None, workers = None, **kwargs):
+    """
+    Given a directory, recursively iterate over the content of the .txt files in that directory as Trees.
+    workers: As parse_files.
+    """
+    filenames = []
+    fullpaths = []
     for root, dirs, files in os.walk(dirname):
         for filename in files:
             fullpath = os.path.join(root, filename)
             if should_parse(fullpath, filename, filter_pattern):
-                yield filename, parse_file(fullpath, *args, **kwargs)
+                filenames.append(filename)
+                fullpaths.append(fullpath)
+    yield from zip(filenames, parse_files(fullpaths, workers, **kwargs))
+
+def iterparse(path, game=None, path_relative_to_game=True):
+    """
+    Parse a single file incrementally, without building a Tree. Returns an IterParser, which yields events as it reads the file.
+    Useful for reading a few keys from a very large file such as a save.
+    path, game: As parse_file.
+    """
+    if not path_relative_to_game:
+        pass
+    else:
+        path, game = pyradox.config.combine_path_and_game(path, game)
+    encodings = game_encodings[game]
+    
+    f = open(path, 'rb')
+    return IterParser(lex_iter(iter_lines(f, path, encodings), path), path, f)
+
+def dump(tree, fp, indent_string = '    ', include_comments = True):
+    """Writes a Tree in .txt format to a text file-like object. The output is the same as tree.prettyprint, but is written as it goes."""
+    tree.write(fp, indent_string = indent_string, include_comments = include_comments)
 
 # open questions:
 # what characters are allowed in key strings?
@@ -123,9 +283,278 @@ def lex_iter(file_lines, filename):
         for m in omnibus_pattern.finditer(line) if m.lastgroup not in ('whitespace',)
         )
         
+# Whole-buffer lexer. Instead of producing whitespace tokens, each match begins by skipping any whitespace.
+# Each token type is a single top-level group, so the token itself is the group given by lastindex.
+# strict_quotes = True requires quoted strings to end with a quote, which matches what the line lexer does with lines that have had their newlines stripped.
+
+def _make_buffer_pattern(strict_quotes):
+    result = r'\s*(?:'
+    for token_type, p in token_types:
+        if token_type == 'whitespace': continue
+        if token_type == 'str' and strict_quotes:
+            p = p.replace('["\\n]', '"', 1)
+        result += '(?P<' + token_type + '>' + p + ')'
+        result += '|'
+    result += r'(\S.*))'
+    return re.compile(result)
+
+buffer_patterns = {
+    False : _make_buffer_pattern(False),
+    True : _make_buffer_pattern(True),
+    }
+
+class TokenStream():
+    """
+    Compact lexer output. Token types, token strings and token offsets are kept in parallel sequences.
+    Line numbers are not stored; they are computed from the offsets only when something (e.g. a warning) needs them.
+    matches gives the position of the matching bracket for each bracket token (-1 if unmatched or not a bracket),
+    and trees is nonzero for each opening bracket that begins a tree rather than a group.
+    Indexing gives the same (token_type, token_string, line_number) tuples as lex().
+    """
+    def __init__(self, types, strings, offsets = None, source = None, line_numbers = None):
+        self.types = types                  # List of token types.
+        self.strings = strings              # List of token strings.
+        self.offsets = offsets              # Offset of each token in source.
+        self.source = source                # The buffer that was lexed.
+        self.line_numbers = line_numbers    # Explicit line numbers, used instead of offsets if the tokens did not come from a buffer.
+        self._newlines = None               # Offsets of newlines in source, computed on demand.
+        self.matches, self.trees = match_brackets(types)
+    
+    @staticmethod
+    def from_token_data(token_data):
+        """Converts a list of (token_type, token_string, line_number) tuples as produced by lex()."""
+        types = [token_type for token_type, token_string, line_number in token_data]
+        strings = [token_string for token_type, token_string, line_number in token_data]
+        line_numbers = [line_number for token_type, token_string, line_number in token_data]
+        return TokenStream(types, strings, line_numbers = line_numbers)
+    
+    def __len__(self):
+        return len(self.types)
+    
+    def __getitem__(self, i):
+        return self.types[i], self.strings[i], self.line_number(i)
+        
+    def line_number(self, i):
+        """Zero-based line number of the ith token."""
+        if self.line_numbers is not None:
+            return self.line_numbers[i]
+        if self._newlines is None:
+            newline = '\n' if isinstance(self.source, str) else b'\n'
+            self._newlines = [m.start() for m in re.finditer(newline, self.source)]
+        return bisect.bisect_left(self._newlines, self.offsets[i])
+    
+    def block_end(self, i):
+        """Position of the bracket matching the opening bracket at i, or the last token if it is never closed."""
+        end = self.matches[i]
+        if end < 0: return len(self.types) - 1
+        return end
+    
+    def same_line(self, i, j):
+        """True iff tokens i < j start on the same line. False if i is negative."""
+        if i < 0: return False
+        if self.line_numbers is not None:
+            return self.line_numbers[i] == self.line_numbers[j]
+        newline = '\n' if isinstance(self.source, str) else b'\n'
+        return self.source.find(newline, self.offsets[i], self.offsets[j]) < 0
+
+def match_brackets(types):
+    """
+    Computes the matching bracket table and tree flags for a list of token types in one pass.
+    A block is a tree if it has an operator at its own level, or if it has nothing but comments at its own level (e.g. {}).
+    Otherwise it is a group.
+    """
+    matches = array.array('l', [-1]) * len(types)
+    trees = bytearray(len(types))
+    stack = []      # Positions of currently open brackets.
+    states = []     # Enclosing levels' states.
+    state = 0       # State of the current level. 0 = only comments so far, 1 = values but no operator, 2 = operator.
+    for i, token_type in enumerate(types):
+        if token_type == 'operator':
+            state = 2
+        elif token_type == 'begin':
+            if state == 0: state = 1
+            stack.append(i)
+            states.append(state)
+            state = 0
+        elif token_type == 'end':
+            if stack:
+                begin = stack.pop()
+                matches[begin] = i
+                matches[i] = begin
+                if state != 1: trees[begin] = 1
+                state = states.pop()
+        elif token_type != 'comment':
+            if state == 0: state = 1
+    
+    # Blocks left open at the end of the file.
+    while stack:
+        begin = stack.pop()
+        if state != 1: trees[begin] = 1
+        state = states.pop()
+    return matches, trees
+
+def lex_buffer(s, filename, strict_quotes = False):
+    """Lexer. Given the contents of a file as a single string, produces a TokenStream in one pass over the string."""
+    types = []
+    strings = []
+    offsets = array.array('l')
+    append_type = types.append
+    append_string = strings.append
+    append_offset = offsets.append
+    intern = _interner()
+    with gc_paused():
+        for m in buffer_patterns[strict_quotes].finditer(s, 0, _scan_end(s)):
+            group = m.lastindex
+            token_type = m.lastgroup
+            token_string = m.group(group)
+            if token_type == 'str' and token_string[0] != '"': token_string = intern(token_string)
+            append_type(token_type)
+            append_string(token_string)
+            append_offset(m.start(group))
+        return TokenStream(types, strings, offsets, s)
+
+def _interner():
+    """
+    Returns the function the lexers pass unquoted str tokens (keys and bare values such as tags) through.
+    Other tokens are not interned, since interned strings are never freed on recent Pythons, and free text,
+    comments and numbers are seldom repeated or are converted by the parser anyway.
+    """
+    if pyradox.config.intern_strings: return sys.intern
+    else: return str
+
+def _scan_end(s):
+    """
+    Where to stop scanning s. Trailing whitespace after the end of the last line with a token on it is excluded,
+    so that the leading whitespace skip does not rescan it at every position.
+    The rest of that line, including the line break (which may end a quoted string), is kept, since it may belong to the token.
+    """
+    end = len(s)
+    while end > 0 and s[end - 1].isspace():
+        end -= 1
+    newline = s.find('\n', end)
+    if newline < 0: return len(s)
+    return newline + 1
+
+# Bytes lexer. The buffer pattern is rewritten to work on undecoded bytes:
+# \s, \S and \b are spelled out as the bytes that decode to whitespace or word characters in the file's encoding,
+# and carriage returns are treated as part of a line break, as reading the file in text mode would.
+
+def _byte_classes(encoding):
+    """
+    Returns the contents of regex character classes matching the bytes that decode to whitespace and to word characters.
+    Bytes that do not decode on their own (including all non-ASCII bytes of multibyte encodings) count as word characters.
+    """
+    whitespace = ''
+    word = ''
+    for b in range(256):
+        try:
+            c = bytes([b]).decode(encoding)
+        except UnicodeDecodeError:
+            word += '\\x%02x' % b
+            continue
+        if c.isspace():
+            whitespace += '\\x%02x' % b
+        elif c.isalnum() or c == '_':
+            word += '\\x%02x' % b
+    return whitespace, word
+
+def _make_bytes_pattern(encoding, strict_quotes):
+    whitespace, word = _byte_classes(encoding)
+    result = _make_buffer_pattern(strict_quotes).pattern
+    replacements = [
+        (r'#.*', r'#[^\r\n]*'),
+        (r'[^"\\\n]', r'[^"\\\r\n]'),
+        (r'\\.', r'\\[^\r\n]'),
+        (r'["\n]', r'(?:"|\r\n?|\n)'),
+        (r'[^#=\{\}\s]', r'[^#=\{\}' + whitespace + ']'),
+        (r'(\S.*)', r'([^' + whitespace + r'][^\r\n]*)'),
+        (r'\s*', '[' + whitespace + ']*'),
+        (r'\b', '(?:(?<=[' + word + '])(?![' + word + '])|(?<![' + word + '])(?=[' + word + ']))'),
+        ]
+    for old, new in replacements:
+        if old == r'["\n]' and strict_quotes: continue
+        if old not in result:
+            raise ValueError('Buffer pattern does not contain %s.' % old)
+        result = result.replace(old, new)
+    return re.compile(result.encode('ascii'))
+
+bytes_patterns = {} # (encoding, strict_quotes) : pattern, compiled on demand.
+
+def lex_bytes(buf, filename, encodings, strict_quotes = False):
+    """
+    Lexer. Given the contents of a file as a bytes-like object (such as the result of map_file), produces a TokenStream.
+    Rather than decoding the whole file, each token is decoded separately. 
+    The encoding is utf_8_sig if the file starts with a byte order mark, and otherwise the first of encodings.
+    Any token that fails to decode is decoded with the next of encodings instead.
+    Files using lone carriage returns as line breaks are not supported.
+    In multibyte encodings, non-ASCII characters outside quoted strings are all treated as word characters,
+    so e.g. a non-breaking space does not separate tokens as it does in lex_buffer.
+    """
+    if buf[:3] == codecs.BOM_UTF8:
+        encodings = ['utf_8']
+        start = 3
+    else:
+        encodings = [('utf_8' if encoding == 'utf_8_sig' else encoding) for encoding in encodings]
+        start = 0
+    encoding = encodings[0]
+    # Most tokens are ASCII, which decodes much faster on its own than with e.g. cp1252.
+    ascii_compatible = bytes(range(128)).decode(encoding) == ''.join(chr(c) for c in range(128))
+    
+    key = (encoding, strict_quotes)
+    if key not in bytes_patterns:
+        bytes_patterns[key] = _make_bytes_pattern(encoding, strict_quotes)
+    
+    types = []
+    strings = []
+    offsets = array.array('l')
+    append_type = types.append
+    append_string = strings.append
+    append_offset = offsets.append
+    intern = _interner()
+    with gc_paused():
+        for m in bytes_patterns[key].finditer(buf, start, _scan_end_bytes(buf)):
+            group = m.lastindex
+            token_type = m.lastgroup
+            token_bytes = m.group(group)
+            if ascii_compatible and token_bytes.isascii():
+                token_string = token_bytes.decode('ascii')
+            else:
+                token_string = _decode(token_bytes, encodings, filename)
+            if token_type == 'str' and not strict_quotes and '\r' in token_string:
+                # Quoted string ended by a line break.
+                token_string = token_string.rstrip('\r\n') + '\n'
+            elif token_type == 'str' and token_string[0] != '"':
+                token_string = intern(token_string)
+            append_type(token_type)
+            append_string(token_string)
+            append_offset(m.start(group))
+        return TokenStream(types, strings, offsets, buf)
+
+def _decode(token_bytes, encodings, filename):
+    """Decodes a token with the first of encodings that can decode it."""
+    for encoding in encodings:
+        try:
+            token_string = token_bytes.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        if encoding == encodings[0]:
+            return token_string
+        warnings.warn(ParseWarning("Failed to decode token in input file %s using codec %s. Using codec %s instead." % (filename, encodings[0], encoding)))
+        return token_string
+    raise ParseError("All codecs failed for token %r in input file %s." % (token_bytes, filename))
+
+def _scan_end_bytes(buf):
+    """As _scan_end, for ASCII whitespace in a bytes-like object."""
+    end = len(buf)
+    while end > 0 and buf[end - 1] in b' \t\n\r\f\v':
+        end -= 1
+    newline = buf.find(b'\n', end)
+    if newline < 0: return len(buf)
+    return newline + 1
+
 class TreeParseState():
     def __init__(self, token_data, filename, start_pos, is_top_level):
-        self.token_data = token_data          # The tokenized version of the file. List of (token_type, token_string, token_line_number) tuples.
+        self.token_data = token_data          # The tokenized version of the file. A TokenStream.
         self.filename = filename            # File the tree is being parsed from. Used for warning and error messages.
         self.is_top_level = is_top_level        # True iff this tree is the top level of the file.
     
@@ -142,9 +571,17 @@ class TreeParseState():
     def get_previous_line_number(self):
         """ Line number of the token just before the one consumed. Returns -1 if the token just consumed was the first one."""
         if len(self.token_data) > 0 and self.pos > 1:
-            return self.token_data[self.pos-2][2]
+            return self.token_data.line_number(self.pos-2)
         return -1
     
+    def get_line_number(self):
+        """ Line number of the token just consumed. """
+        return self.token_data.line_number(self.pos-1)
+    
+    def is_on_previous_line(self):
+        """ True iff the token just consumed is on the same line as the token before it. """
+        return self.token_data.same_line(self.pos-2, self.pos-1)
+    
     def parse(self):
         """ Called once to parse. """
         while self.pos < len(self.token_data) and self.next is not None:
@@ -164,10 +601,11 @@ class TreeParseState():
             return self.result, self.pos
     
     def consume(self):
-        """ Read the next tuple from the list and advance the position counter. """
-        token_type, token_string, token_line_number = self.token_data[self.pos]
+        """ Read the next token type and string and advance the position counter. """
+        token_type = self.token_data.types[self.pos]
+        token_string = self.token_data.strings[self.pos]
         self.pos += 1
-        return token_type, token_string, token_line_number
+        return token_type, token_string
         
     def append_to_result(self, value):
         """ 
@@ -182,23 +620,17 @@ class TreeParseState():
         """
         Appends a line comment if not already set; otherwise appends to post_comments.
         """
-        
-        if len(self.result) == 0: return
-        
-        if self.result.get_line_comment_at(-1) is None:
-            self.result.set_line_comment_at(-1, comment)
-        else:
-            self.result.get_post_comments_at(-1).append(comment)
+        append_line_comment(self.result, comment)
         
     def process_key(self):
-        token_type, token_string, token_line_number = self.consume()
+        token_type, token_string = self.consume()
         
         if pyradox.token.is_primitive_key_token_type(token_type):
             self.key_string = token_string
             self.key = pyradox.token.make_primitive(token_string, token_type)
             self.next = self.process_operator
         elif token_type == 'comment':
-            if token_line_number == self.get_previous_line_number():
+            if self.is_on_previous_line():
                 # Comment following a previous value.
                 self.append_line_comment(token_string[1:])
             else:
@@ -207,18 +639,18 @@ class TreeParseState():
         elif token_type == 'end':
             if self.is_top_level:
                 # top level cannot be ended, warn
-                warnings.warn_explicit('Unmatched closing bracket at outer level of file. Skipping token.', ParseWarning, self.filename, token_line_number + 1)
+                warnings.warn_explicit('Unmatched closing bracket at outer level of file. Skipping token.', ParseWarning, self.filename, self.get_line_number() + 1)
                 self.next = self.process_key
             else:
                 self.next = None
         else:
             #invalid key
-            warnings.warn_explicit('Token "%s" is not valid key. Skipping token.' % token_string, ParseWarning, self.filename, token_line_number + 1)
+            warnings.warn_explicit('Token "%s" is not valid key. Skipping token.' % token_string, ParseWarning, self.filename, self.get_line_number() + 1)
             self.next = self.process_key
     
     def process_operator(self):
         # expecting an operator
-        token_type, token_string, token_line_number = self.consume()
+        token_type, token_string = self.consume()
         
         if token_type == 'operator':
             self.operator = token_string
@@ -228,17 +660,17 @@ class TreeParseState():
             self.next = self.process_operator
         else:
             # missing operator; unconsume the token and move on
-            warnings.warn_explicit('Expected operator after key "%s". Treating operator as "=" and token "%s" as value.' % (self.key_string, token_string), ParseWarning, self.filename, token_line_number + 1)
+            warnings.warn_explicit('Expected operator after key "%s". Treating operator as "=" and token "%s" as value.' % (self.key_string, token_string), ParseWarning, self.filename, self.get_line_number() + 1)
             self.pos -= 1
             self.operator = '='
             self.next = self.process_value
         
     def process_value(self):
         # expecting a value
-        token_type, token_string, token_line_number = self.consume()
+        token_type, token_string = self.consume()
         
         if pyradox.token.is_primitive_value_token_type(token_type):
-            maybe_color = self.maybe_subprocess_color(token_string, token_line_number)
+            maybe_color = self.maybe_subprocess_color(token_string, self.get_line_number())
             if maybe_color is not None:
                 value = maybe_color
             else:
@@ -251,34 +683,12 @@ class TreeParseState():
             else:
                 self.next = self.process_key
         elif token_type == 'begin':
-            # Value is a tree or group. First, determine whether this is a tree or group.
-            lookahead_pos = self.pos
-            level = 0
-            
-            # Empty brackets are trees by default.
-            is_tree = True
-            while lookahead_pos < len(self.token_data) and level >= 0:
-                token_type, token_string, token_line_number = self.token_data[lookahead_pos]
-                lookahead_pos += 1
-                
-                if level == 0:
-                    if token_type == 'operator':
-                        # If an operator is found at this level, it's definitely a tree.
-                        is_tree = True
-                        break
-                    elif token_type not in ['comment', 'end']:
-                        # If something else (other than a comment or end) is found at this level, 
-                        # then it's a group unless an operator is found later.
-                        is_tree = False
-                
-                if token_type == 'begin':
-                    level += 1
-                elif token_type == 'end':
-                    level -= 1
+            # Value is a tree or group. The lexer has already determined which.
+            is_tree = self.token_data.trees[self.pos - 1]
 
             if is_tree:
                 # Recurse.
-                value, self.pos = parse_tree(self.token_data, self.filename, self.pos)
+                value, self.pos = TreeParseState(self.token_data, self.filename, self.pos, False).parse()
                 self.append_to_result(value)
                 
                 if self.in_group:
@@ -288,13 +698,13 @@ class TreeParseState():
             else:
                 # Process following values as a group.
                 if self.in_group:
-                    raise ParseError('%s, line %d: Error: Cannot nest groups inside groups.' % (self.filename, token_line_number + 1))
+                    raise ParseError('%s, line %d: Error: Cannot nest groups inside groups.' % (self.filename, self.token_data.line_number(self.token_data.block_end(self.pos - 1)) + 1))
                 else:
                     self.in_group = True
                     self.next = self.process_value
         elif token_type == 'comment':
             if self.in_group:
-                if token_line_number == self.get_previous_line_number():
+                if self.is_on_previous_line():
                     self.append_line_comment(token_string[1:])
                 else:
                     self.pending_comments.append(token_string[1:])
@@ -305,7 +715,7 @@ class TreeParseState():
             self.in_group = False
             self.next = self.process_key
         else:
-            raise ParseError('%s, line %d: Error: Invalid token type %s after key "%s", expected a value type.' % (self.filename, token_line_number + 1, token_type, self.key_string))
+            raise ParseError('%s, line %d: Error: Invalid token type %s after key "%s", expected a value type.' % (self.filename, self.get_line_number() + 1, token_type, self.key_string))
         
     def maybe_subprocess_color(self, colorspace_token_string, colorspace_token_line_number):
         # Try to parse a color. 
@@ -316,49 +726,646 @@ class TreeParseState():
         if colorspace not in pyradox.Color.COLORSPACES:
             return None
         
-        # Possible comments to add.
-        maybe_pre_comments = []
-        
-        # Expected sequence of non-comment tokens.
-        COLOR_SEQUENCE = [['begin']] + [['int', 'float']] * 3 + [['end']]
-        
-        # Current position in the sequence.
-        seq = 0
+        maybe_pos, maybe_pre_comments, channels = match_color(self.token_data, self.pos)
+        if channels is not None:
+            # Finished color. Update state.
+            self.pending_comments += maybe_pre_comments
+            self.pos = maybe_pos
+            color = pyradox.Color(channels, colorspace)
+            return color
         
-        channels = []
+        warnings.warn_explicit('Found colorspace token %s without following color.' % (colorspace_token_string.lower()), ParseWarning, self.filename, colorspace_token_line_number + 1)
+        return None
+
+def match_color(token_data, pos):
+    """
+    Checks whether the tokens starting at pos (just after a colorspace token) are a bracketed color, e.g. { 1 100 200 }.
+    Returns (position after the color, comments found along the way, channels), or (pos, None, None) if not.
+    """
+    types = token_data.types
+    strings = token_data.strings
+    comments = []
+    
+    # Comments may come before the opening bracket.
+    while pos < len(types) and types[pos] == 'comment':
+        comments.append(strings[pos])
+        pos += 1
+    if pos >= len(types) or types[pos] != 'begin':
+        return pos, None, None
+    end = token_data.matches[pos]
+    if end < 0:
+        return pos, None, None
+    
+    channels = []
+    for i in range(pos + 1, end):
+        token_type = types[i]
+        if token_type == 'comment':
+            comments.append(strings[i])
+        elif token_type in ('int', 'float') and len(channels) < 3:
+            channels.append(pyradox.token.make_primitive(strings[i], token_type))
+        else:
+            return pos, None, None
+    if len(channels) < 3:
+        return pos, None, None
+    return end + 1, comments, channels
+
+def append_line_comment(tree, comment):
+    """
+    Appends a line comment to the last item of tree if not already set; otherwise appends to post_comments.
+    """
+    
+    if len(tree) == 0: return
+    
+    if tree.get_line_comment_at(-1) is None:
+        tree.set_line_comment_at(-1, comment)
+    else:
+        tree.get_post_comments_at(-1).append(comment)
+
+# Parser states for parse_token_stream.
+_EXPECT_KEY = 0
+_EXPECT_OPERATOR = 1
+_EXPECT_VALUE = 2
+
+# Only str tokens can be colorspaces, so this avoids lowercasing every value.
+_colorspace_strings = set()
+for colorspace in pyradox.Color.COLORSPACES:
+    for mask in range(1 << len(colorspace)):
+        _colorspace_strings.add(''.join(c.upper() if mask & (1 << i) else c for i, c in enumerate(colorspace)))
+
+def compile_projection(projection):
+    """
+    Converts a projection into a function that takes the path of an item (the tuple of keys leading to it from the top level)
+    and returns one of _SKIP, _SELECT_CHILDREN or _SELECT_ALL.
+    A projection is one of:
+        A function that takes the path of an item and returns True iff the item should be kept. 
+            Items whose parent is skipped are skipped without being checked.
+        An iterable of key paths. Each key path is a tuple of keys or a string of keys separated by '/', 
+            e.g. 'technologies' or ('sub_units', 'infantry'). Keys are matched case-insensitively, and '*' matches any key.
+            An item is kept if its path is a prefix of a key path (keeping only the selected children),
+            or if a key path is a prefix of its path (keeping it whole).
+            A single string is treated as a single key path.
+    """
+    if callable(projection):
+        return lambda path: _SELECT_CHILDREN if projection(path) else _SKIP
+    
+    if isinstance(projection, (str, tuple)):
+        projection = [projection]
+    
+    key_paths = []
+    for key_path in projection:
+        if isinstance(key_path, str):
+            key_path = tuple(pyradox.token.make_primitive(key, default_token_type = 'str') for key in key_path.split('/'))
+        key_paths.append(tuple(key_path))
+    
+    def select(path):
+        result = _SKIP
+        for key_path in key_paths:
+            if all(spec == '*' or pyradox.datatype.util.match(key, spec) for key, spec in zip(path, key_path)):
+                if len(path) >= len(key_path):
+                    return _SELECT_ALL
+                result = _SELECT_CHILDREN
+        return result
+    
+    return select
+
+# Results of a compiled projection.
+_SKIP = 0
+_SELECT_CHILDREN = 1
+_SELECT_ALL = 2
+
+def parse_token_stream(token_data, filename, start_pos = 0, is_top_level = True, projection = None, lazy = False, path = (), end_pos = None):
+    """
+    Non-recursive parser. Produces the same result as TreeParseState, but keeps enclosing levels on an explicit stack
+    rather than the call stack, and runs the whole state machine in a single loop.
+    Returns a Tree if is_top_level, and (Tree, position after the closing bracket) otherwise.
+    If a compiled projection is supplied, blocks that are not selected are jumped over using the bracket matches.
+    path is the path of the Tree being parsed, for the projection.
+    If lazy, nested Trees are not parsed, but returned as LazyTrees over their span of token_data.
+    end_pos is the position of the closing bracket matching the one before start_pos, if known.
+    Closing brackets before it that do not close an inner level are skipped, as at the top level.
+    """
+    types = token_data.types
+    strings = token_data.strings
+    trees = token_data.trees
+    matches = token_data.matches
+    token_count = len(types)
+    
+    key_constructors = pyradox.token.key_constructors
+    value_constructors = pyradox.token.constructors
+    Tree = pyradox.Tree
+    
+    pos = start_pos
+    stack = []          # (result, pending_comments, key, key_string, operator, in_group, path, selection, item_selection) of each enclosing level.
+    
+    # State of the current level, as in TreeParseState.
+    result = Tree()
+    pending_comments = []
+    key = None
+    key_string = None
+    operator = None
+    in_group = False
+    state = _EXPECT_KEY
+    
+    # Projection state. path holds the keys leading to the current level.
+    selection = _SELECT_ALL if projection is None else _SELECT_CHILDREN # Selection of the current level.
+    item_selection = _SELECT_ALL                # Selection of the current item or group.
+    skipped_last = False                        # Whether the last item was skipped, in which case its line comment is too.
+    
+    while True:
+        if pos >= token_count:
+            # End of file reached.
+            if not stack and is_top_level:
+                if pending_comments: result.end_comments = pending_comments
+                return result
+            line_number = token_data.line_number(pos - 2) if pos > 1 else -1
+            warnings.warn_explicit('Cannot end inner level with end of file.', ParseWarning, filename, line_number + 1)
+            if not stack:
+                return result, pos
+            value = result
+            result, pending_comments, key, key_string, operator, in_group, path, selection, item_selection = stack.pop()
+            result._append(key, value, operator, in_group, pending_comments)
+            pending_comments = []
+            skipped_last = False
+            state = _EXPECT_VALUE if in_group else _EXPECT_KEY
+            continue
         
-        maybe_pos = self.pos
+        token_type = types[pos]
+        pos += 1
         
-        while maybe_pos < len(self.token_data):
-            token_type, token_string, token_line_number = self.token_data[maybe_pos]
-            maybe_pos += 1
-            if token_type == 'comment':
-                maybe_pre_comments.append(token_string)
-            elif token_type in COLOR_SEQUENCE[seq]:
-                if token_type in ['int', 'float']:
-                    channels.append(pyradox.token.make_primitive(token_string, token_type))
-                seq += 1
-                if seq >= len(COLOR_SEQUENCE):
-                    # Finished color. Update state.
-                    self.pending_comments += maybe_pre_comments
-                    self.pos = maybe_pos
-                    color = pyradox.Color(channels, colorspace)
-                    return color
+        if state == _EXPECT_KEY:
+            if token_type in key_constructors:
+                key_string = strings[pos - 1]
+                key = value_constructors[token_type](key_string)
+                state = _EXPECT_OPERATOR
+            elif token_type == 'comment':
+                if token_data.same_line(pos - 2, pos - 1):
+                    # Comment following a previous value.
+                    if not skipped_last:
+                        append_line_comment(result, strings[pos - 1][1:])
+                else:
+                    pending_comments.append(strings[pos - 1][1:])
+            elif token_type == 'end':
+                if not stack and is_top_level:
+                    # top level cannot be ended, warn
+                    warnings.warn_explicit('Unmatched closing bracket at outer level of file. Skipping token.', ParseWarning, filename, token_data.line_number(pos - 1) + 1)
+                elif not stack and end_pos is not None and pos - 1 < end_pos:
+                    # The level must extend to its matching bracket, since that is where the enclosing level resumed.
+                    warnings.warn_explicit('Unmatched closing bracket. Skipping token.', ParseWarning, filename, token_data.line_number(pos - 1) + 1)
+                else:
+                    # End of tree reached.
+                    if pending_comments: result.end_comments = pending_comments
+                    if not stack:
+                        return result, pos
+                    value = result
+                    result, pending_comments, key, key_string, operator, in_group, path, selection, item_selection = stack.pop()
+                    result._append(key, value, operator, in_group, pending_comments)
+                    pending_comments = []
+                    skipped_last = False
+                    state = _EXPECT_VALUE if in_group else _EXPECT_KEY
             else:
-                # Unexpected token.
-                break
-        
-        warnings.warn_explicit('Found colorspace token %s without following color.' % (colorspace_token_string.lower()), ParseWarning, self.filename, colorspace_token_line_number + 1)
-        return None
+                #invalid key
+                warnings.warn_explicit('Token "%s" is not valid key. Skipping token.' % strings[pos - 1], ParseWarning, filename, token_data.line_number(pos - 1) + 1)
+        elif state == _EXPECT_OPERATOR:
+            if token_type == 'operator':
+                operator = strings[pos - 1]
+                state = _EXPECT_VALUE
+            elif token_type == 'comment':
+                pending_comments.append(strings[pos - 1][1:])
+            else:
+                # missing operator; unconsume the token and move on
+                warnings.warn_explicit('Expected operator after key "%s". Treating operator as "=" and token "%s" as value.' % (key_string, strings[pos - 1]), ParseWarning, filename, token_data.line_number(pos - 1) + 1)
+                pos -= 1
+                operator = '='
+                state = _EXPECT_VALUE
+        else:
+            if selection == _SELECT_CHILDREN and not in_group and (token_type in value_constructors or token_type == 'begin'):
+                item_selection = projection(path + (key,))
+            
+            if token_type in value_constructors:
+                token_string = strings[pos - 1]
+                value = None
+                if token_type == 'str' and token_string in _colorspace_strings:
+                    color_pos, color_comments, channels = match_color(token_data, pos)
+                    if channels is not None:
+                        pending_comments += color_comments
+                        pos = color_pos
+                        value = pyradox.Color(channels, token_string)
+                    else:
+                        warnings.warn_explicit('Found colorspace token %s without following color.' % (token_string.lower()), ParseWarning, filename, token_data.line_number(pos - 1) + 1)
+                if item_selection == _SKIP:
+                    skipped_last = True
+                else:
+                    if value is None:
+                        value = value_constructors[token_type](token_string)
+                    result._append(key, value, operator, in_group, pending_comments)
+                    skipped_last = False
+                pending_comments = []
+                if not in_group:
+                    state = _EXPECT_KEY
+            elif token_type == 'begin':
+                if item_selection == _SKIP and not in_group:
+                    # Jump over the whole block, whether it is a tree or a group.
+                    end = matches[pos - 1]
+                    pos = token_count if end < 0 else end + 1
+                    pending_comments = []
+                    skipped_last = True
+                    state = _EXPECT_KEY
+                elif trees[pos - 1] and lazy:
+                    # Leave the new level for later.
+                    if selection == _SELECT_CHILDREN and item_selection == _SELECT_CHILDREN:
+                        value = LazyTree(token_data, filename, pos, projection, path + (key,))
+                    else:
+                        value = LazyTree(token_data, filename, pos)
+                    result._append(key, value, operator, in_group, pending_comments)
+                    pending_comments = []
+                    skipped_last = False
+                    end = matches[pos - 1]
+                    pos = token_count if end < 0 else end + 1
+                    state = _EXPECT_VALUE if in_group else _EXPECT_KEY
+                elif trees[pos - 1]:
+                    # Start a new level.
+                    stack.append((result, pending_comments, key, key_string, operator, in_group, path, selection, item_selection))
+                    if selection == _SELECT_CHILDREN:
+                        path = path + (key,)
+                        selection = item_selection
+                    result = Tree()
+                    pending_comments = []
+                    key = None
+                    key_string = None
+                    operator = None
+                    in_group = False
+                    state = _EXPECT_KEY
+                elif in_group:
+                    raise ParseError('%s, line %d: Error: Cannot nest groups inside groups.' % (filename, token_data.line_number(token_data.block_end(pos - 1)) + 1))
+                else:
+                    # Process following values as a group.
+                    in_group = True
+            elif token_type == 'comment':
+                if in_group and token_data.same_line(pos - 2, pos - 1):
+                    append_line_comment(result, strings[pos - 1][1:])
+                else:
+                    pending_comments.append(strings[pos - 1][1:])
+            elif token_type == 'end' and in_group:
+                in_group = False
+                state = _EXPECT_KEY
+            else:
+                raise ParseError('%s, line %d: Error: Invalid token type %s after key "%s", expected a value type.' % (filename, token_data.line_number(pos - 1) + 1, token_type, key_string))
 
-def parse_tree(token_data, filename, start_pos = 0):
-    """Given a list of (token_type, token_string, line_number) from the lexer, produces a Tree."""
+def parse_tree(token_data, filename, start_pos = 0, projection = None, lazy = False):
+    """
+    Given a TokenStream or a list of (token_type, token_string, line_number) from the lexer, produces a Tree.
+    If projection is supplied, only the selected items are included. See compile_projection.
+    If lazy, nested Trees are returned as LazyTrees.
+    """
+    if not isinstance(token_data, TokenStream):
+        token_data = TokenStream.from_token_data(token_data)
     is_top_level = (start_pos == 0)
      # if starting position is 0, check for extra token at beginning
-    if start_pos == 0 and len(token_data) >= 1 and re.search('txt$', token_data[0][1]):
+    if start_pos == 0 and len(token_data) >= 1 and re.search('txt$', token_data.strings[0]):
         token_type, token_string, line_number = token_data[0]
         print('%s, line %d: Skipping header token "%s".' % (filename, line_number + 1, token_string))
         start_pos = 1 # skip first token
     
-    state = TreeParseState(token_data, filename, start_pos, is_top_level)
-    return state.parse()
+    if projection is not None:
+        projection = compile_projection(projection)
+    
+    with gc_paused():
+        return parse_token_stream(token_data, filename, start_pos, is_top_level, projection, lazy)
+
+class LazyTree(pyradox.Tree):
+    """
+    A Tree that is parsed from its span of a TokenStream when its contents are first accessed, as produced by parse_file(lazy = True).
+    Any nested Trees are in turn LazyTrees.
+    Parse warnings and errors for its contents are raised when it is parsed rather than when the file is.
+    Copies share the TokenStream. Pickling parses it and produces an ordinary Tree.
+    """
+    
+    # Until parsed, _source is (token_data, filename, position after the opening bracket, projection, path)
+    # and the Tree slots are unset. Afterwards it is None.
+    __slots__ = ()
+    
+    def __init__(self, token_data, filename, start_pos, projection = None, path = ()):
+        self._source = (token_data, filename, start_pos, projection, path)
+        self._parent = None
+    
+    def __getattr__(self, name):
+        # Only called for unset slots.
+        if name == '_source' or name not in pyradox.Tree.__slots__: raise AttributeError(name)
+        self._parse()
+        return getattr(self, name)
+    
+    def _parse(self):
+        token_data, filename, start_pos, projection, path = self._source
+        with gc_paused():
+            end_pos = token_data.matches[start_pos - 1]
+            if end_pos < 0: end_pos = None
+            tree, pos = parse_token_stream(token_data, filename, start_pos, False, projection, True, path, end_pos)
+        self._set_columns(tree._columns())
+        self._link_values(self._values, tree)
+        self._source = None
+    
+    @property
+    def is_parsed(self):
+        return self._source is None
+    
+    def _copy(self):
+        if self._source is not None:
+            return LazyTree(*self._source)
+        return pyradox.Tree._copy(self)
+    
+    def __deepcopy__(self, memo):
+        if self._source is not None:
+            return LazyTree(*self._source)
+        result = pyradox.Tree()
+        result._set_columns(copy.deepcopy(self._columns(), memo))
+        result._link_values(result._values)
+        return result
+    
+    def __reduce__(self):
+        return (pyradox.Tree, (), self.__getstate__())
+
+class IterParser():
+    """
+    Event-based (pull) parser, as returned by iterparse.
+    Iterating over it yields (event, key, value) tuples, where event is one of:
+        'start': The start of a Tree-valued item with the given key. value is None.
+        'end': The end of that Tree. value is None.
+        'value': An item with a primitive value (including colors).
+    Items of a group are reported individually with the key of the group, and in_group set.
+    Comments are not reported.
+    
+    Immediately after a 'start' event, the rest of that Tree may be consumed with skip() or subtree(),
+    in which case no events (not even 'end') are produced for it.
+    The file is read a chunk at a time as events are produced, so the caller may stop at any point without reading the rest.
+    Only a bounded lookahead is held in memory. Whether a block is a Tree or a group is decided from at most lookahead_limit tokens;
+    a block with values but no operator among them is taken to be a group. Since parse_file examines the whole block,
+    the two only differ for a block with an operator after that many tokens, which would be malformed.
+    """
+    
+    # Maximum number of tokens examined to decide whether a block is a Tree or a group.
+    lookahead_limit = 4096
+    
+    def __init__(self, token_iter, filename, f = None):
+        self.filename = filename            # Used for warning and error messages.
+        self.depth = 0                      # Number of Trees currently open.
+        self.operator = None                # Operator of the item in the last event.
+        self.in_group = False               # Whether the item in the last event is part of a group.
+        
+        self._tokens = token_iter           # Iterator over (token_type, token_string, line_number).
+        self._lookahead = collections.deque()
+        self._file = f                      # Closed once parsing is finished.
+        self._line_numbers = collections.deque(maxlen = 3) # Line numbers of the last few tokens consumed.
+        self._at_start = False              # True iff the last event was 'start'.
+        self._block_consumed = False        # Set by skip() and subtree().
+        self._events = self._generate()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        try:
+            return next(self._events)
+        except:
+            self.close()
+            raise
+    
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *args):
+        self.close()
+    
+    def close(self):
+        """Stop parsing and close the file."""
+        self._events.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def skip(self):
+        """Skips the rest of the Tree whose 'start' event was just produced."""
+        for token in self._consume_block():
+            pass
+        
+    def subtree(self):
+        """Parses the rest of the Tree whose 'start' event was just produced and returns it."""
+        begin_line_number = self._line_numbers[-1]
+        token_data = list(self._consume_block())
+        if len(token_data) > 0 and token_data[0][0] == 'comment' and token_data[0][2] == begin_line_number:
+            # A comment on the same line as the opening bracket has no item to attach to, so the parser drops it.
+            del token_data[0]
+        return parse_token_stream(TokenStream.from_token_data(token_data), self.filename)
+    
+    def _consume_block(self):
+        """Consumes the tokens of the Tree just started, yielding all but its closing bracket."""
+        if not self._at_start:
+            raise ValueError('A Tree may only be skipped or parsed immediately after its start event.')
+        self._at_start = False
+        self._block_consumed = True
+        level = 0
+        while True:
+            token = self._next_token()
+            if token is None:
+                return
+            token_type = token[0]
+            if token_type == 'begin':
+                level += 1
+            elif token_type == 'end':
+                if level == 0:
+                    return
+                level -= 1
+            yield token
+    
+    def _next_token(self):
+        if self._lookahead:
+            token = self._lookahead.popleft()
+        else:
+            token = next(self._tokens, None)
+            if token is None:
+                return None
+        self._line_numbers.append(token[2])
+        return token
+    
+    def _peek(self, i):
+        """Returns the ith token after the current one without consuming it, or None at end of file."""
+        while len(self._lookahead) <= i:
+            token = next(self._tokens, None)
+            if token is None:
+                return None
+            self._lookahead.append(token)
+        return self._lookahead[i]
+    
+    def _is_tree(self):
+        """Decides whether the bracket just consumed starts a tree or a group, as match_brackets does."""
+        level = 0
+        state = 0
+        i = 0
+        while i < self.lookahead_limit:
+            token = self._peek(i)
+            if token is None:
+                break
+            token_type = token[0]
+            if level == 0:
+                if token_type == 'operator':
+                    return True
+                elif token_type not in ('comment', 'end'):
+                    state = 1
+            if token_type == 'begin':
+                level += 1
+            elif token_type == 'end':
+                level -= 1
+                if level < 0: break
+            i += 1
+        return state != 1
+    
+    def _group_end_line_number(self):
+        """
+        Consumes the tokens of the group just started, and returns the line number of its closing bracket,
+        or of the last token if it is not closed. Only used to report an error.
+        """
+        level = 0
+        line_number = self._line_numbers[-1]
+        while True:
+            token = self._next_token()
+            if token is None:
+                return line_number
+            line_number = token[2]
+            if token[0] == 'begin':
+                level += 1
+            elif token[0] == 'end':
+                level -= 1
+                if level < 0: return line_number
+    
+    def _match_color(self):
+        """If the following tokens are a bracketed color, consume them and return the channels. Otherwise return None."""
+        i = 0
+        while True:
+            token = self._peek(i)
+            if token is None: return None
+            if token[0] == 'begin': break
+            if token[0] != 'comment': return None
+            i += 1
+        channels = []
+        while True:
+            i += 1
+            token = self._peek(i)
+            if token is None: return None
+            token_type, token_string, line_number = token
+            if token_type == 'end' and len(channels) == 3:
+                break
+            elif token_type in ('int', 'float') and len(channels) < 3:
+                channels.append(pyradox.token.make_primitive(token_string, token_type))
+            elif token_type != 'comment':
+                return None
+        for j in range(i + 1):
+            self._next_token()
+        return channels
+    
+    def _generate(self):
+        key_constructors = pyradox.token.key_constructors
+        value_constructors = pyradox.token.constructors
+        filename = self.filename
+        
+        stack = []          # (key, operator, in_group) of each open Tree.
+        key = None
+        key_string = None
+        operator = None
+        in_group = False
+        state = _EXPECT_KEY
+        
+        # Check for extra token at beginning.
+        token = self._peek(0)
+        if token is not None and re.search('txt$', token[1]):
+            print('%s, line %d: Skipping header token "%s".' % (filename, token[2] + 1, token[1]))
+            self._next_token()
+        
+        while True:
+            token = self._next_token()
+            if token is None:
+                # End of file reached.
+                while stack:
+                    line_number = self._line_numbers[-2] if len(self._line_numbers) >= 2 else -1
+                    warnings.warn_explicit('Cannot end inner level with end of file.', ParseWarning, filename, line_number + 1)
+                    key, operator, in_group = stack.pop()
+                    self.depth -= 1
+                    self.operator, self.in_group = operator, in_group
+                    yield 'end', key, None
+                return
+            
+            token_type, token_string, line_number = token
+            
+            if state == _EXPECT_KEY:
+                if token_type in key_constructors:
+                    key_string = token_string
+                    key = value_constructors[token_type](token_string)
+                    state = _EXPECT_OPERATOR
+                elif token_type == 'comment':
+                    pass
+                elif token_type == 'end':
+                    if not stack:
+                        warnings.warn_explicit('Unmatched closing bracket at outer level of file. Skipping token.', ParseWarning, filename, line_number + 1)
+                    else:
+                        key, operator, in_group = stack.pop()
+                        self.depth -= 1
+                        self.operator, self.in_group = operator, in_group
+                        yield 'end', key, None
+                        state = _EXPECT_VALUE if in_group else _EXPECT_KEY
+                else:
+                    warnings.warn_explicit('Token "%s" is not valid key. Skipping token.' % token_string, ParseWarning, filename, line_number + 1)
+            elif state == _EXPECT_OPERATOR:
+                if token_type == 'operator':
+                    operator = token_string
+                    state = _EXPECT_VALUE
+                elif token_type == 'comment':
+                    pass
+                else:
+                    warnings.warn_explicit('Expected operator after key "%s". Treating operator as "=" and token "%s" as value.' % (key_string, token_string), ParseWarning, filename, line_number + 1)
+                    self._lookahead.appendleft(token)
+                    self._line_numbers.pop()
+                    operator = '='
+                    state = _EXPECT_VALUE
+            else:
+                if token_type in value_constructors:
+                    value = None
+                    if token_type == 'str' and token_string in _colorspace_strings:
+                        channels = self._match_color()
+                        if channels is not None:
+                            value = pyradox.Color(channels, token_string)
+                        else:
+                            warnings.warn_explicit('Found colorspace token %s without following color.' % (token_string.lower()), ParseWarning, filename, line_number + 1)
+                    if value is None:
+                        value = value_constructors[token_type](token_string)
+                    self.operator, self.in_group = operator, in_group
+                    yield 'value', key, value
+                    if not in_group:
+                        state = _EXPECT_KEY
+                elif token_type == 'begin':
+                    if self._is_tree():
+                        stack.append((key, operator, in_group))
+                        self.depth += 1
+                        self.operator, self.in_group = operator, in_group
+                        self._at_start = True
+                        self._block_consumed = False
+                        yield 'start', key, None
+                        self._at_start = False
+                        if self._block_consumed:
+                            key, operator, in_group = stack.pop()
+                            self.depth -= 1
+                            state = _EXPECT_VALUE if in_group else _EXPECT_KEY
+                        else:
+                            key = None
+                            key_string = None
+                            operator = None
+                            in_group = False
+                            state = _EXPECT_KEY
+                    elif in_group:
+                        raise ParseError('%s, line %d: Error: Cannot nest groups inside groups.' % (filename, self._group_end_line_number() + 1))
+                    else:
+                        in_group = True
+                elif token_type == 'comment':
+                    pass
+                elif token_type == 'end' and in_group:
+                    in_group = False
+                    state = _EXPECT_KEY
+                else:
+                    raise ParseError('%s, line %d: Error: Invalid token type %s after key "%s", expected a value type.' % (filename, line_number + 1, token_type, key_string))
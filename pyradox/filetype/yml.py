@@ -1,4 +1,5 @@
 import pyradox
+import pyradox.cache
 import pyradox.token
 
 from pyradox.error import *
@@ -52,6 +53,9 @@ def parse(s, path=""):
 
 def parse_file(path):
     """ Return a dictionary containing all key-value pairs in the given file. All keys are lower-case. """
+    return pyradox.cache.cached(path, ('yml', encodings), _parse_file, path)
+
+def _parse_file(path):
     lines = readlines(path)
     return {key : value for key, value in parse_lines(lines, path)}
     
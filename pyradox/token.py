@@ -1,7 +1,9 @@
 from pyradox.datatype import *
 from pyradox.error import *
+import pyradox.config
 
 import re
+import sys
 
 """
 Token handling. The end-user should not ever have to deal with this directly.
@@ -18,25 +20,36 @@ def make_bool(token_string):
 def make_string(token_string):
     """
     Converts a token string to a string by dequoting it.
+    Results that are identifiers (e.g. quoted tags) are interned if pyradox.config.intern_strings is set, but not free text.
     """
-    return re.sub(r'^"(.*)"$', r'\1', token_string)
+    if '\n' in token_string:
+        result = re.sub(r'^"(.*)"$', r'\1', token_string)
+    elif len(token_string) >= 2 and token_string[0] == '"' and token_string[-1] == '"':
+        result = token_string[1:-1]
+    else:
+        result = token_string
+    if pyradox.config.intern_strings and result.isidentifier(): result = sys.intern(result)
+    return result
+
+# Strings are quoted if they contain a match. Checked after str.isalnum, which is faster and rules out a match.
+_non_word_search = re.compile(r'\W').search
 
 def make_token_string(value):
     """
     Converts a primitive value to a token string.
     """
-    if isinstance(value, bool):
+    if isinstance(value, str):
+        #quote string if contains non-alphanumerics or is empty
+        if value.isalnum() or (value and not _non_word_search(value)):
+            return value
+        else:
+            return '"%s"' % value
+    elif isinstance(value, bool):
         if value: return 'yes'
         else: return 'no'
     elif isinstance(value, float):
         # Only go to 3 decimal places.
         return ('%0.3f' % value).rstrip('0')
-    elif isinstance(value, str):
-        #quote string if contains non-alphanumerics or is empty
-        if len(value) == 0 or re.search("\W", value):
-            return '"%s"' % value
-        else:
-            return value
     else:
         return str(value)
     
@@ -1,11 +1,16 @@
 import pyradox
+import pyradox.cache
 
 import csv
 import os
-import collections
+import hashlib
+import pickle
+import shutil
+import tempfile
 import warnings
 
-from PIL import Image, ImageFilter, ImageChops, ImageFont, ImageDraw
+import numpy
+from PIL import Image, ImageChops, ImageFont, ImageDraw
 
 class MapWarning(Warning):
     def __init__(self, message):
@@ -14,6 +19,11 @@ class MapWarning(Warning):
     def __str__(self):
         return self.message
 
+def pack_colors(pixels):
+    """Packs an array of RGB values (with the channels in the last axis) into an array of 0xRRGGBB ints."""
+    pixels = numpy.asarray(pixels)
+    return (pixels[..., 0].astype(numpy.uint32) << 16) | (pixels[..., 1].astype(numpy.uint32) << 8) | pixels[..., 2]
+
 def ne_image(image1, image2):
     """Returns a boolean image that is True where image1 != image2."""
     result_image = Image.new('1', image1.size)
@@ -24,27 +34,52 @@ def ne_image(image1, image2):
     return result_image
     
 
+def image_labels(image):
+    """Returns a 2D array with a different int for each distinct pixel value of the image."""
+    pixels = numpy.asarray(image)
+    if pixels.ndim == 2: return pixels
+    labels = numpy.zeros(pixels.shape[:2], dtype = numpy.uint64)
+    for band in range(pixels.shape[2]):
+        labels = (labels << numpy.uint64(8)) | pixels[..., band]
+    return labels
+
+def edge_mask(labels, edge_width=1):
+    """
+    Returns a boolean array which is True at the edges between the regions of a 2D array of labels.
+    edge_width < 3: Pixels whose label differs from the pixel to their left or above (wrapping around).
+    Otherwise: Pixels whose edge_width x edge_width neighborhood, clipped to the array, contains more than one label.
+        edge_width must be odd.
+    """
+    if edge_width < 3:
+        result = labels != numpy.roll(labels, 1, axis = 1)
+        result |= labels != numpy.roll(labels, 1, axis = 0)
+        return result
+    else:
+        if edge_width % 2 == 0: raise ValueError('edge_width must be odd, not %d.' % edge_width)
+        # The neighborhood contains more than one label iff its maximum and minimum (i.e. dilation and erosion) differ.
+        radius = edge_width // 2
+        return _window_extreme(labels, radius, numpy.maximum) != _window_extreme(labels, radius, numpy.minimum)
+
+def _window_extreme(array, radius, extreme):
+    """Returns extreme (numpy.maximum or numpy.minimum) over the square window of each element of a 2D array, clipped to the array."""
+    # Square windows are separable, so take the extreme along columns, then along rows.
+    return _window_extreme_1d(_window_extreme_1d(array, radius, extreme).T, radius, extreme).T
+
+def _window_extreme_1d(array, radius, extreme):
+    """As _window_extreme, along the first axis only."""
+    result = array.copy()
+    for offset in range(1, min(radius, len(array) - 1) + 1):
+        extreme(result[offset:], array[:-offset], out = result[offset:])
+        extreme(result[:-offset], array[offset:], out = result[:-offset])
+    return result
+
 def generate_edge_image(image, edge_width=1):
-    """Generates an edge mask from the image."""
+    """Generates an edge mask from the image. See edge_mask."""
+    mask = edge_mask(image_labels(image), edge_width)
     if edge_width < 3:
-        result_image = Image.new('L', image.size)
-        """
-        for x_offset, y_offset in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-            offset_image = ImageChops.offset(image, x_offset, y_offset)
-            curr_edge = Image.new('L', image.size)
-            curr_edge.paste(127, None, ne_image(offset_image, image))
-            result_image = ImageChops.add(result_image, curr_edge)
-        """
-        for x_offset, y_offset in [(1, 0), (0, 1)]:
-            offset_image = ImageChops.offset(image, x_offset, y_offset)
-            curr_edge = Image.new('L', image.size)
-            curr_edge.paste(255, None, ne_image(offset_image, image))
-            result_image = ImageChops.add(result_image, curr_edge)
-        return result_image
+        return Image.fromarray(mask.astype(numpy.uint8) * 255)
     else:
-        max_image = image.filter(ImageFilter.MaxFilter(edge_width))
-        min_image = image.filter(ImageFilter.MinFilter(edge_width))
-        return ne_image(max_image, min_image)
+        return Image.fromarray(mask)
     
 class DefaultMapData():
     def __init__(self):
@@ -56,10 +91,13 @@ class DefaultMapData():
         self.impassable_sea_provinces = set()
         self.impassable_provinces = set()
         
-    def parse_from_file(self):
-        map_folder = r"C:\Program Files (x86)\Steam\steamapps\common\Crusader Kings III\game\map_data\\"
-        file = open(map_folder + "default.map")
-        lines = file.readlines()
+    def parse_from_file(self, default_map = None):
+        """Reads the province types from a default.map file, by default the one in the usual CK3 install location."""
+        if default_map is None:
+            map_folder = r"C:\Program Files (x86)\Steam\steamapps\common\Crusader Kings III\game\map_data\\"
+            default_map = map_folder + "default.map"
+        with open(default_map) as file:
+            lines = file.readlines()
         for line in lines:
             content = line
             content = content.split('#')[0]
@@ -163,9 +201,9 @@ class DefaultMapData():
 
 class ProvinceMap():
     
-    def parse_default_file(self):
+    def parse_default_file(self, default_map = None):
         default_data = DefaultMapData()
-        default_data.parse_from_file()
+        default_data.parse_from_file(default_map)
         return default_data
 
     def __init__(self, game, flip_y = False):
@@ -178,11 +216,77 @@ class ProvinceMap():
         definition_csv = os.path.join(basedir, 'game', 'map_data', 'definition.csv')
         default_map = os.path.join(basedir, 'game', 'map_data', 'default.map')
         
-        self.province_image = Image.open(provinces_bmp)
-
-        if flip_y:
-            self.province_image = self.province_image.transpose(Image.FLIP_TOP_BOTTOM)
-
+        self._province_image_path = provinces_bmp
+        self._flip_y = flip_y
+        self._province_image = None # lazy evaluation
+        self._adjacency = {} # lazy evaluation, by wrap_x
+        
+        cache_directory = self._cache_directory([provinces_bmp, definition_csv, default_map])
+        self._cache_path = cache_directory
+        if not self._load_cache(cache_directory):
+            self._read_definitions(definition_csv, default_map)
+            self.province_raster = self._compute_province_raster()
+            self._compute_province_extents()
+            print('Computed province centroids.')
+            self._store_cache(cache_directory)
+        
+        max_y = self.province_raster.shape[0] # use image coords
+        
+        if 'HoI4' in game:
+        
+            building_headings = ['state_id', 'type', 'x', 'x_offset', 'y', 'y_offset', 'sea_province_id']
+            buildings = pyradox.csv.parse_file(['map', 'buildings.txt'], game = game, headings = building_headings)
+            for _, row in buildings.items():
+                building_type = row['type']
+                x, y = int(row['x']), max_y - int(row['y'])
+                province_id = self.province_at_coordinates(x, y)
+                if building_type not in self.positions: self.positions[building_type] = {}
+                self.positions[building_type][province_id] = (row['x'], max_y - row['y'])
+            
+            """
+            unitstack_headings = ['province_id', 'type', 'x', 'x_offset', 'y', 'y_offset', 'z']
+            
+            self.positions['unitstacks'] = {}
+            unitstacks = pyradox.csv.parse_file(['map', 'unitstacks.txt'], game = game, headings = unitstack_headings)
+            for province_id, row in unitstacks.items():
+                self.positions['unitstacks'][province_id] = (row['x'], max_y - row['y'])
+            """
+            
+            print('Read province positions.')
+        """
+        else:
+            positions_txt = os.path.join(basedir, 'map', 'positions.txt')
+            positions_tree = pyradox.parse_file(positions_txt, verbose=False)
+            if len(positions_tree) > 0:
+                
+                for province_id, data in positions_tree.items():
+                    if "position" in data:
+                        position_data = [x for x in data.find_all('position')]
+                        # second pair is unit position
+                        self.positions[province_id] = (position_data[2], max_y - position_data[3]) 
+                        
+                    elif "text_position" in data:
+                        position_data = data['text_position']
+                        self.positions[province_id] = (position_data['x'], max_y - position_data['y'])
+                    elif "building_position" in data:
+                        _, position_data = data['building_position'].at(0)
+                        self.positions[province_id] = (position_data['x'], max_y - position_data['y'])
+        """
+        
+    @property
+    def province_image(self):
+        """The province image, loaded on first use."""
+        if self._province_image is None:
+            self._province_image = Image.open(self._province_image_path)
+            if self._flip_y:
+                self._province_image = self._province_image.transpose(Image.FLIP_TOP_BOTTOM)
+        return self._province_image
+    
+    @province_image.setter
+    def province_image(self, province_image):
+        self._province_image = province_image
+    
+    def _read_definitions(self, definition_csv, default_map):
         with open(definition_csv) as definition_file:
             csv_reader = csv.reader(definition_file, delimiter = ';')
             self.province_color_by_id = {}
@@ -192,9 +296,8 @@ class ProvinceMap():
             self.river_provinces = set()
             self.lake_provinces = set()
             self.impassable_sea_provinces = set()
-            self._adjacency = {} # lazy evaluation
 
-            default_map_data = self.parse_default_file()
+            default_map_data = self.parse_default_file(default_map)
             
             for water_province in default_map_data.water_provinces:
                 self.water_provinces.add(water_province)
@@ -232,77 +335,138 @@ class ProvinceMap():
                     pass
             
             print("Read %d provinces from %s." % (province_count, definition_csv))
-
-        self.positions = {}
-        self.positions['centroid'] = { province_id : (0.0, 0.0) for province_id in self.province_color_by_id.keys() }
-        self.province_sizes = { province_id : 0 for province_id in self.province_color_by_id.keys() }
+    
+    # Data derived from the map files which is stored in the cache, along with province_raster.
+    _cached_attributes = (
+        'province_color_by_id', 'province_id_by_color',
+        'water_provinces', 'impassable_provinces', 'river_provinces', 'lake_provinces', 'impassable_sea_provinces',
+        'province_sizes', 'positions', 'province_bounding_boxes',
+        )
+    
+    def _cache_directory(self, paths):
+        """
+        Returns the directory in which the data derived from the map files at paths is cached, or None if caching is disabled.
+        It is keyed by the size and modification time of each file, so it is not used once any of them changes.
+        """
+        if not pyradox.cache.is_enabled(): return None
+        key = [pyradox.cache.cache_version, self._flip_y]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                key.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                key.append((os.path.abspath(path), None))
+        name = hashlib.sha1(repr(key).encode('utf_8')).hexdigest()
+        return os.path.join(pyradox.config.cache_directory, 'worldmap', name)
+    
+    def _load_cache(self, cache_directory):
+        """
+        Loads the cached data if there is any, returning whether it did.
+        The raster is memory-mapped rather than read, so it is shared with other processes using the same cache.
+        """
+        if cache_directory is None: return False
+        try:
+            with open(os.path.join(cache_directory, 'data.pickle'), 'rb') as f:
+                data = pickle.load(f)
+            province_raster = numpy.load(os.path.join(cache_directory, 'province_raster.npy'), mmap_mode = 'r')
+        except Exception:
+            # Missing, or written by an incompatible version.
+            return False
         
-        # compute province sizes and centroids (assume no provinces wrap around)
-        for index, pixel in enumerate(self.province_image.getdata()):
-            x = index % self.province_image.size[0]
-            y = index // self.province_image.size[0]
-            province_id = self.province_id_by_color[pixel]
-            self.province_sizes[province_id] += 1
-            
-            prev_x, prev_y = self.positions['centroid'][province_id]
-            self.positions['centroid'][province_id] = (prev_x + x, prev_y + y)
-            
-        for province_id in self.positions['centroid'].keys():
-            size = self.province_sizes[province_id]
-            if size > 0:
-                prev_x, prev_y = self.positions['centroid'][province_id]
-                self.positions['centroid'][province_id] = (prev_x / size, prev_y / size)
-            else:
-                warnings.warn('Province %d has size 0.' % province_id)
+        for name in ProvinceMap._cached_attributes:
+            setattr(self, name, data[name])
+        self.province_raster = province_raster
+        pyradox.cache.mark_used(cache_directory)
+        print('Loaded province map data from %s.' % cache_directory)
+        return True
+    
+    def _store_cache(self, cache_directory):
+        if cache_directory is None: return
+        parent_directory = os.path.dirname(cache_directory)
+        os.makedirs(parent_directory, exist_ok = True)
         
-        print('Computed province centroids.')
+        # Write to a temporary directory first so that other processes never see a partial entry.
+        temp_directory = tempfile.mkdtemp(dir = parent_directory, suffix = '.tmp')
+        try:
+            with open(os.path.join(temp_directory, 'data.pickle'), 'wb') as f:
+                pickle.dump({ name : getattr(self, name) for name in ProvinceMap._cached_attributes }, f, pickle.HIGHEST_PROTOCOL)
+            numpy.save(os.path.join(temp_directory, 'province_raster.npy'), self.province_raster)
+            os.rename(temp_directory, cache_directory)
+        except OSError:
+            # e.g. another process stored it first.
+            shutil.rmtree(temp_directory, ignore_errors = True)
+            return
+        # Counted towards the cache size limit like parsed files, and removed in the same way when least recently used.
+        pyradox.cache.stored_directory(cache_directory)
+    
+    def _compute_province_raster(self):
+        """
+        Returns an array of the province ID at each pixel of the province image, indexed [y, x].
+        Colors are matched by searching the sorted packed colors of the province definitions.
+        """
+        province_ids = numpy.array(list(self.province_id_by_color.values()))
+        province_colors = pack_colors(list(self.province_id_by_color.keys()))
+        order = numpy.argsort(province_colors)
+        province_ids = province_ids[order]
+        province_colors = province_colors[order]
         
-        max_y = self.province_image.size[1] # use image coords
+        image = self.province_image
+        if image.mode != 'RGB': image = image.convert('RGB')
+        pixel_colors = pack_colors(numpy.asarray(image))
         
-        if 'HoI4' in game:
+        positions = numpy.searchsorted(province_colors, pixel_colors)
+        positions[positions == len(province_colors)] = 0
+        unknown = province_colors[positions] != pixel_colors
+        if unknown.any():
+            color = int(pixel_colors[unknown][0])
+            raise KeyError((color >> 16, (color >> 8) & 0xff, color & 0xff))
         
-            building_headings = ['state_id', 'type', 'x', 'x_offset', 'y', 'y_offset', 'sea_province_id']
-            buildings = pyradox.csv.parse_file(['map', 'buildings.txt'], game = game, headings = building_headings)
-            for _, row in buildings.items():
-                building_type = row['type']
-                x, y = int(row['x']), max_y - int(row['y'])
-                province_id = self.province_at_coordinates(x, y)
-                if building_type not in self.positions: self.positions[building_type] = {}
-                self.positions[building_type][province_id] = (row['x'], max_y - row['y'])
-            
-            """
-            unitstack_headings = ['province_id', 'type', 'x', 'x_offset', 'y', 'y_offset', 'z']
-            
-            self.positions['unitstacks'] = {}
-            unitstacks = pyradox.csv.parse_file(['map', 'unitstacks.txt'], game = game, headings = unitstack_headings)
-            for province_id, row in unitstacks.items():
-                self.positions['unitstacks'][province_id] = (row['x'], max_y - row['y'])
-            """
-            
-            print('Read province positions.')
+        dtype = numpy.uint16 if province_ids.max(initial = 0) <= numpy.iinfo(numpy.uint16).max else numpy.uint32
+        return province_ids.astype(dtype)[positions]
+    
+    def _compute_province_extents(self):
         """
-        else:
-            positions_txt = os.path.join(basedir, 'map', 'positions.txt')
-            positions_tree = pyradox.parse_file(positions_txt, verbose=False)
-            if len(positions_tree) > 0:
-                
-                for province_id, data in positions_tree.items():
-                    if "position" in data:
-                        position_data = [x for x in data.find_all('position')]
-                        # second pair is unit position
-                        self.positions[province_id] = (position_data[2], max_y - position_data[3]) 
-                        
-                    elif "text_position" in data:
-                        position_data = data['text_position']
-                        self.positions[province_id] = (position_data['x'], max_y - position_data['y'])
-                    elif "building_position" in data:
-                        _, position_data = data['building_position'].at(0)
-                        self.positions[province_id] = (position_data['x'], max_y - position_data['y'])
+        Computes the size, centroid and bounding box of each province from the province raster (assume no provinces wrap around).
+        Pixels are sorted by province, and each quantity is then a reduction over the run of pixels of each province.
         """
+        width = self.province_raster.shape[1]
+        flat_raster = self.province_raster.ravel()
+        order = numpy.argsort(flat_raster, kind = 'stable')
+        if len(order) <= numpy.iinfo(numpy.int32).max: order = order.astype(numpy.int32) # Halves the memory used below.
+        sorted_ids = flat_raster[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+        ends = numpy.append(starts[1:], len(sorted_ids))
+        ys, xs = numpy.divmod(order, width)
+        
+        ids = sorted_ids[starts].tolist()
+        sizes = (ends - starts).tolist()
+        sums_x = numpy.add.reduceat(xs, starts, dtype = numpy.int64).tolist()
+        sums_y = numpy.add.reduceat(ys, starts, dtype = numpy.int64).tolist()
+        # Bounding boxes as PIL's getbbox: (left, upper, right, lower), exclusive on the right and lower sides.
+        # Within each run pixels are in raster order, so the first and last give the vertical extent.
+        bounding_boxes = zip(
+            numpy.minimum.reduceat(xs, starts).tolist(),
+            ys[starts].tolist(),
+            (numpy.maximum.reduceat(xs, starts) + 1).tolist(),
+            (ys[ends - 1] + 1).tolist())
+        
+        self.positions = {}
+        self.positions['centroid'] = { province_id : (0.0, 0.0) for province_id in self.province_color_by_id.keys() }
+        self.province_sizes = { province_id : 0 for province_id in self.province_color_by_id.keys() }
+        self.province_bounding_boxes = {}
+        
+        for province_id, size, sum_x, sum_y, bounding_box in zip(ids, sizes, sums_x, sums_y, bounding_boxes):
+            self.province_sizes[province_id] = size
+            self.positions['centroid'][province_id] = (sum_x / size, sum_y / size)
+            self.province_bounding_boxes[province_id] = bounding_box
         
+        for province_id, size in self.province_sizes.items():
+            if size == 0:
+                warnings.warn('Province %d has size 0.' % province_id)
+    
     def province_at_coordinates(self, x, y):
         """ Return the province ID at a given coordinates in image space (y down). """
-        return self.province_id_by_color[self.province_image.getpixel((x, y))]
+        return int(self.province_raster[y, x])
         
     def province_position(self, province_id, position_type = 'centroid'):
         """ Returns the position of a province by ID. Various position types can be specified; default is just the centroid of the province's pixels."""
@@ -319,32 +483,84 @@ class ProvinceMap():
     def is_impassable_province(self, province_id):
         return province_id in self.impassable_provinces
 
-    def get_adjacent(self, province_id):
-        """ Returns a list of adjacent province_ids. """
-        # get province bounding box
-        province_color_image = ImageChops.constant(self.province_image, self.province_color_by_id[province_id])
-        mask = ImageChops.invert(ne_image(self.province_image, province_color_image))
-        x_min, y_min, x_max, y_max = Image.getbbox(mask)
+    def get_adjacent(self, province_id, wrap_x = False):
+        """ Returns a list of adjacent province_ids. wrap_x: As adjacency_graph. """
+        indptr, indices, border_lengths = self.adjacency_graph(wrap_x)
+        if not 0 <= province_id < len(indptr) - 1: return []
+        return indices[indptr[province_id]:indptr[province_id + 1]].tolist()
+    
+    def adjacency_graph(self, wrap_x = False):
+        """
+        Returns the adjacency graph of all provinces as compressed sparse row arrays (indptr, indices, border_lengths):
+        the provinces adjacent to province_id are indices[indptr[province_id]:indptr[province_id + 1]] in ascending order,
+        and the corresponding border_lengths are the number of pixel sides they share with it.
+        Provinces are adjacent if they share a horizontal or vertical pixel side.
+        wrap_x: If True, the left and right edges of the map are also adjacent.
+        The graph is computed on first use and cached, on disk too if the map data is.
+        """
+        if wrap_x not in self._adjacency:
+            graph = self._load_adjacency(wrap_x)
+            if graph is None:
+                graph = self._compute_adjacency(wrap_x)
+                self._store_adjacency(wrap_x, graph)
+            self._adjacency[wrap_x] = graph
+        return self._adjacency[wrap_x]
+    
+    def _compute_adjacency(self, wrap_x):
+        """Finds every border in one pass by comparing the raster with itself shifted by one pixel."""
+        raster = self.province_raster
+        province_count = max(self.province_color_by_id.keys(), default = 0) + 1
         
-        # grow box
-        #TODO: wraparound
-        x_min = max(0, x_min - 1)
-        y_min = max(0, y_min - 1)
-        x_max = min(self.province_image.size[0]-1, x_max + 1)
-        y_max = min(self.province_image.size[1]-1, y_max + 1)
-        box = (x_min, y_min, x_max, y_max)
-
-        # crop to area
-        mask = mask.crop(box)
-        grow_filter = ImageFilter.Kernel((3, 3), (0, 1, 0, 1, 0, 1, 0, 1, 0))
-        mask = mask.filter(grow_filter)
+        shifted_pairs = [(raster[:, :-1], raster[:, 1:]), (raster[:-1, :], raster[1:, :])]
+        if wrap_x: shifted_pairs.append((raster[:, -1], raster[:, 0]))
         
-        province_color_image = province_color_image.crop(box)
-        black_image = ImageChops.constant(province_color_image, (0, 0, 0))
-        province_color_image = Image.composite(black_image, province_color_image, mask)
-        border_colors = province_color_image.getcolors()
-        result = [color for (count, color) in border_colors]
+        # Identify each border by (lower province_id) * province_count + (higher province_id).
+        border_keys = []
+        for province_ids, neighbor_ids in shifted_pairs:
+            is_border = province_ids != neighbor_ids
+            province_ids = province_ids[is_border].astype(numpy.uint64)
+            neighbor_ids = neighbor_ids[is_border].astype(numpy.uint64)
+            border_keys.append(numpy.minimum(province_ids, neighbor_ids) * numpy.uint64(province_count) + numpy.maximum(province_ids, neighbor_ids))
+        border_keys, border_lengths = numpy.unique(numpy.concatenate(border_keys), return_counts = True)
+        lower_ids, higher_ids = numpy.divmod(border_keys, numpy.uint64(province_count))
         
+        # Each border appears in the rows of both of its provinces.
+        sources = numpy.concatenate((lower_ids, higher_ids)).astype(numpy.int64)
+        targets = numpy.concatenate((higher_ids, lower_ids)).astype(raster.dtype)
+        border_lengths = numpy.concatenate((border_lengths, border_lengths))
+        order = numpy.lexsort((targets, sources))
+        
+        indptr = numpy.zeros(province_count + 1, dtype = numpy.int64)
+        numpy.cumsum(numpy.bincount(sources, minlength = province_count), out = indptr[1:])
+        return indptr, targets[order], border_lengths[order]
+    
+    def _adjacency_cache_path(self, wrap_x):
+        if self._cache_path is None: return None
+        return os.path.join(self._cache_path, 'adjacency_wrap_x.npz' if wrap_x else 'adjacency.npz')
+    
+    def _load_adjacency(self, wrap_x):
+        path = self._adjacency_cache_path(wrap_x)
+        if path is None: return None
+        try:
+            with numpy.load(path) as data:
+                return data['indptr'], data['indices'], data['border_lengths']
+        except Exception:
+            return None
+    
+    def _store_adjacency(self, wrap_x, graph):
+        path = self._adjacency_cache_path(wrap_x)
+        if path is None or not os.path.isdir(self._cache_path): return
+        indptr, indices, border_lengths = graph
+        fd, temp_path = tempfile.mkstemp(dir = self._cache_path, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(f, indptr = indptr, indices = indices, border_lengths = border_lengths)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
     
     def generate_image(self, colormap,
                       default_land_color = (51, 51, 51),
@@ -357,19 +573,22 @@ class ProvinceMap():
         province_id_s with no color get a default color depending on whether they are land or water.
         """
 
-        # precompute map province_color -> result color
-        merged_map = collections.defaultdict(lambda: default_water_color)
-        for province_id, province_color in self.province_color_by_id.items():
+        # precompute lookup table province_id -> result color, then look up every pixel of the province raster at once
+        province_ids = list(self.province_color_by_id.keys())
+        color_table = numpy.empty((max(province_ids, default = 0) + 1, 3), dtype = numpy.uint8)
+        color_table[:] = default_water_color
+        colors = []
+        for province_id in province_ids:
             if province_id in colormap.keys():
-                merged_map[province_color] = colormap[province_id]
+                colors.append(tuple(colormap[province_id]))
             else:
                 if province_id in self.water_provinces:
-                    merged_map[province_color] = default_water_color
+                    colors.append(default_water_color)
                 else:
-                    merged_map[province_color] = default_land_color
+                    colors.append(default_land_color)
+        if province_ids: color_table[province_ids] = colors
         
-        result = Image.new(self.province_image.mode, self.province_image.size)
-        result.putdata([tuple(merged_map[pixel]) for pixel in self.province_image.getdata()])
+        result = Image.fromarray(color_table[self.province_raster])
 
         if edge_width > 0:
             self.overlay_edges(result, edge_color, edge_width, groups = edge_groups)
@@ -382,32 +601,23 @@ class ProvinceMap():
         [[province_id_in_group0, province_id_in_group0, ...], [province_id_in_group1, province_id_in_group1, ...], ...]
         """
         
+        labels = self.province_raster
         if groups is not None:
-            # map province_color -> result color
-            color_map = {}
+            # map province_id -> group label; all ungrouped provinces are mapped to the same group
+            group_labels = numpy.full(max(self.province_color_by_id.keys(), default = 0) + 1, -1, dtype = numpy.int64)
             
             for group in groups:
-                # color all provinces in the group according to the first province in the group
-                group_color = self.province_color_by_id[group[0]]
+                # label all provinces in the group according to the first province in the group
                 for province_id in group:
-                    original_color = self.province_color_by_id[province_id]
-                    color_map[original_color] = group_color
-            
-            # perform the coloring
-            province_image = Image.new(self.province_image.mode, image.size)
-            def map_color(pixel):
-                if pixel in color_map: return color_map[pixel]
-                else:
-                    # map all ungrouped provinces to the same group
-                    if 'default' not in color_map:
-                        color_map['default'] = pixel
-                    return color_map['default']
+                    if province_id not in self.province_color_by_id: raise KeyError(province_id)
+                    group_labels[province_id] = group[0]
             
-            province_image.putdata([map_color(pixel) for pixel in self.province_image.getdata()])
-        else:
-            province_image = self.province_image.resize(image.size, Image.NEAREST)
-                    
-        edge_image = generate_edge_image(province_image, edge_width)
+            labels = group_labels[labels]
+        
+        if labels.shape != (image.size[1], image.size[0]):
+            labels = numpy.asarray(Image.fromarray(labels.astype(numpy.int32)).resize(image.size, Image.NEAREST))
+        
+        edge_image = Image.fromarray(edge_mask(labels, edge_width))
         image.paste(edge_color, None, edge_image)
 
     def overlay_icons(self, image, iconmap, offsetmap = {}, default_offset = (0, 0), position_type = 'centroid'):
@@ -0,0 +1,44 @@
+import _initpath
+import pyradox
+import pyradox.filetype.binary
+
+s = """
+# header
+technologies = {
+    tech_a = { cost = 1 } # first
+    tech_b = { cost = 2.5 date = 1444.11.11 color = rgb { 1 2 3 } allow = yes }
+}
+ideas = { a b c }
+value < 3
+"""
+
+tree = pyradox.txt.parse(s)
+data = pyradox.filetype.binary.dumps_tree(tree)
+result = pyradox.filetype.binary.loads_tree(data)
+print(result)
+print(str(result) == str(tree))
+
+print(pyradox.filetype.binary.loads_tree(data, key_path = ('technologies', 'tech_b')))
+print(pyradox.filetype.binary.loads_tree(data, key_path = ('ideas', 'a')))
+print(pyradox.filetype.binary.loads_tree(pyradox.filetype.binary.dumps_tree(tree, comments = False)))
+
+# Duplicate keys are followed as tree[key] would, i.e. the last one at each level.
+tree = pyradox.txt.parse('a = { b = { v = 0 } } a = { b = { v = 1 } b = { v = 2 } }')
+data = pyradox.filetype.binary.dumps_tree(tree)
+print(str(pyradox.filetype.binary.loads_tree(data, key_path = ('a',))) == str(tree['a']), pyradox.filetype.binary.loads_tree(data, key_path = ('a', 'b')))
+
+# Data written in another format version cannot be loaded.
+try:
+    pyradox.filetype.binary.loads_tree(data[:4] + bytes([2]) + data[5:])
+except pyradox.error.ParseError as e:
+    print(e)
+
+# comments = False omits comments from lazily parsed Trees too.
+tree = pyradox.txt.parse('# pc\na = { b = 1 # lc\n} c = { d = { e = 2 } } # lc2\n', lazy = True)
+print(pyradox.filetype.binary.loads_tree(pyradox.filetype.binary.dumps_tree(tree, comments = False)))
+
+# Corrupt data is reported as a ParseError.
+try:
+    pyradox.filetype.binary.loads_tree(data[:-3])
+except pyradox.error.ParseError as e:
+    print(e)
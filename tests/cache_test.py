@@ -0,0 +1,53 @@
+import _initpath
+import pyradox
+import pyradox.cache
+
+import os
+import tempfile
+
+s = """
+technologies = {
+    tech_a = { cost = 1 } # first
+    tech_b = { cost = 2 date = 1444.11.11 color = rgb { 1 2 3 } }
+}
+"""
+
+cache_directory = tempfile.mkdtemp()
+fd, path = tempfile.mkstemp(suffix = '.txt')
+with os.fdopen(fd, 'w') as f:
+    f.write(s)
+
+pyradox.config.cache_directory = cache_directory
+first = pyradox.txt.parse_file(path, game = 'EU4', path_relative_to_game = False)
+second = pyradox.txt.parse_file(path, game = 'EU4', path_relative_to_game = False)
+print(second)
+print(str(first) == str(second), len(os.listdir(cache_directory)))
+
+# Changing the file invalidates the entry.
+with open(path, 'a') as f:
+    f.write('ideas = { a b c }\n')
+print(pyradox.txt.parse_file(path, game = 'EU4', path_relative_to_game = False)['ideas'] is not None, len(os.listdir(cache_directory)))
+
+pyradox.cache.clear()
+print(len(os.listdir(cache_directory)))
+
+# Entry directories in subdirectories (as stored by pyradox.worldmap) count towards the size limit,
+# and are removed when least recently used like parsed files.
+size_limit = pyradox.config.cache_size_limit
+pyradox.config.cache_size_limit = 2500
+entry_directories = []
+for i in range(3):
+    entry_directory = os.path.join(cache_directory, 'worldmap', 'entry_%d' % i)
+    os.makedirs(entry_directory)
+    with open(os.path.join(entry_directory, 'data'), 'wb') as f:
+        f.write(bytes(1000))
+    os.utime(entry_directory, ns = (i * 10 ** 9, i * 10 ** 9))
+    pyradox.cache.stored_directory(entry_directory)
+    entry_directories.append(entry_directory)
+print([os.path.isdir(entry_directory) for entry_directory in entry_directories])
+pyradox.cache.clear()
+pyradox.config.cache_size_limit = size_limit
+pyradox.config.cache_directory = None
+
+os.remove(path)
+os.rmdir(cache_directory)
@@ -0,0 +1,28 @@
+import _initpath
+import pyradox
+
+tree = pyradox.parse('''
+owner = GER
+buildings = { infrastructure = 3 }
+1936.1.1 = { add_core_of = POL }
+1939.9.1 = { owner = POL buildings = { bunker = 1 } }
+1938.3.12 = { buildings = { infrastructure = 4 } }
+''')
+
+history = pyradox.History(tree)
+print([str(date) for date in history.dates])
+for time in ['1935.1.1', '1938.6.1', '1940.1.1', True, False]:
+    snapshot = history.snapshot(time)
+    print(time, snapshot['owner'], snapshot['buildings']['infrastructure'], snapshot.contains('add_core_of'))
+
+# Snapshots can be modified without affecting the others.
+snapshot['buildings']['infrastructure'] = 10
+for time, snapshot in history.snapshots():
+    print(time, snapshot['owner'], snapshot['buildings']['infrastructure'], snapshot['buildings'].contains('bunker'))
+
+# Only a bounded number of states are kept, and evicted states are rebuilt as needed.
+tree = pyradox.Tree([('count', 0)] + [(pyradox.Time(1444 + i, 1, 1), pyradox.Tree({'count' : i + 1})) for i in range(100)])
+history = pyradox.History(tree)
+counts = [snapshot['count'] for time, snapshot in history.snapshots()]
+print(counts == list(range(1, 101)), len(history._states) <= pyradox.History._state_cache_length)
+print([history.snapshot(time)['count'] for time in ['1450.6.1', '1443.1.1', '1520.1.1', '1450.6.1']])
@@ -0,0 +1,58 @@
+import _initpath
+import pyradox
+
+tree = pyradox.Tree()
+for i in range(20):
+    tree.append('key_%d' % (i % 5), i)
+tree.append(pyradox.Time('1444.11.11'), 'date')
+
+print(tree['KEY_1'], tree.find('key_1'), tree.count('Key_1'), tree.index('key_1'), tree.index('key_1', reverse = False))
+print(list(tree.find_all('key_2')), list(tree.find_all('key_2', reverse = True)))
+print(tree[pyradox.Time('1444.11.11')], 'missing' in tree)
+
+# Lookups stay correct as the tree is modified.
+tree.append('Key_1', 100)
+tree['key_3'] = 300
+tree.insert(0, 'key_4', 400)
+del tree['key_0']
+print(tree['key_1'], list(tree.find_all('key_3')), tree.index('key_4', reverse = False), tree.count('key_0'))
+
+# Recursive lookups, which use an index from the second lookup on.
+tree = pyradox.parse('a = { b = 1 c = { b = 2 } } b = 3 d = { B = 4 }')
+for i in range(2):
+    print(list(tree.find_all('b', recurse = True)), list(tree.find_all('b', recurse = True, reverse = True)), tree.find('c', recurse = True), tree.contains('e', recurse = True))
+tree['a']['c']['b'] = 5
+tree['d'].append('e', 6)
+print(list(tree.find_all('b', recurse = True)), tree.contains('e', recurse = True))
+
+# Times are mutable, so they are not hashable, and modifying a Time key in place is seen by later lookups.
+tree = pyradox.Tree((pyradox.Time(1444, 11, i), i) for i in range(1, 21))
+date = tree.key_at(0)
+print(tree[pyradox.Time('1444.11.1')], tree.count(pyradox.Time('1444.11.2')))
+date.day = 30
+print(tree[pyradox.Time('1444.11.1')], tree[pyradox.Time('1444.11.30')], tree.count(pyradox.Time('1444.11.2')))
+try:
+    hash(date)
+except TypeError:
+    print('unhashable')
+
+nested = pyradox.Tree()
+nested.append('history', tree)
+for i in range(2):
+    print(list(nested.find_all(pyradox.Time('1444.11.30'), recurse = True)), list(nested.find_all(pyradox.Time('1444.11.1'), recurse = True)))
+
+# A tree with an unhashable key is scanned rather than indexed.
+tree = pyradox.Tree(('key_%d' % i, i) for i in range(10))
+tree.append(['unhashable'], 10)
+print(tree['key_3'], tree[['unhashable']], tree._index)
+
+# Changing a tree only discards the recursive indexes of the trees containing it, and subtrees are not indexed when scanned.
+tree = pyradox.txt.parse('a = { b = { c = 1 } } d = { c = 2 }')
+other = pyradox.txt.parse('x = { c = 3 }')
+for i in range(2):
+    print(list(tree.find_all('c', recurse = True)))
+other['x']['c'] = 4
+print(tree._recursive_index is not None, tree['a']._recursive_index)
+subtree = tree['a']['b']
+subtree.append('c', 5)
+print(tree._recursive_index, list(tree.find_all('c', recurse = True)))
@@ -0,0 +1,81 @@
+import _initpath
+import pyradox
+
+import os
+import tempfile
+import warnings
+
+s = """EU4txt
+date = 1444.11.11
+checksum = "abc123"
+player = "ENG"
+provinces = {
+    -1 = { name = "Stockholm" owner = SWE }
+    -2 = { name = "Uppsala" owner = SWE }
+}
+countries = {
+    SWE = { color = rgb { 1 100 200 } ideas = { 1 2 3 } }
+}
+"""
+
+fd, path = tempfile.mkstemp(suffix = '.eu4')
+with os.fdopen(fd, 'w') as f:
+    f.write(s)
+
+with pyradox.txt.iterparse(path, game = 'EU4', path_relative_to_game = False) as events:
+    for event, key, value in events:
+        print(events.depth, event, key, value)
+        if event == 'start' and key == 'provinces':
+            events.skip()
+        elif event == 'start' and key == 'countries':
+            print(events.subtree())
+
+# Stop as soon as the checksum is found.
+with pyradox.txt.iterparse(path, game = 'EU4', path_relative_to_game = False) as events:
+    for event, key, value in events:
+        if key == 'checksum':
+            print(value)
+            break
+
+os.remove(path)
+
+def write_temp(data):
+    fd, path = tempfile.mkstemp(suffix = '.txt')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+# The file is only read as far as needed.
+path = write_temp(b'checksum = "abc123"\r\n' + b'a = { b = c }\r\n' * 100000)
+with pyradox.txt.iterparse(path, game = 'EU4', path_relative_to_game = False) as events:
+    for event, key, value in events:
+        if key == 'checksum':
+            print(value, events._file.tell() < os.path.getsize(path))
+            break
+os.remove(path)
+
+# A large group is decided from a bounded lookahead.
+path = write_temp(b'big = { ' + b' '.join(b'%d' % i for i in range(10000)) + b' } after = 1')
+with pyradox.txt.iterparse(path, game = 'EU4', path_relative_to_game = False) as events:
+    group_values = 0
+    max_lookahead = 0
+    for event, key, value in events:
+        max_lookahead = max(max_lookahead, len(events._lookahead))
+        if key == 'big' and events.in_group: group_values += 1
+        elif key == 'after': print(key, value)
+    print(group_values, max_lookahead <= events.lookahead_limit)
+os.remove(path)
+
+# The encoding comes from the byte order mark, or the first chunk. A later chunk that fails to decode falls back to the next encoding.
+path = write_temp(pyradox.txt.codecs.BOM_UTF8 + 'name = "Göteborg"'.encode('utf_8'))
+with pyradox.txt.iterparse(path, game = 'EU4', path_relative_to_game = False) as events:
+    print(list(events))
+os.remove(path)
+
+path = write_temp(b'a = b\n' * 100000 + 'name = "“quoted”"'.encode('cp1252'))
+with warnings.catch_warnings(record = True) as w:
+    warnings.simplefilter('always')
+    with pyradox.txt.iterparse(path, game = 'HoI4', path_relative_to_game = False) as events:
+        print(list(events)[-1])
+    print([str(x.message).split(' using ')[1] for x in w])
+os.remove(path)
@@ -0,0 +1,47 @@
+import _initpath
+import pyradox
+
+import io
+import json
+
+tree = pyradox.parse('''
+a = 1
+b = { c = "string" d = 1.5 e = yes }
+a = 2
+group = { 1 2 3 }
+1444.11.11 = { owner = FRA }
+''')
+
+# The output is the same as json.dumps of to_python.
+for duplicate_action in ['error', 'overwrite', 'one_group', 'list']:
+    for kwargs in [{}, {'indent' : 2, 'sort_keys' : True}]:
+        try:
+            expected = json.dumps(tree.to_python(duplicate_action = duplicate_action), **kwargs)
+        except ValueError as e:
+            expected = str(e)
+        try:
+            result = pyradox.json.dumps_tree(tree, duplicate_action = duplicate_action, **kwargs)
+        except ValueError as e:
+            result = str(e)
+        print(duplicate_action, result == expected)
+
+fp = io.StringIO()
+pyradox.json.dump_tree(tree, fp, lines = True)
+print(fp.getvalue())
+
+# JSON lines honour sort_keys.
+print(pyradox.json.dumps_tree(tree, lines = True, sort_keys = True))
+
+# Long lists and flat trees are written in chunks, not only after each Tree.
+class ChunkCounter(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.chunks = 0
+    def write(self, s):
+        self.chunks += 1
+        return super().write(s)
+
+for flat in [pyradox.Tree(('key_%d' % i, i) for i in range(10000)), pyradox.Tree({'group' : list(range(10000))})]:
+    fp = ChunkCounter()
+    pyradox.json.dump_tree(flat, fp)
+    print(fp.chunks > 1, fp.getvalue() == json.dumps(flat.to_python()))
@@ -0,0 +1,26 @@
+import _initpath
+import pyradox
+
+import copy
+import pickle
+
+s = """
+provinces = {
+    -1 = { name = "Stockholm" owner = SWE # capital
+        history = { 1444.11.11 = { owner = SWE } }
+    }
+    -2 = { name = "Uppsala" owner = SWE }
+}
+countries = {
+    SWE = { color = rgb { 1 100 200 } ideas = { 1 2 3 } }
+}
+"""
+
+tree = pyradox.txt.parse(s, lazy = True)
+provinces = tree['provinces']
+print(type(provinces).__name__, provinces.is_parsed)
+print(provinces[-2]['name'], provinces.is_parsed, provinces[-1].is_parsed)
+copied = copy.deepcopy(tree)
+print(str(tree) == str(pyradox.txt.parse(s)))
+print(str(copied) == str(tree))
+print(type(pickle.loads(pickle.dumps(tree))['countries']).__name__)
@@ -0,0 +1,43 @@
+import _initpath
+import pyradox
+import pyradox.filetype.txt
+
+s = """EU4txt
+# comment
+foo = bar # line comment
+list = { 1 2 3 }
+date = 1444.11.11
+quoted = "with spaces"
+name = Göteborg
+color = rgb { 1 100 200 }
+"""
+
+# The whole-buffer lexer should produce the same tokens as the line lexer.
+line_tokens = pyradox.filetype.txt.lex(s.splitlines(), '<string>')
+buffer_tokens = pyradox.filetype.txt.lex_buffer(s, '<string>')
+
+for token in buffer_tokens:
+    print(token)
+
+print(line_tokens == list(buffer_tokens))
+
+# The bytes lexer should too, whatever the line endings and encoding.
+for encoding, line_ending in [('cp1252', '\n'), ('cp1252', '\r\n'), ('utf_8_sig', '\r\n')]:
+    b = s.replace('\n', line_ending).encode(encoding)
+    bytes_tokens = pyradox.filetype.txt.lex_bytes(b, '<bytes>', ['cp1252', 'utf_8_sig'])
+    print(encoding, repr(line_ending), line_tokens == list(bytes_tokens))
+
+# Trailing whitespace on the last line belongs to a comment there, with or without a final line break.
+for end in ['# last   ', '# last   \n\n  ', '"unterminated   \n  \n']:
+    t = s + end
+    line_tokens = pyradox.filetype.txt.lex(t.splitlines(True), '<string>')
+    print(repr(end), line_tokens == list(pyradox.filetype.txt.lex_buffer(t, '<string>')),
+        line_tokens == list(pyradox.filetype.txt.lex_bytes(t.encode('cp1252'), '<bytes>', ['cp1252'])))
+
+# Repeated keys and values are interned, so a parsed tree holds one copy of each.
+tree = pyradox.txt.parse('a = { owner = "ENG" } b = { owner = ENG }')
+print(tree['a'].key_at(0) is tree['b'].key_at(0), tree['a']['owner'] is tree['b']['owner'])
+
+# Free text and comments are not interned, since interned strings are never freed.
+tree = pyradox.txt.parse('a = { name = "Some Name" } # comment text\nb = { name = "Some Name" } # comment text')
+print(tree['a']['name'] is tree['b']['name'], tree.get_line_comment_at(0) is tree.get_line_comment_at(1))
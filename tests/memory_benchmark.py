@@ -0,0 +1,125 @@
+import _initpath
+import pyradox
+
+import gc
+import time
+import tracemalloc
+
+"""
+Measures the memory used by a parsed save-like Tree.
+"""
+
+def make_save(province_count, country_count):
+    # Many small blocks with mostly default operators and few comments, like the provinces and countries in a save.
+    result = 'date = 1444.11.11\nplayer = "ENG"\n'
+    result += 'provinces = {\n'
+    for i in range(province_count):
+        result += '    -%d = { name = "Province %d" owner = ENG controller = ENG core = ENG core = FRA base_tax = %d.000 base_production = 3.000 base_manpower = 2.000 trade_goods = grain\n' % (i, i, i % 10)
+        result += '        discovered_by = { western eastern muslim } flags = { province_flag_%d = 1444.11.11 } history = { 1444.11.11 = { owner = ENG } 1500.1.1 = { owner = FRA controller = FRA } }\n' % i
+        if i % 50 == 0:
+            result += '        # comment %d\n' % i
+        result += '    }\n'
+    result += '}\n'
+    result += 'countries = {\n'
+    for i in range(country_count):
+        result += '    C%02d = { tag = C%02d color = rgb { %d 0 0 } treasury = %d.000 stability = 1.000 prestige >= 10 ideas = { a b c d } }\n' % (i, i, i % 256, i)
+    result += '}\n'
+    return result
+
+def measure(s):
+    """Returns (tree, parse time, bytes allocated for the tree). The tokens are freed, so only what the tree holds is counted."""
+    start = time.perf_counter()
+    tree = pyradox.txt.parse(s)
+    elapsed = time.perf_counter() - start
+    del tree
+
+    gc.collect()
+    tracemalloc.start()
+    tree = pyradox.txt.parse(s)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tree, elapsed, size
+
+class _Item():
+    """An item as Trees stored them before they were column-wise, for comparison."""
+    def __init__(self, key, value, operator, in_group, pre_comments, line_comment):
+        self.key = key
+        self.pre_comments = pre_comments
+        self.line_comment = line_comment
+        self.operator = operator
+        self.in_group = in_group
+        self.value = value
+
+class _ItemTree():
+    def __init__(self):
+        self._data = []
+        self.end_comments = []
+
+def item_layout(tree):
+    """Returns the contents of tree in the _Item layout, sharing its keys and values."""
+    result = _ItemTree()
+    for i, (key, value) in enumerate(tree.items()):
+        if isinstance(value, pyradox.Tree): value = item_layout(value)
+        pre_comments = list(tree._comments[i][0]) if tree._comments and i in tree._comments else []
+        result._data.append(_Item(key, value, tree.get_operator_at(i), bool(tree._groups and tree._groups[i]), pre_comments, tree.get_line_comment_at(i)))
+    result.end_comments = list(tree._end_comments or ())
+    return result
+
+def column_layout(tree):
+    """Returns the contents of tree in a new Tree, sharing its keys and values."""
+    values = [column_layout(value) if isinstance(value, pyradox.Tree) else value for value in tree.values()]
+    result = pyradox.Tree.__new__(pyradox.Tree)
+    result._parent = None
+    result._set_columns((
+        list(tree._keys),
+        values,
+        tree._operators and list(tree._operators),
+        tree._groups and bytearray(tree._groups),
+        tree._comments and {i : [list(pre_comments), line_comment] for i, (pre_comments, line_comment) in tree._comments.items()},
+        tree._end_comments and list(tree._end_comments),
+        ))
+    result._link_values(values)
+    return result
+
+def layout_size(layout, tree):
+    """Returns the bytes allocated by layout(tree), which only counts the structure of the tree since the keys and values are shared."""
+    gc.collect()
+    tracemalloc.start()
+    result = layout(tree)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+def count(tree):
+    """Returns (number of trees, number of items)."""
+    item_count = 0
+    tree_count = 1
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        item_count += len(subtree)
+        for value in subtree.values():
+            if isinstance(value, pyradox.Tree):
+                tree_count += 1
+                stack.append(value)
+    return tree_count, item_count
+
+s = make_save(10000, 500)
+for intern_strings in (True, False):
+    pyradox.config.intern_strings = intern_strings
+    tree, elapsed, size = measure(s)
+    tree_count, item_count = count(tree)
+    del tree
+    print('intern_strings = %s (%d trees, %d items):' % (intern_strings, tree_count, item_count))
+    print('    parse time:      %0.3fs' % elapsed)
+    print('    tree memory:     %0.1f MB' % (size / 1e6))
+    print('    bytes per item:  %0.1f' % (size / item_count))
+pyradox.config.intern_strings = True
+
+tree = pyradox.txt.parse(s)
+tree_count, item_count = count(tree)
+print('structure only (%d trees, %d items):' % (tree_count, item_count))
+for name, layout in (('columns', column_layout), ('_Item objects', item_layout)):
+    print('    %-15s %0.1f bytes per item' % (name + ':', layout_size(layout, tree) / item_count))
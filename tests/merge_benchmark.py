@@ -0,0 +1,66 @@
+import _initpath
+import pyradox
+
+import copy
+import time
+
+"""
+Compares Tree.merge, and the move = True merge used by parse_merge, with the previous scan-and-copy implementation on synthetic inputs.
+"""
+
+def make_technologies(file_count, tech_count):
+    # Like common/technologies: each file adds to the same top-level blocks.
+    result = []
+    for i in range(file_count):
+        s = 'technologies = {\n'
+        for j in range(tech_count):
+            s += '    tech_%d_%d = { research_cost = %d start_year = 1936 path = { leads_to_tech = tech_%d_%d research_cost_coeff = 1 } categories = { infantry_weapons } }\n' % (i, j, j, i, j + 1)
+        s += '}\n'
+        s += 'folder = { name = folder_%d ledger = army }\n' % i
+        result.append(s)
+    return result
+
+def make_states(file_count):
+    # Like history/states: one state per file.
+    result = []
+    for i in range(file_count):
+        result.append('state = { id = %d name = STATE_%d manpower = %d history = { owner = ENG add_core_of = ENG victory_points = { %d 5 } buildings = { infrastructure = 3 %d = { naval_base = 1 } } 1939.1.1 = { owner = GER } } provinces = { %d %d %d } }\n' % (i, i, i * 1000, i, i, i, i + 1, i + 2))
+    return result
+
+def reference_merge_item(tree, key, value, merge_levels):
+    if key in tree and isinstance(tree[key], pyradox.Tree):
+        reference_merge(tree[key], value, merge_levels)
+    else:
+        tree[key] = copy.deepcopy(value)
+
+def reference_merge(tree, other, merge_levels):
+    if merge_levels == 0:
+        # other was deep-copied three times: by merge, by the Tree copy constructor and item by item.
+        copied = other
+        for i in range(3):
+            copied = copy.deepcopy(copied)
+        tree._extend(copied)
+    else:
+        for key, value in other.items():
+            reference_merge_item(tree, key, value, merge_levels - 1)
+
+def time_merge(name, merge_function, trees, merge_levels):
+    result = pyradox.Tree()
+    start = time.perf_counter()
+    for tree in trees:
+        merge_function(result, tree, merge_levels)
+    elapsed = time.perf_counter() - start
+    print('    %-10s %0.3fs' % (name, elapsed))
+    return result
+
+def compare(name, sources, merge_levels):
+    print('%s (%d files, merge_levels = %d):' % (name, len(sources), merge_levels))
+    trees = [pyradox.txt.parse(s) for s in sources]
+    reference = time_merge('reference', reference_merge, trees, merge_levels)
+    merged = time_merge('merge', lambda tree, other, merge_levels: tree.merge(other, merge_levels), trees, merge_levels)
+    moved = time_merge('move', lambda tree, other, merge_levels: tree.merge(other, merge_levels, move = True), trees, merge_levels)
+    print('    identical output: %s' % (str(reference) == str(merged) == str(moved)))
+
+compare('technologies', make_technologies(40, 100), 1)
+compare('states', make_states(1000), 0)
+compare('states', make_states(1000), -1)
@@ -0,0 +1,43 @@
+import _initpath
+import pyradox
+import pyradox.filetype.txt
+
+import time
+
+"""
+Compares the iterative parser used by parse_tree with the recursive TreeParseState on synthetic inputs.
+"""
+
+def make_wide(count):
+    # Many small blocks, like the provinces or countries in a save.
+    return ''.join('id_%d = { owner = ENG controller = FRA infrastructure = %d modifier = { value = 0.500 } history = { add_core_of = ENG } }\n' % (i, i % 10) for i in range(count))
+
+def make_deep(depth, count):
+    # Deeply nested blocks.
+    block = 'leaf = yes'
+    for i in range(depth):
+        block = 'level_%d = { value = %d %s }' % (i, i, block)
+    return '\n'.join([block] * count)
+
+def time_parser(name, parse_function, token_data):
+    start = time.perf_counter()
+    with pyradox.filetype.txt.gc_paused():
+        result = parse_function(token_data)
+    elapsed = time.perf_counter() - start
+    print('    %-16s %0.3fs' % (name, elapsed))
+    return result
+
+def compare(name, s):
+    token_data = pyradox.filetype.txt.lex_buffer(s, name)
+    print('%s (%d tokens):' % (name, len(token_data)))
+    recursive = time_parser('TreeParseState', lambda t: pyradox.filetype.txt.TreeParseState(t, name, 0, True).parse(), token_data)
+    iterative = time_parser('iterative', lambda t: pyradox.filetype.txt.parse_token_stream(t, name), token_data)
+    print('    identical output: %s' % (str(recursive) == str(iterative)))
+
+compare('wide', make_wide(50000))
+compare('deep', make_deep(200, 500))
+
+# Too deep for the recursive parser.
+token_data = pyradox.filetype.txt.lex_buffer(make_deep(20000, 1), 'very deep')
+print('very deep (%d tokens):' % len(token_data))
+time_parser('iterative', lambda t: pyradox.filetype.txt.parse_token_stream(t, 'very deep'), token_data)
@@ -0,0 +1,19 @@
+import _initpath
+import pyradox
+
+s = """
+technologies = {
+    tech_a = { cost = 1 allow = { always = yes } } # first
+    tech_b = { cost = 2 }
+}
+sub_units = {
+    infantry = { speed = 4 group = { 1 2 3 } }
+    cavalry = { speed = 8 }
+}
+ideas = { a b c }
+"""
+
+print(pyradox.txt.parse(s, projection = ['technologies']))
+print(pyradox.txt.parse(s, projection = ['sub_units/infantry', 'ideas']))
+print(pyradox.txt.parse(s, projection = [('*', '*', 'speed')]))
+print(pyradox.txt.parse(s, projection = lambda path: len(path) < 3))
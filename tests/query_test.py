@@ -0,0 +1,44 @@
+import _initpath
+import pyradox
+
+tree = pyradox.parse('''
+state = {
+    id = 1
+    history = {
+        buildings = { infrastructure = 3 1234 = { naval_base = 2 } 1235 = { naval_base = 5 bunker = 1 } }
+        victory_points = { 1234 5 }
+        victory_points = { 1235 10 }
+        1936.1.1 = { owner = GER }
+    }
+}
+state = {
+    id = 2
+    history = {
+        buildings = { 99 = { naval_base = 1 } }
+        1939.5.1 = { owner = SOV }
+    }
+}
+''')
+
+print(list(tree.select('state/*/buildings/#int/naval_base')))
+print(list(tree.select('**/naval_base')), list(tree.select('**/buildings/*[#tree][bunker]/naval_base')))
+print(list(tree.select('state[id = 2]/history/#date/owner')), list(tree.select('State/History/1936.*/owner')))
+print(list(tree.select('**/naval_base[>=2]')), list(tree.select('**/victory_points{2}')))
+
+# Grouping is as find_all(tuple_length = n), so groups may span several trees.
+grouped = pyradox.parse('a = { x = 1 x = 2 x = 3 } b = { x = 4 x = 5 }')
+print(list(grouped.select('*/x{2}')), list(grouped.find_all('x', tuple_length = 2, recurse = True)))
+
+# A compiled query can be reused over several trees.
+query = pyradox.datatype.query.compile_query('**/owner')
+print(list(query.select(tree, tree['state'])), query is pyradox.datatype.query.compile_query('**/owner'))
+
+for bad_query in ['a//b', 'a{2}/b', '#foo', 'a[x y]']:
+    try:
+        pyradox.datatype.query.compile_query(bad_query)
+    except pyradox.error.ParseError as e:
+        print(e)
+
+# Keys that are falsy, such as 0, are still keys in comparison predicates.
+tree = pyradox.txt.parse('a = { 0 = 5 x = 1 } a = { 0 = 6 x = 2 } b = 0')
+print(list(pyradox.datatype.query.compile_query('a[0 = 5]/x').select(tree)), list(tree.select('b[= 0]')))
@@ -0,0 +1,68 @@
+import _initpath
+import pyradox
+
+s = """
+owner = ENG
+core = ENG
+1450.1.1 = { owner = FRA core = FRA }
+1500.1.1 = { owner = BUR }
+buildings = { temple = yes workshop = yes }
+"""
+
+tree = pyradox.txt.parse(s)
+snapshot = tree.at_time('1460.1.1')
+print(snapshot)
+
+# The snapshot is independent of the original.
+snapshot['buildings']['marketplace'] = 'yes'
+tree['buildings']['temple'] = 'no'
+print(snapshot['buildings'])
+print(tree['buildings'])
+
+copied = pyradox.Tree(tree)
+copied.find(pyradox.Time('1500.1.1'))['owner'] = 'ENG'
+print(tree.find(pyradox.Time('1500.1.1')), copied.find(pyradox.Time('1500.1.1')))
+
+# References to subtrees of the original taken before a copy still belong to the original, and do not affect the copy.
+tree = pyradox.txt.parse('a = { b = 1 } history = { buildings = { infra = 1 } 1450.1.1 = { owner = FRA } }')
+a = tree['a']
+buildings = tree['history']['buildings']
+added = tree + pyradox.Tree()
+copied = pyradox.Tree(tree)
+snapshot = tree['history'].at_time('1460.1.1')
+tree['a']['b'] = 2
+buildings['infra'] = 99
+print(a['b'], tree['history']['buildings']['infra'])
+print(added['a']['b'], copied['a']['b'], added['history']['buildings']['infra'], snapshot['buildings']['infra'])
+
+# Snapshots taken by History share their contents with each other, but not with the original tree or one another's changes.
+history = pyradox.History(tree['history'])
+first = history.snapshot('1460.1.1')
+second = history.snapshot('1460.1.1')
+first['buildings']['infra'] = 5
+print(first['buildings']['infra'], second['buildings']['infra'], tree['history']['buildings']['infra'])
+
+# Copies are made by copy-on-write: the original copies its columns for its copies when it or a tree containing it is next modified.
+tree = pyradox.txt.parse('a = { b = { c = 1 } } d = 2')
+c = tree['a']['b']
+copied = pyradox.Tree(tree)
+c['c'] = 2
+tree.set_pre_comments_at(1, ['comment'])
+tree.end_comments.append('end')
+print(copied)
+copied['a']['b']['c'] = 3
+print(tree)
+
+# A subtree that is a value of several trees keeps the copies of each as they were.
+shared = pyradox.txt.parse('c = 1')
+first = pyradox.Tree([('s', shared)])
+second = pyradox.Tree([('s', shared)])
+copied = pyradox.Tree(first)
+second['s']['c'] = 2
+print(copied['s']['c'], first['s']['c'])
+
+# apply_defines only copies the subtrees that contain substitutions.
+tree = pyradox.txt.parse('@x = 5 a = { b = @x } c = { d = { e = 1 } }')
+result = tree.apply_defines()
+tree['a']['b'] = 0
+print(result['a']['b'], type(result._values[2]).__name__)
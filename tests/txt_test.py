@@ -35,3 +35,14 @@ list2 = {1 2 3}
 """)
 
 print(result)
+
+# Comments can be added through item_comments, as through get_pre_comments_at.
+result = pyradox.parse('a = 1 # line comment\nb = 2')
+for pre_comments, line_comment in result.item_comments():
+    pre_comments.append(' added pre comment')
+print(result)
+
+# Reading comments does not add entries for items without them.
+result = pyradox.parse('a = 1 # line comment\nb = 2')
+for pre_comments, line_comment in result.item_comments(): pass
+print(len(result.get_pre_comments_at(1)), result._comments)
@@ -0,0 +1,53 @@
+import _initpath
+import pyradox.worldmap
+
+import numpy
+
+# A synthetic map, so that no game files are needed.
+raster = numpy.array([
+    [1, 1, 2, 2, 3, 3],
+    [1, 1, 2, 2, 3, 3],
+    [4, 4, 4, 5, 5, 3],
+    [4, 4, 4, 5, 5, 1],
+    ], dtype = numpy.uint16)
+
+province_map = pyradox.worldmap.ProvinceMap.__new__(pyradox.worldmap.ProvinceMap)
+province_map.province_raster = raster
+province_map.province_color_by_id = { province_id : (province_id, 0, 0) for province_id in range(1, 7) }
+province_map._adjacency = {}
+province_map._cache_path = None
+
+province_map._compute_province_extents()
+print(province_map.province_sizes)
+print(province_map.positions['centroid'])
+print(province_map.province_bounding_boxes)
+
+# Compare with each province's pixels found directly.
+def extents(province_id):
+    ys, xs = numpy.nonzero(raster == province_id)
+    return len(xs), (xs.mean(), ys.mean()), (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+print(all(extents(province_id) == (province_map.province_sizes[province_id], province_map.positions['centroid'][province_id], province_map.province_bounding_boxes[province_id]) for province_id in range(1, 6)))
+
+# Neighbors and border lengths, i.e. the number of pixel sides shared.
+for wrap_x in (False, True):
+    indptr, indices, border_lengths = province_map.adjacency_graph(wrap_x)
+    for province_id in range(1, 7):
+        start, end = indptr[province_id], indptr[province_id + 1]
+        print(wrap_x, province_id, province_map.get_adjacent(province_id, wrap_x), dict(zip(indices[start:end].tolist(), border_lengths[start:end].tolist())))
+print(province_map.get_adjacent(0), province_map.get_adjacent(99))
+
+# Edges between provinces.
+print(pyradox.worldmap.edge_mask(raster).astype(int))
+print(pyradox.worldmap.edge_mask(raster, 3).astype(int))
+
+# Compare with each pixel's neighborhood examined directly.
+def neighborhood_edge_mask(labels, edge_width):
+    radius = edge_width // 2
+    height, width = labels.shape
+    return numpy.array([[len(numpy.unique(labels[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1])) > 1 for x in range(width)] for y in range(height)])
+print([bool((pyradox.worldmap.edge_mask(raster, edge_width) == neighborhood_edge_mask(raster, edge_width)).all()) for edge_width in (3, 5, 9)])
+
+try:
+    pyradox.worldmap.edge_mask(raster, 4)
+except ValueError as e:
+    print(e)
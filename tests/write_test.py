@@ -0,0 +1,39 @@
+import _initpath
+import pyradox
+
+import io
+
+tree = pyradox.parse('''
+# comment
+a = 1 # line comment
+b = { c = "quoted string" d = 1.5 e = yes }
+group = { 1 2
+    # pre comment
+    3 { f = 1 } 4 }
+1444.11.11 = { owner = FRA }
+# end comment
+''')
+
+# write and pyradox.txt.dump produce the same output as prettyprint.
+for level, indent_string, include_comments in [(0, '    ', True), (1, '\t', True), (0, '  ', False)]:
+    s = io.StringIO()
+    tree.write(s, level, indent_string, include_comments)
+    print(s.getvalue() == tree.prettyprint(level, indent_string, include_comments))
+
+s = io.StringIO()
+pyradox.txt.dump(tree, s)
+print(s.getvalue())
+
+# Output is written in chunks however it is made up, e.g. a flat tree or a large group with no Tree values.
+class ChunkCounter(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.chunks = 0
+    def write(self, s):
+        self.chunks += 1
+        return super().write(s)
+
+for flat in [pyradox.Tree(('key_%d' % i, i) for i in range(10000)), pyradox.Tree({'group' : list(range(10000))})]:
+    s = ChunkCounter()
+    flat.write(s)
+    print(s.chunks > 1, s.getvalue() == flat.prettyprint())